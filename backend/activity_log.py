@@ -0,0 +1,321 @@
+import logging
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, case, func, select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine, session_scope
+from metrics import timed_db
+from models import User, EmailLog, ActivityRollup, get_or_create_user
+
+logger = logging.getLogger(__name__)
+
+# Keep IN (...) lists well under every backend's bound-parameter limit
+IN_CLAUSE_CHUNK = 500
+
+
+def _chunks(items: List[str], size: int = IN_CLAUSE_CHUNK) -> Iterable[List[str]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+GMAIL_CATEGORY_LABELS = {
+    'CATEGORY_PROMOTIONS': 'promotions',
+    'CATEGORY_SOCIAL': 'social',
+    'CATEGORY_UPDATES': 'updates',
+    'CATEGORY_FORUMS': 'forums',
+}
+
+
+def email_category(labels: Optional[List[str]]) -> str:
+    """Bucket an email by its Gmail category tab."""
+    for label in labels or []:
+        if label in GMAIL_CATEGORY_LABELS:
+            return GMAIL_CATEGORY_LABELS[label]
+    return 'primary'
+
+
+def _dialect_insert():
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+def _log_day(value) -> date:
+    """Normalize date(created_at) as SQLite (a string) or PostgreSQL (a date) returns it."""
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _log_day_expr(table=None):
+    # Rollups are keyed by the day a message was first logged, in the database's own
+    # date(); incremental updates and rebuild_rollups must agree on it
+    created_at = EmailLog.created_at if table is None else table.c.created_at
+    return func.date(created_at)
+
+
+def _insert_ignoring_duplicates(db, user_id: int, rows: List[dict]) -> List[Tuple[str, str, bool, date]]:
+    """INSERT rows, skipping any (user_id, message_id) already logged.
+
+    Returns (message_id, category, moved_to_gator, day) for the rows actually written, so
+    a concurrent request logging the same messages doesn't count them a second time.
+    """
+    table = EmailLog.__table__
+    insert = _dialect_insert()
+    if insert is None:
+        existing = set()
+        for chunk in _chunks([row["message_id"] for row in rows]):
+            existing.update(message_id for (message_id,) in db.query(EmailLog.message_id).filter(
+                EmailLog.user_id == user_id,
+                EmailLog.message_id.in_(chunk)
+            ))
+        rows = [row for row in rows if row["message_id"] not in existing]
+        if not rows:
+            return []
+        db.execute(table.insert(), rows)
+        days = {}
+        for chunk in _chunks([row["message_id"] for row in rows]):
+            days.update(db.execute(select(table.c.message_id, _log_day_expr(table)).where(
+                table.c.user_id == user_id,
+                table.c.message_id.in_(chunk)
+            )).all())
+        return [
+            (row["message_id"], row["category"], row["moved_to_gator"], _log_day(days[row["message_id"]]))
+            for row in rows
+        ]
+    stmt = insert(table).on_conflict_do_nothing(index_elements=["user_id", "message_id"]).returning(
+        table.c.message_id, table.c.category, table.c.moved_to_gator, _log_day_expr(table)
+    )
+    return [
+        (message_id, category, moved, _log_day(day))
+        for message_id, category, moved, day in db.execute(stmt, rows)
+    ]
+
+
+def _mark_moved(db, user_id: int, message_ids: List[str]) -> List[Tuple[str, str, date]]:
+    """Flag logged messages as moved; returns (message_id, category, day) for those not already moved."""
+    table = EmailLog.__table__
+    changed = []
+    for chunk in _chunks(message_ids):
+        condition = and_(
+            table.c.user_id == user_id,
+            table.c.message_id.in_(chunk),
+            table.c.moved_to_gator.isnot(True)
+        )
+        stmt = update(table).where(condition).values(moved_to_gator=True)
+        columns = (table.c.message_id, table.c.category, _log_day_expr(table))
+        if db.get_bind().dialect.update_returning:
+            rows = db.execute(stmt.returning(*columns)).all()
+        else:
+            rows = db.execute(select(*columns).where(condition).with_for_update()).all()
+            db.execute(stmt)
+        changed.extend((message_id, category, _log_day(day)) for message_id, category, day in rows)
+    return changed
+
+
+def _add_to_rollups(db, user_id: int, processed: Counter, moved: Counter) -> None:
+    """Increment the (user, day, category) rollup rows inside the caller's transaction.
+
+    Both counters are keyed by (day, category).
+    """
+    for day, category in set(processed) | set(moved):
+        values = {
+            "user_id": user_id,
+            "day": day,
+            "category": category,
+            "emails_processed": processed.get((day, category), 0),
+            "moved_to_gator": moved.get((day, category), 0)
+        }
+        insert = _dialect_insert()
+        if insert is not None:
+            stmt = insert(ActivityRollup).values(**values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["user_id", "day", "category"],
+                set_={
+                    "emails_processed": ActivityRollup.emails_processed + stmt.excluded.emails_processed,
+                    "moved_to_gator": ActivityRollup.moved_to_gator + stmt.excluded.moved_to_gator
+                }
+            )
+            db.execute(stmt)
+            continue
+        rollup = db.query(ActivityRollup).filter(
+            ActivityRollup.user_id == user_id,
+            ActivityRollup.day == day,
+            ActivityRollup.category == category
+        ).with_for_update().first()
+        if rollup is None:
+            db.add(ActivityRollup(**values))
+        else:
+            rollup.emails_processed += values["emails_processed"]
+            rollup.moved_to_gator += values["moved_to_gator"]
+
+
+@timed_db('log_email_activities')
+def log_email_activities(email: str, entries: Iterable[Dict[str, Any]],
+                         db: Optional[Session] = None) -> Dict[str, int]:
+    """Log emails for one user in a single transaction.
+
+    Each entry has message_id, moved and optionally category. Messages already
+    logged are not duplicated; a message only counts towards the moved totals
+    the first time it is logged as moved. User counters and daily rollups are
+    updated in the same transaction, on `db` when a request passes its session.
+    """
+    moved_by_id: Dict[str, bool] = {}
+    category_by_id: Dict[str, str] = {}
+    for entry in entries:
+        message_id = entry["message_id"]
+        moved_by_id[message_id] = moved_by_id.get(message_id, False) or bool(entry.get("moved"))
+        category_by_id.setdefault(message_id, entry.get("category") or "primary")
+    if not moved_by_id:
+        return {"inserted": 0, "newly_moved": 0}
+
+    with session_scope(db) as db:
+        try:
+            logger.debug(f"Logging activity for {len(moved_by_id)} emails for {email}")
+            user = get_or_create_user(db, email)
+            rows = [
+                {
+                    "user_id": user.id,
+                    "message_id": message_id,
+                    "moved_to_gator": moved,
+                    "category": category_by_id[message_id]
+                }
+                for message_id, moved in moved_by_id.items()
+            ]
+            # Count only what the writes changed; a read taken beforehand can be stale by now
+            inserted = _insert_ignoring_duplicates(db, user.id, rows)
+            inserted_ids = {message_id for message_id, _, _, _ in inserted}
+            # Rollups follow the day and category the message was first logged under
+            moved_existing = _mark_moved(db, user.id, [
+                message_id for message_id, moved in moved_by_id.items()
+                if moved and message_id not in inserted_ids
+            ])
+
+            processed_by_bucket = Counter((day, category or 'primary') for _, category, _, day in inserted)
+            moved_by_bucket = Counter((day, category or 'primary') for _, category, moved, day in inserted if moved)
+            moved_by_bucket.update((day, category or 'primary') for _, category, day in moved_existing)
+            newly_moved = sum(moved_by_bucket.values())
+
+            if inserted or newly_moved:
+                db.execute(
+                    update(User)
+                    .where(User.id == user.id)
+                    .values(
+                        total_emails_processed=User.total_emails_processed + len(inserted),
+                        total_moved_to_gator=User.total_moved_to_gator + newly_moved
+                    )
+                )
+                _add_to_rollups(db, user.id, processed_by_bucket, moved_by_bucket)
+
+            db.commit()
+            logger.debug(f"Logged {len(inserted)} new emails ({newly_moved} newly moved) for {email}")
+            return {"inserted": len(inserted), "newly_moved": newly_moved}
+
+        except Exception as e:
+            logger.error(f"Error logging email activity: {str(e)}")
+            db.rollback()
+            raise
+
+
+def log_email_activity(email: str, message_id: str, moved: bool, category: Optional[str] = None,
+                       db: Optional[Session] = None) -> Dict[str, int]:
+    return log_email_activities(email, [{"message_id": message_id, "moved": moved, "category": category}], db=db)
+
+
+@timed_db('get_user_stats')
+def get_user_stats(email: str, days: int = 14, db: Optional[Session] = None) -> Dict[str, Any]:
+    """Read counters and per-day/category trends from the rollups (no scan of email_logs)."""
+    with session_scope(db) as db:
+        user = get_or_create_user(db, email)
+        db.commit()
+
+        since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+        rollups = db.query(ActivityRollup).filter(
+            ActivityRollup.user_id == user.id,
+            ActivityRollup.day >= since
+        ).order_by(ActivityRollup.day).all()
+
+        trends: Dict[str, Dict[str, Any]] = {}
+        for rollup in rollups:
+            bucket = trends.setdefault(rollup.day.isoformat(), {
+                "day": rollup.day.isoformat(),
+                "emails_processed": 0,
+                "moved_to_gator": 0,
+                "categories": {}
+            })
+            bucket["emails_processed"] += rollup.emails_processed
+            bucket["moved_to_gator"] += rollup.moved_to_gator
+            bucket["categories"][rollup.category] = {
+                "emails_processed": rollup.emails_processed,
+                "moved_to_gator": rollup.moved_to_gator
+            }
+
+        return {
+            "total_moved_to_gator": user.total_moved_to_gator or 0,
+            "total_emails_processed": user.total_emails_processed or 0,
+            "email": email,
+            "trends": list(trends.values())
+        }
+
+
+def rebuild_rollups(email: Optional[str] = None) -> int:
+    """Recompute user counters and daily rollups from raw email_logs.
+
+    Rebuilds every user, or only `email` when given. Returns the number of users rebuilt.
+    """
+    db = SessionLocal()
+    try:
+        users_query = db.query(User)
+        if email:
+            users_query = users_query.filter(User.email == email)
+        users = users_query.all()
+
+        # date() works on both SQLite and PostgreSQL timestamps
+        day_expr = _log_day_expr()
+        for user in users:
+            logger.info(f"Rebuilding stats for {user.email}")
+            db.query(ActivityRollup).filter(ActivityRollup.user_id == user.id).delete(synchronize_session=False)
+
+            rows = db.query(
+                day_expr,
+                func.coalesce(EmailLog.category, 'primary'),
+                func.count(EmailLog.id),
+                func.sum(case((EmailLog.moved_to_gator.is_(True), 1), else_=0))
+            ).filter(EmailLog.user_id == user.id).group_by(
+                day_expr, func.coalesce(EmailLog.category, 'primary')
+            ).all()
+
+            total_processed = 0
+            total_moved = 0
+            for day, category, processed, moved in rows:
+                db.add(ActivityRollup(
+                    user_id=user.id,
+                    day=_log_day(day),
+                    category=category,
+                    emails_processed=processed,
+                    moved_to_gator=moved or 0
+                ))
+                total_processed += processed
+                total_moved += moved or 0
+
+            user.total_emails_processed = total_processed
+            user.total_moved_to_gator = total_moved
+
+        db.commit()
+        return len(users)
+    except Exception as e:
+        logger.error(f"Error rebuilding stats: {str(e)}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
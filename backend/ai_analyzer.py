@@ -1,23 +1,55 @@
+import asyncio
 import os
 import requests
 import logging
 import json
+import httpx
+from async_io import get_http_client
+from metrics import LLM_DURATION, record_llm_usage, timed
+from outbound import RETRYABLE_STATUSES, OutboundError, get_upstream
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever either prompt or parser changes so cached analyses are recomputed
+PROMPT_VERSION = "2"
+
+# Rough chars-per-token ratio for budgeting; avoids shipping a tokenizer
+CHARS_PER_TOKEN = 4
+BATCH_PREAMBLE_TOKENS = 250
+
+class UpstreamUnavailable(ValueError):
+    """OpenRouter failed in a way that may pass: throttled, overloaded or unreachable."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def upstream_failure(e: Exception) -> ValueError:
+    """The ValueError callers get for a failed OpenRouter call; transient ones are UpstreamUnavailable."""
+    message = f"OpenRouter API failed: {e}"
+    if isinstance(e, OutboundError):
+        return UpstreamUnavailable(message, e.retry_after)
+    response = getattr(e, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status in RETRYABLE_STATUSES or isinstance(e, (httpx.TransportError, requests.ConnectionError, requests.Timeout)):
+        return UpstreamUnavailable(message)
+    return ValueError(message)
+
+
 class AIAnalyzer:
     def __init__(self):
         self.api_key = os.getenv("OPENROUTER_API_KEY")
         if not self.api_key:
             raise ValueError("Missing OPENROUTER_API_KEY in .env")
 
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
-        self.model = "mistralai/mistral-7b-instruct"  # free model
-
-    def analyze_email(self, subject: str, content: str, from_address: str) -> dict:
-        if not content:
-            raise ValueError("Email content is empty")
+        self.api_url = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+        self.model = os.getenv("OPENROUTER_MODEL", "mistralai/mistral-7b-instruct")  # free model
+        self.prompt_version = PROMPT_VERSION
+        self.batch_token_budget = int(os.getenv("ANALYSIS_BATCH_TOKEN_BUDGET", "6000"))
+        self.batch_max_emails = int(os.getenv("ANALYSIS_BATCH_MAX_EMAILS", "10"))
 
+    def _build_payload(self, subject: str, content: str, from_address: str) -> dict:
         prompt = f"""
 Analyze the following email:
 
@@ -35,34 +67,139 @@ Return:
 5. Should it be moved to trash? (yes/no with reason)
 """
 
-        payload = {
+        return {
             "model": self.model,
             "messages": [
                 {"role": "user", "content": prompt}
             ]
         }
 
-        headers = {
+    def _headers(self) -> dict:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
             "HTTP-Referer": "http://localhost:5173",  # optional, shows up on OpenRouter stats
             "X-Title": "Gmail-AI-Assistant"           # optional
         }
 
+    def analyze_email(self, subject: str, content: str, from_address: str) -> dict:
+        if not content:
+            raise ValueError("Email content is empty")
+
+        payload = self._build_payload(subject, content, from_address)
+
         try:
             logger.debug("Sending prompt to OpenRouter")
-            response = requests.post(
-                url=self.api_url,
-                headers=headers,
-                data=json.dumps(payload)
-            )
-            response.raise_for_status()
-            content = response.json()["choices"][0]["message"]["content"]
+            openrouter = get_upstream("openrouter")
+            with timed(LLM_DURATION, model=self.model, operation="analyze"):
+                response = openrouter.call(lambda: requests.post(
+                    url=self.api_url,
+                    headers=self._headers(),
+                    data=json.dumps(payload),
+                    timeout=openrouter.timeout
+                ), operation="chat.completions")
+                response.raise_for_status()
+            body = response.json()
+            record_llm_usage(self.model, "analyze", body.get("usage"))
+            content = body["choices"][0]["message"]["content"]
+            logger.debug(f"OpenRouter Response: {content[:200]}")
+            return self._parse_response(content)
+        except (requests.RequestException, OutboundError) as e:
+            logger.error(f"OpenRouter API error: {e}")
+            raise upstream_failure(e)
+
+    async def analyze_email_async(self, subject: str, content: str, from_address: str) -> dict:
+        """Same as analyze_email, but awaits OpenRouter on the shared keep-alive client."""
+        if not content:
+            raise ValueError("Email content is empty")
+
+        payload = self._build_payload(subject, content, from_address)
+
+        try:
+            logger.debug("Sending prompt to OpenRouter (async)")
+            openrouter = get_upstream("openrouter")
+            with timed(LLM_DURATION, model=self.model, operation="analyze"):
+                response = await openrouter.call_async(lambda: get_http_client().post(
+                    self.api_url,
+                    headers=self._headers(),
+                    json=payload,
+                    timeout=openrouter.timeout
+                ), operation="chat.completions")
+                response.raise_for_status()
+            body = response.json()
+            record_llm_usage(self.model, "analyze", body.get("usage"))
+            content = body["choices"][0]["message"]["content"]
             logger.debug(f"OpenRouter Response: {content[:200]}")
             return self._parse_response(content)
-        except requests.RequestException as e:
+        except (httpx.HTTPError, OutboundError) as e:
             logger.error(f"OpenRouter API error: {e}")
-            raise ValueError(f"OpenRouter API failed: {e}")
+            raise upstream_failure(e)
+
+    async def analyze_email_stream(self, subject: str, content: str, from_address: str):
+        """Stream the completion as it is generated.
+
+        Yields ("token", text) for each content delta, then one ("result", analysis)
+        parsed from the full text, exactly as analyze_email would return it.
+        """
+        if not content:
+            raise ValueError("Email content is empty")
+
+        payload = self._build_payload(subject, content, from_address)
+        payload["stream"] = True
+
+        parts = []
+        try:
+            logger.debug("Streaming prompt to OpenRouter")
+            openrouter = get_upstream("openrouter")
+            client = get_http_client()
+            request = client.build_request(
+                "POST", self.api_url, headers=self._headers(), json=payload, timeout=openrouter.timeout
+            )
+            # Retries only happen before the first byte; a stream cut off midway is an error
+            with timed(LLM_DURATION, model=self.model, operation="analyze_stream"):
+                response = await openrouter.call_async(
+                    lambda: client.send(request, stream=True), operation="chat.completions"
+                )
+                try:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        # OpenRouter sends SSE: "data: {...}" lines, ": comments" while queued, then [DONE]
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            chunk = json.loads(data)
+                            # The final chunk carries the token usage, with or without a delta
+                            record_llm_usage(self.model, "analyze_stream", chunk.get("usage"))
+                            delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                        except (ValueError, KeyError, IndexError, AttributeError) as e:
+                            logger.warning(f"Skipping malformed stream chunk: {e}")
+                            continue
+                        if delta:
+                            parts.append(delta)
+                            yield "token", delta
+                except httpx.HTTPStatusError:
+                    # Already settled by call_async from the status code
+                    raise
+                except Exception:
+                    # Cut off midway by the upstream or the transport
+                    openrouter.record_stream(False)
+                    raise
+                except BaseException:
+                    # Cancelled, or the client disconnected and the generator was closed
+                    openrouter.release_stream()
+                    raise
+                finally:
+                    await response.aclose()
+        except (httpx.HTTPError, OutboundError) as e:
+            logger.error(f"OpenRouter API error: {e}")
+            raise upstream_failure(e)
+
+        raw = "".join(parts)
+        logger.debug(f"OpenRouter streamed response: {raw[:200]}")
+        yield "result", self._parse_response(raw)
 
     def _parse_response(self, raw: str) -> dict:
         """Parse OpenRouter output into structure used by frontend."""
@@ -92,4 +229,134 @@ Return:
                 result["key_points"].append(line.split(":", 1)[-1].strip())
             elif "action items" in line:
                 result["action_items"].append(line.split(":", 1)[-1].strip())
-        return result 
\ No newline at end of file
+        return result 
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        return len(text or "") // CHARS_PER_TOKEN + 1
+
+    def pack_batches(self, emails: list) -> list:
+        """Group emails into prompts that stay under the token budget.
+
+        Each email is a dict with id, subject, from and content. An email larger than
+        the budget on its own has its body truncated to fit.
+        """
+        per_email_budget = self.batch_token_budget - BATCH_PREAMBLE_TOKENS
+        batches = []
+        current = []
+        current_tokens = 0
+        for email in emails:
+            header_tokens = self.estimate_tokens(email["subject"]) + self.estimate_tokens(email["from"]) + 10
+            body_budget = max(per_email_budget - header_tokens, 1)
+            content = email["content"]
+            if self.estimate_tokens(content) > body_budget:
+                content = content[:body_budget * CHARS_PER_TOKEN]
+                email = dict(email, content=content)
+            tokens = header_tokens + self.estimate_tokens(content)
+            if current and (current_tokens + tokens > per_email_budget or len(current) >= self.batch_max_emails):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(email)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _build_batch_payload(self, emails: list) -> dict:
+        sections = []
+        for index, email in enumerate(emails, start=1):
+            sections.append(
+                f"### E{index}\nSubject: {email['subject']}\nFrom: {email['from']}\n\nBody:\n{email['content']}"
+            )
+        prompt = (
+            "Analyze each of the following emails.\n\n"
+            "Reply with only a JSON array containing one object per email, in any order, with keys:\n"
+            '"id" (the E-number, e.g. "E1"), "topic", "sentiment" (positive, neutral, or negative), '
+            '"priority" (high, medium, low), "category" (important, promotional, spam, social, updates), '
+            '"should_trash" (true or false), "key_points" (list of strings), "action_items" (list of strings).\n\n'
+            + "\n\n".join(sections)
+        )
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ]
+        }
+
+    def _parse_batch_response(self, raw: str, emails: list) -> dict:
+        """Split the model's JSON array back into per-message results keyed by message id."""
+        start = raw.find("[")
+        end = raw.rfind("]")
+        if start == -1 or end <= start:
+            raise ValueError("Batch response did not contain a JSON array")
+        items = json.loads(raw[start:end + 1])
+
+        results = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            ref = str(item.get("id", "")).strip().upper().lstrip("E")
+            if not ref.isdigit() or not 1 <= int(ref) <= len(emails):
+                continue
+            message_id = emails[int(ref) - 1]["id"]
+            should_trash = item.get("should_trash", False)
+            if isinstance(should_trash, str):
+                should_trash = should_trash.strip().lower().startswith(("yes", "true"))
+            results[message_id] = {
+                "topic": str(item.get("topic", "")).strip().lower(),
+                "sentiment": str(item.get("sentiment", "")).strip().lower(),
+                "priority": str(item.get("priority", "")).strip().lower(),
+                "category": str(item.get("category", "other")).strip().lower() or "other",
+                "should_trash": bool(should_trash),
+                "key_points": [str(point) for point in item.get("key_points", []) or []],
+                "action_items": [str(action) for action in item.get("action_items", []) or []]
+            }
+        return results
+
+    async def analyze_batch_async(self, emails: list) -> dict:
+        """Analyze one packed group of emails in a single completion.
+
+        Returns results keyed by message id. Emails the model skipped, or every email
+        when the reply cannot be parsed, fall back to one completion each; a fallback
+        that fails is returned as {"error": detail} for its id.
+        """
+        results = {}
+        if len(emails) > 1:
+            payload = self._build_batch_payload(emails)
+            try:
+                logger.debug(f"Sending batch of {len(emails)} emails to OpenRouter")
+                openrouter = get_upstream("openrouter")
+                with timed(LLM_DURATION, model=self.model, operation="analyze_batch"):
+                    response = await openrouter.call_async(lambda: get_http_client().post(
+                        self.api_url,
+                        headers=self._headers(),
+                        json=payload,
+                        timeout=openrouter.timeout
+                    ), operation="chat.completions")
+                    response.raise_for_status()
+                body = response.json()
+                record_llm_usage(self.model, "analyze_batch", body.get("usage"))
+                content = body["choices"][0]["message"]["content"]
+                results = self._parse_batch_response(content, emails)
+            except (httpx.HTTPError, OutboundError) as e:
+                logger.error(f"OpenRouter API error: {e}")
+                raise upstream_failure(e)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Could not parse batch analysis, falling back to per-email: {e}")
+
+        # One failed fallback must not throw away what the batch already answered
+        skipped = [email for email in emails if email["id"] not in results]
+        fallbacks = await asyncio.gather(
+            *(self.analyze_email_async(email["subject"], email["content"], email["from"]) for email in skipped),
+            return_exceptions=True
+        )
+        for email, outcome in zip(skipped, fallbacks):
+            if isinstance(outcome, (ValueError, OutboundError)):
+                logger.error(f"Fallback analysis failed for {email['id']}: {outcome}")
+                results[email["id"]] = {"error": str(outcome)}
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                results[email["id"]] = outcome
+        return results
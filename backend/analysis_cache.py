@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from database import SessionLocal
+from metrics import DB_DURATION, timed
+from models import AnalysisCacheEntry, User, get_or_create_user
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(subject: str, from_address: str, content: str) -> str:
+    """Hash of everything that goes into the analysis prompt."""
+    digest = hashlib.sha256()
+    for part in (subject, from_address, content):
+        digest.update((part or '').encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """Two-tier cache of LLM analyses: in-process LRU in front of the analysis_cache table.
+
+    Entries are keyed on (user, message id, model, prompt version) and record the
+    content hash they were computed from, so a model or prompt change is a miss
+    and a hash mismatch is treated as stale.
+    """
+
+    def __init__(self, model: str, prompt_version: str, max_entries: Optional[int] = None):
+        self.model = model
+        self.prompt_version = prompt_version
+        self.max_entries = max_entries or int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '5000'))
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _memory_key(self, user_email: str, message_id: str) -> Tuple[str, str]:
+        return (user_email, f"{message_id}|{self.model}|{self.prompt_version}")
+
+    def _remember(self, user_email: str, message_id: str, digest: str, result: Dict[str, Any]) -> None:
+        key = self._memory_key(user_email, message_id)
+        with self._lock:
+            self._entries[key] = (digest, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_memory(self, user_email: str, message_id: str,
+                   digest: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """In-process lookup only; cheap enough to call on the event loop."""
+        key = self._memory_key(user_email, message_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (digest is not None and entry[0] != digest):
+                return None
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return dict(entry[1])
+
+    def get(self, user_email: str, message_id: str, digest: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """LRU first, then the database. Pass `digest` to reject entries computed from other content.
+
+        Read-only: a user with no row yet simply has nothing cached.
+        """
+        cached = self.get_memory(user_email, message_id, digest)
+        if cached is not None:
+            return cached
+
+        with timed(DB_DURATION, operation='analysis_cache.get'):
+            db = SessionLocal()
+            try:
+                entry = db.query(AnalysisCacheEntry).join(User, User.id == AnalysisCacheEntry.user_id).filter(
+                    User.email == user_email,
+                    AnalysisCacheEntry.message_id == message_id,
+                    AnalysisCacheEntry.model == self.model,
+                    AnalysisCacheEntry.prompt_version == self.prompt_version
+                ).first()
+                if entry is None or (digest is not None and entry.content_hash != digest):
+                    with self._lock:
+                        self.misses += 1
+                    return None
+                result = json.loads(entry.result)
+                self._remember(user_email, message_id, entry.content_hash, result)
+                with self._lock:
+                    self.db_hits += 1
+                return dict(result)
+            finally:
+                db.close()
+
+    def put(self, user_email: str, message_id: str, digest: str, result: Dict[str, Any]) -> None:
+        self._remember(user_email, message_id, digest, result)
+        with timed(DB_DURATION, operation='analysis_cache.put') as labels:
+            db = SessionLocal()
+            try:
+                user = get_or_create_user(db, user_email)
+                entry = db.query(AnalysisCacheEntry).filter(
+                    AnalysisCacheEntry.user_id == user.id,
+                    AnalysisCacheEntry.message_id == message_id,
+                    AnalysisCacheEntry.model == self.model,
+                    AnalysisCacheEntry.prompt_version == self.prompt_version
+                ).first()
+                if entry is None:
+                    entry = AnalysisCacheEntry(
+                        user_id=user.id,
+                        message_id=message_id,
+                        model=self.model,
+                        prompt_version=self.prompt_version
+                    )
+                    db.add(entry)
+                entry.content_hash = digest
+                entry.result = json.dumps(result)
+                db.commit()
+            except Exception as e:
+                # A failed cache write must never fail the analysis itself
+                logger.error(f"Error storing cached analysis for {message_id}: {str(e)}")
+                db.rollback()
+                labels['outcome'] = 'error'
+            finally:
+                db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.memory_hits + self.db_hits) / lookups, 4) if lookups else 0.0,
+                "model": self.model,
+                "prompt_version": self.prompt_version
+            }
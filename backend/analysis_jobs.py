@@ -0,0 +1,324 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from ai_analyzer import AIAnalyzer, UpstreamUnavailable
+from analysis_cache import AnalysisCache
+from near_duplicates import NearDuplicateIndex
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first: a user waiting on a click beats background triage
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+PRIORITIES = {"interactive": PRIORITY_INTERACTIVE, "bulk": PRIORITY_BULK}
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+TERMINAL_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+# How often an idle worker sweeps out finished jobs past their retention
+PURGE_INTERVAL_SECONDS = 600
+# Longest wait before retrying a job OpenRouter turned away
+MAX_RETRY_DELAY_SECONDS = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    id TEXT PRIMARY KEY,
+    user_email TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    subject TEXT,
+    from_address TEXT,
+    content TEXT,
+    content_hash TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_analysis_jobs_claim ON analysis_jobs (status, priority, created_at);
+CREATE INDEX IF NOT EXISTS ix_analysis_jobs_message ON analysis_jobs (user_email, message_id, status);
+"""
+
+
+class AnalysisJobQueue:
+    """SQLite-backed priority queue of analysis jobs drained by a bounded worker pool.
+
+    Pending work survives restarts: jobs left running by a crash are re-queued on start.
+    Jobs OpenRouter turns away for a while (throttled, circuit open, 5xx, unreachable)
+    go back to pending with exponential backoff until they run out of attempts; only
+    other errors fail a job outright. Email bodies are only kept until the job finishes,
+    and finished jobs are deleted once they are older than the retention period.
+    """
+
+    def __init__(self, analyzer: AIAnalyzer, cache: AnalysisCache, db_path: Optional[str] = None,
+                 workers: Optional[int] = None, near_duplicates: Optional[NearDuplicateIndex] = None):
+        self.analyzer = analyzer
+        self.cache = cache
+        self.near_duplicates = near_duplicates
+        self.db_path = db_path or os.getenv('ANALYSIS_QUEUE_PATH', 'analysis_jobs.db')
+        self.worker_count = workers or int(os.getenv('ANALYSIS_WORKERS', '4'))
+        self.retention_seconds = float(os.getenv('ANALYSIS_JOB_RETENTION_HOURS', '24')) * 3600
+        self.max_attempts = int(os.getenv('ANALYSIS_JOB_MAX_ATTEMPTS', '5'))
+        self.retry_seconds = float(os.getenv('ANALYSIS_JOB_RETRY_SECONDS', '10'))
+        self._last_purge = 0.0
+        self.purged = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+
+    # SQLite access; always called off the event loop
+
+    def _migrate(self) -> None:
+        # Queue files from before retries were added
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(analysis_jobs)")}
+        if "attempts" not in columns:
+            self._conn.execute("ALTER TABLE analysis_jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        if "not_before" not in columns:
+            self._conn.execute("ALTER TABLE analysis_jobs ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _recover(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE analysis_jobs SET status = ?, updated_at = ? WHERE status = ?",
+                (STATUS_PENDING, time.time(), STATUS_RUNNING)
+            )
+            return cursor.rowcount
+
+    def _insert(self, user_email: str, message_id: str, priority: int, subject: str,
+                from_address: str, content: str, content_hash: str) -> Dict[str, Any]:
+        with self._lock:
+            existing = self._conn.execute(
+                "SELECT id, priority, status FROM analysis_jobs "
+                "WHERE user_email = ? AND message_id = ? AND status IN (?, ?)",
+                (user_email, message_id, STATUS_PENDING, STATUS_RUNNING)
+            ).fetchone()
+            now = time.time()
+            if existing is not None:
+                # Same message already queued; a user click promotes the queued bulk job
+                if priority < existing["priority"]:
+                    self._conn.execute(
+                        "UPDATE analysis_jobs SET priority = ?, updated_at = ? WHERE id = ?",
+                        (priority, now, existing["id"])
+                    )
+                return {"job_id": existing["id"], "status": existing["status"]}
+
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO analysis_jobs (id, user_email, message_id, priority, status, subject, "
+                "from_address, content, content_hash, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, user_email, message_id, priority, STATUS_PENDING, subject,
+                 from_address, content, content_hash, now, now)
+            )
+            return {"job_id": job_id, "status": STATUS_PENDING}
+
+    def _claim_next(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM analysis_jobs WHERE status = ? AND not_before <= ? "
+                "ORDER BY priority, created_at LIMIT 1",
+                (STATUS_PENDING, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE analysis_jobs SET status = ?, updated_at = ? WHERE id = ?",
+                (STATUS_RUNNING, time.time(), row["id"])
+            )
+            return dict(row)
+
+    def _next_due(self) -> Optional[float]:
+        """When the earliest job waiting out a retry delay becomes claimable, if any."""
+        rows = self._execute(
+            "SELECT MIN(not_before) AS due FROM analysis_jobs WHERE status = ? AND not_before > ?",
+            (STATUS_PENDING, time.time())
+        )
+        return rows[0]["due"]
+
+    def _finish(self, job_id: str, result: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+        self._execute(
+            "UPDATE analysis_jobs SET status = ?, result = ?, error = ?, content = NULL, updated_at = ? "
+            "WHERE id = ?",
+            (STATUS_COMPLETED if error is None else STATUS_FAILED,
+             json.dumps(result) if result is not None else None, error, time.time(), job_id)
+        )
+
+    def _retry_later(self, job_id: str, error: str, delay: float) -> None:
+        self._execute(
+            "UPDATE analysis_jobs SET status = ?, error = ?, attempts = attempts + 1, not_before = ?, "
+            "updated_at = ? WHERE id = ?",
+            (STATUS_PENDING, error, time.time() + delay, time.time(), job_id)
+        )
+
+    def _retry_delay(self, attempts: int, retry_after: float) -> float:
+        """Exponential backoff from retry_seconds, never sooner than the upstream asked for."""
+        return min(max(self.retry_seconds * 2 ** attempts, retry_after), MAX_RETRY_DELAY_SECONDS)
+
+    def _purge(self, older_than: float) -> int:
+        """Delete finished and failed jobs last updated before `older_than`."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM analysis_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (*TERMINAL_STATUSES, older_than)
+            )
+            self.purged += cursor.rowcount
+            return cursor.rowcount
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute(
+            "SELECT id, user_email, message_id, priority, status, result, error, attempts, created_at, updated_at "
+            "FROM analysis_jobs WHERE id = ?",
+            (job_id,)
+        )
+        if not rows:
+            return None
+        job = dict(rows[0])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _counts(self) -> Dict[str, int]:
+        rows = self._execute("SELECT status, COUNT(*) AS n FROM analysis_jobs GROUP BY status")
+        return {row["status"]: row["n"] for row in rows}
+
+    # Async API
+
+    async def start(self) -> None:
+        recovered = await asyncio.to_thread(self._recover)
+        if recovered:
+            logger.info(f"Re-queued {recovered} analysis jobs interrupted by a restart")
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker(index)) for index in range(self.worker_count)
+        ]
+        logger.debug(f"Started {self.worker_count} analysis workers")
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Anything cancelled mid-flight goes back to pending on the next start
+
+    async def submit(self, user_email: str, message_id: str, subject: str, from_address: str,
+                     content: str, content_hash: str, priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Any]:
+        job = await asyncio.to_thread(
+            self._insert, user_email, message_id, priority, subject, from_address, content, content_hash
+        )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Return the job once it finishes or after `timeout` seconds, whichever comes first."""
+        job = await self.get(job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES or timeout <= 0:
+            return job
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, []).append(future)
+        try:
+            # Re-check after registering so a completion in between is not missed
+            job = await self.get(job_id)
+            if job["status"] not in TERMINAL_STATUSES:
+                await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(job_id, [])
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self._waiters.pop(job_id, None)
+        return await self.get(job_id)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._workers),
+            "jobs": await asyncio.to_thread(self._counts),
+            "purged": self.purged
+        }
+
+    async def _maybe_purge(self) -> None:
+        now = time.time()
+        if now - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        # Claimed before the sweep so concurrent idle workers don't all run it
+        self._last_purge = now
+        purged = await asyncio.to_thread(self._purge, now - self.retention_seconds)
+        if purged:
+            logger.info(f"Purged {purged} analysis jobs older than the retention period")
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            # Clear before claiming so a submit that lands in between still wakes us
+            self._wakeup.clear()
+            job = await asyncio.to_thread(self._claim_next)
+            if job is None:
+                await self._maybe_purge()
+                due = await asyncio.to_thread(self._next_due)
+                timeout = 5.0 if due is None else min(5.0, max(due - time.time(), 0.01))
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            logger.debug(f"Worker {index} running analysis job {job['id']} (priority {job['priority']})")
+            result = None
+            error = None
+            try:
+                result = await self.analyzer.analyze_email_async(
+                    job["subject"] or "", job["content"] or "", job["from_address"] or ""
+                )
+                await asyncio.to_thread(
+                    self.cache.put, job["user_email"], job["message_id"], job["content_hash"], result
+                )
+                if self.near_duplicates is not None:
+                    await asyncio.to_thread(
+                        self.near_duplicates.add, job["user_email"], job["message_id"],
+                        job["subject"] or "", job["from_address"] or "", job["content"] or ""
+                    )
+            except asyncio.CancelledError:
+                raise
+            except UpstreamUnavailable as e:
+                error = str(e)
+                if job["attempts"] + 1 < self.max_attempts:
+                    delay = self._retry_delay(job["attempts"], e.retry_after)
+                    logger.warning(f"Analysis job {job['id']} will retry in {delay:.0f}s: {error}")
+                    await asyncio.to_thread(self._retry_later, job["id"], error, delay)
+                    continue
+            except ValueError as e:
+                error = str(e)
+            except Exception as e:
+                logger.exception(f"Unexpected error in analysis job {job['id']}")
+                error = "Failed to analyze email"
+
+            await asyncio.to_thread(self._finish, job["id"], result, error)
+            for future in self._waiters.pop(job["id"], []):
+                if not future.done():
+                    future.set_result(None)
@@ -0,0 +1,61 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+_http_client: Optional[httpx.AsyncClient] = None
+_gmail_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared async HTTP client with pooled keep-alive connections (userinfo, OpenRouter)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        limits = httpx.Limits(
+            max_connections=int(os.getenv('HTTP_MAX_CONNECTIONS', '100')),
+            max_keepalive_connections=int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', '20')),
+            keepalive_expiry=float(os.getenv('HTTP_KEEPALIVE_EXPIRY_SECONDS', '30'))
+        )
+        timeout = httpx.Timeout(float(os.getenv('HTTP_TIMEOUT_SECONDS', '60')), connect=10.0)
+        logger.debug("Creating shared async HTTP client...")
+        _http_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+    return _http_client
+
+
+def get_gmail_executor() -> ThreadPoolExecutor:
+    """Bounded worker pool for blocking googleapiclient calls."""
+    global _gmail_executor
+    if _gmail_executor is None:
+        workers = int(os.getenv('GMAIL_EXECUTOR_WORKERS', '32'))
+        logger.debug(f"Creating Gmail executor with {workers} workers...")
+        _gmail_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gmail')
+    return _gmail_executor
+
+
+async def run_gmail(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking Gmail call on the bounded executor without stalling the event loop.
+
+    The caller's context variables (the endpoint metrics are labeled with) go along.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_gmail_executor(), functools.partial(context.run, fn, *args, **kwargs))
+
+
+async def close_async_io() -> None:
+    global _http_client, _gmail_executor
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    if _gmail_executor is not None:
+        _gmail_executor.shutdown(wait=False)
+        _gmail_executor = None
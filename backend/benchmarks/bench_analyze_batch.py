@@ -0,0 +1,93 @@
+"""Compare per-email and packed batch analysis throughput against the fake OpenRouter server.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_analyze_batch --emails 100 --latency-ms 400 --per-email-latency-ms 60
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(backend_dir))
+
+from fakes.fake_openrouter import start_fake_openrouter
+
+
+def make_emails(count):
+    return [
+        {
+            "id": f"bench-{i}",
+            "subject": f"Benchmark email {i}",
+            "from": f"sender{i % 10}@example.com",
+            "content": ("Big sale this week only, click to unsubscribe. " if i % 3 == 0 else
+                        "Can we move tomorrow's meeting to 3pm? Let me know. ") * 8
+        }
+        for i in range(count)
+    ]
+
+
+async def run_per_email(analyzer, emails, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze(email):
+        async with semaphore:
+            return await analyzer.analyze_email_async(email["subject"], email["content"], email["from"])
+
+    return await asyncio.gather(*(analyze(email) for email in emails))
+
+
+async def run_batched(analyzer, emails, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze(group):
+        async with semaphore:
+            return await analyzer.analyze_batch_async(group)
+
+    return await asyncio.gather(*(analyze(group) for group in analyzer.pack_batches(emails)))
+
+
+async def measure(label, coro_fn, analyzer, emails, concurrency, server):
+    requests_before = server.request_count
+    started = time.perf_counter()
+    await coro_fn(analyzer, emails, concurrency)
+    elapsed = time.perf_counter() - started
+    upstream_calls = server.request_count - requests_before
+    print(f"{label:>10} {elapsed * 1000:>10.0f} {len(emails) / elapsed:>12.1f} {upstream_calls:>15}")
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--emails', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=400.0, help="Fixed cost per completion")
+    parser.add_argument('--per-email-latency-ms', type=float, default=60.0, help="Extra cost per email in a prompt")
+    args = parser.parse_args()
+
+    server = start_fake_openrouter(latency_ms=args.latency_ms, per_email_latency_ms=args.per_email_latency_ms)
+    os.environ['OPENROUTER_API_URL'] = server.api_url
+    os.environ.setdefault('OPENROUTER_API_KEY', 'bench-key')
+
+    from ai_analyzer import AIAnalyzer
+    from async_io import close_async_io
+
+    analyzer = AIAnalyzer()
+    emails = make_emails(args.emails)
+
+    print(f"emails={args.emails} concurrency={args.concurrency} token_budget={analyzer.batch_token_budget} "
+          f"max_emails_per_prompt={analyzer.batch_max_emails}")
+    print(f"{'path':>10} {'total_ms':>10} {'emails_per_s':>12} {'upstream_calls':>15}")
+    per_email = await measure("per-email", run_per_email, analyzer, emails, args.concurrency, server)
+    batched = await measure("batched", run_batched, analyzer, emails, args.concurrency, server)
+    print(f"speedup: {per_email / batched:.1f}x")
+
+    await close_async_io()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
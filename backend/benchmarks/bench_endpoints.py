@@ -0,0 +1,305 @@
+"""End-to-end load test of the API against the fake Gmail, userinfo and OpenRouter servers.
+
+The backend runs in-process under uvicorn with a throwaway SQLite database, and a load
+driver sends real HTTP requests to `/emails`, `/emails/{id}/analyze`, `/stats` and
+`/emails/trash` at a fixed concurrency. Each scenario reports latency percentiles and
+throughput; results can be saved as a baseline and later runs are compared against it.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_endpoints --requests 200 --concurrency 8
+    python -m benchmarks.bench_endpoints --save-baseline
+    python -m benchmarks.bench_endpoints --gmail-error-rate 0.05 --llm-error-rate 0.05
+    python -m benchmarks.bench_endpoints --database-url postgresql://localhost/bench --reset-database --async-db
+
+The exit status is 1 when a scenario regressed against the baseline by more than
+--tolerance, so the command can gate CI.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Add the backend directory to Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(backend_dir))
+
+from fakes.fake_gmail import start_fake_gmail
+from fakes.fake_openrouter import start_fake_openrouter
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'baseline_endpoints.json'
+# Async sessions are a different serving path, so they keep their own baseline
+DEFAULT_ASYNC_BASELINE = Path(__file__).resolve().parent / 'baseline_endpoints_async.json'
+SCENARIOS = ('emails', 'analyze', 'stats', 'trash')
+# Settings that change the numbers; a baseline taken with other values is not comparable
+COMPARABLE_SETTINGS = (
+    'requests', 'concurrency', 'users', 'page_size', 'trash_batch', 'messages', 'gmail_latency_ms',
+    'batch_item_latency_ms', 'userinfo_latency_ms', 'llm_latency_ms', 'gmail_error_rate', 'llm_error_rate',
+    'error_status', 'database', 'async_db'
+)
+
+# (method, path, JSON body or None, access token)
+RequestSpec = Tuple[str, str, Optional[Dict[str, Any]], str]
+
+
+def percentile(sorted_samples: List[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted samples."""
+    if not sorted_samples:
+        return 0.0
+    rank = max(int(round(q / 100.0 * len(sorted_samples) + 0.5)) - 1, 0)
+    return sorted_samples[min(rank, len(sorted_samples) - 1)]
+
+
+def summarize(latencies_ms: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    samples = sorted(latencies_ms)
+    count = len(samples)
+    return {
+        "requests": count,
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        "p50_ms": round(percentile(samples, 50), 1),
+        "p95_ms": round(percentile(samples, 95), 1),
+        "p99_ms": round(percentile(samples, 99), 1),
+        "mean_ms": round(sum(samples) / count, 1) if count else 0.0,
+        "throughput_rps": round(count / elapsed, 1) if elapsed else 0.0
+    }
+
+
+async def run_scenario(client, make_request: Callable[[int], RequestSpec], count: int,
+                       concurrency: int) -> Dict[str, float]:
+    """Send `count` requests with at most `concurrency` in flight; non-2xx answers are errors."""
+    latencies: List[float] = []
+    errors = 0
+    statuses: Dict[int, int] = {}
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < count:
+            index = next_index
+            next_index += 1
+            method, path, body, token = make_request(index)
+            started = time.perf_counter()
+            try:
+                response = await client.request(
+                    method, path, json=body, headers={"Authorization": f"Bearer {token}"}
+                )
+                status = response.status_code
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Request {method} {path} failed: {e}")
+                status = 0
+            latencies.append((time.perf_counter() - started) * 1000.0)
+            statuses[status] = statuses.get(status, 0) + 1
+            if not 200 <= status < 300:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(latencies, errors, time.perf_counter() - started)
+    result["statuses"] = {str(status): seen for status, seen in sorted(statuses.items())}
+    return result
+
+
+def build_scenarios(args, message_ids: List[str]) -> Dict[str, Callable[[int], RequestSpec]]:
+    tokens = [f"bench-user-{user}" for user in range(args.users)]
+    # Analysis walks the newest messages and trash the oldest, so neither sees the other's changes
+    analyze_ids = message_ids[:len(message_ids) // 2]
+    trash_ids = message_ids[len(message_ids) // 2:][::-1]
+
+    def emails(index: int) -> RequestSpec:
+        return "GET", f"/emails?page_size={args.page_size}", None, tokens[index % args.users]
+
+    def analyze(index: int) -> RequestSpec:
+        return "GET", f"/emails/{analyze_ids[index % len(analyze_ids)]}/analyze", None, tokens[index % args.users]
+
+    def stats(index: int) -> RequestSpec:
+        return "GET", "/stats", None, tokens[index % args.users]
+
+    def trash(index: int) -> RequestSpec:
+        start = (index * args.trash_batch) % len(trash_ids)
+        ids = trash_ids[start:start + args.trash_batch]
+        return "POST", "/emails/trash", {"message_ids": ids}, tokens[index % args.users]
+
+    return {"emails": emails, "analyze": analyze, "stats": stats, "trash": trash}
+
+
+def start_backend(port: int):
+    """Run the FastAPI app under uvicorn on a background thread; returns the server."""
+    import uvicorn
+    import main as backend
+
+    config = uvicorn.Config(backend.app, host='127.0.0.1', port=port, log_level='warning', lifespan='on')
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError("Backend did not start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], settings: Dict[str, Any],
+            tolerance: float) -> List[str]:
+    """Regressions of p95 latency, throughput or error rate beyond the tolerance."""
+    mismatched = [
+        name for name in COMPARABLE_SETTINGS if baseline.get("settings", {}).get(name) != settings.get(name)
+    ]
+    if mismatched:
+        print(f"note: baseline was recorded with different {', '.join(mismatched)}; comparison is indicative only")
+
+    regressions = []
+    print(f"\n{'scenario':>10} {'p95_ms':>18} {'throughput_rps':>21} {'error_rate':>18}")
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        print(
+            f"{name:>10} {before['p95_ms']:>7.1f} -> {result['p95_ms']:<7.1f}"
+            f"{before['throughput_rps']:>9.1f} -> {result['throughput_rps']:<8.1f}"
+            f"{before['error_rate']:>7.3f} -> {result['error_rate']:<7.3f}"
+        )
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s")
+        if result["error_rate"] > before["error_rate"] + 0.01:
+            regressions.append(f"{name}: error rate {before['error_rate']} -> {result['error_rate']}")
+    return regressions
+
+
+async def drive(args, base_url: str, message_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    import httpx
+
+    scenarios = build_scenarios(args, message_ids)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        # One untimed listing per user warms the identity cache, Gmail client pool and label registry
+        await asyncio.gather(*(
+            client.get("/emails?page_size=1", headers={"Authorization": f"Bearer bench-user-{user}"})
+            for user in range(args.users)
+        ))
+        print(f"{'scenario':>10} {'requests':>9} {'errors':>7} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} "
+              f"{'mean_ms':>8} {'req_per_s':>10}")
+        for name in args.scenarios.split(','):
+            result = await run_scenario(client, scenarios[name], args.requests, args.concurrency)
+            results[name] = result
+            print(f"{name:>10} {result['requests']:>9} {result['errors']:>7} {result['p50_ms']:>8.1f} "
+                  f"{result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['mean_ms']:>8.1f} "
+                  f"{result['throughput_rps']:>10.1f}")
+            if result['errors']:
+                print(f"{'':>10} statuses: {result['statuses']}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated, run in this order")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--users', type=int, default=8, help="Distinct access tokens the requests rotate through")
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--trash-batch', type=int, default=10, help="Message ids per /emails/trash request")
+    parser.add_argument('--messages', type=int, default=2000, help="Size of the fake mailbox")
+    parser.add_argument('--gmail-latency-ms', type=float, default=20.0)
+    parser.add_argument('--batch-item-latency-ms', type=float, default=1.0)
+    parser.add_argument('--userinfo-latency-ms', type=float, default=20.0)
+    parser.add_argument('--llm-latency-ms', type=float, default=300.0)
+    parser.add_argument('--gmail-error-rate', type=float, default=0.0, help="Also applies to userinfo")
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503, help="Status of injected errors")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help="Baseline file (default: baseline_endpoints.json, "
+                        "or baseline_endpoints_async.json with --async-db)")
+    parser.add_argument('--save-baseline', action='store_true', help="Write the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative p95/throughput change")
+    parser.add_argument('--database-url', help="Scratch database to use instead of a throwaway SQLite file")
+    parser.add_argument('--reset-database', action='store_true',
+                        help="Drop the app's tables in --database-url first, so runs start from the same state")
+    parser.add_argument('--async-db', action='store_true', help="Serve requests with async database sessions")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    unknown = set(args.scenarios.split(',')) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    gmail = start_fake_gmail(
+        message_count=args.messages, latency_ms=args.gmail_latency_ms,
+        batch_item_latency_ms=args.batch_item_latency_ms, userinfo_latency_ms=args.userinfo_latency_ms,
+        error_rate=args.gmail_error_rate, error_status=args.error_status, seed=args.seed
+    )
+    openrouter = start_fake_openrouter(
+        latency_ms=args.llm_latency_ms, error_rate=args.llm_error_rate, error_status=args.error_status,
+        seed=args.seed
+    )
+
+    workdir = tempfile.mkdtemp(prefix='bench-endpoints-')
+    os.environ.update({
+        'GMAIL_API_ROOT_URL': gmail.root_url,
+        'GOOGLE_USERINFO_URL': gmail.userinfo_url,
+        'OPENROUTER_API_URL': openrouter.api_url,
+        'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'DATABASE_ASYNC_ENABLED': 'true' if args.async_db else 'false',
+        'ANALYSIS_QUEUE_PATH': os.path.join(workdir, 'jobs.db'),
+        'SIMILARITY_INDEX_DIR': os.path.join(workdir, 'similarity_index')
+    })
+    for name, value in (('OPENROUTER_API_KEY', 'bench-key'), ('GOOGLE_CLIENT_ID', 'bench-client-id'),
+                        ('GOOGLE_CLIENT_SECRET', 'bench-client-secret')):
+        os.environ.setdefault(name, value)
+
+    if args.database_url and args.reset_database:
+        import models
+        from database import engine
+        models.Base.metadata.drop_all(bind=engine)
+
+    port = free_port()
+    server, thread = start_backend(port)
+    # main configures DEBUG logging on import; keep log formatting out of the measurements
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    args.database = os.environ['DATABASE_URL'].split(':', 1)[0].split('+', 1)[0]
+    settings = {name: getattr(args, name) for name in COMPARABLE_SETTINGS}
+    print(f"settings: {json.dumps(settings)}")
+    try:
+        results = asyncio.run(drive(args, f"http://127.0.0.1:{port}", list(gmail.mailbox.order)))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        gmail.shutdown()
+        openrouter.shutdown()
+    print(f"\nupstream calls: gmail={gmail.request_count} userinfo={gmail.userinfo_count} "
+          f"openrouter={openrouter.request_count} injected_errors={gmail.injected_errors + openrouter.injected_errors}")
+
+    baseline_path = Path(args.baseline or (DEFAULT_ASYNC_BASELINE if args.async_db else DEFAULT_BASELINE))
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps({"settings": settings, "results": results}, indent=2) + '\n')
+        print(f"Baseline written to {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}; run with --save-baseline to record one")
+        return 0
+    regressions = compare(results, json.loads(baseline_path.read_text()), settings, args.tolerance)
+    if regressions:
+        print("\nREGRESSIONS:\n  " + "\n  ".join(regressions))
+        return 1
+    print("\nNo regressions against the baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
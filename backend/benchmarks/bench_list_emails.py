@@ -0,0 +1,76 @@
+"""Compare sequential vs batched Gmail metadata fetching against the fake Gmail server.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_list_emails --latency-ms 20 --page-sizes 10,50,100
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(backend_dir))
+
+from fakes.fake_gmail import start_fake_gmail
+
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+
+
+def fetch_sequential(service, message_ids):
+    return [
+        service.users().messages().get(
+            userId='me', id=message_id, format='metadata', metadataHeaders=METADATA_HEADERS
+        ).execute()
+        for message_id in message_ids
+    ]
+
+
+def time_call(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Simulated per-HTTP-request latency")
+    parser.add_argument('--page-sizes', default='10,50,100')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    server = start_fake_gmail(message_count=500, latency_ms=args.latency_ms)
+    os.environ['GMAIL_API_ROOT_URL'] = server.root_url
+    os.environ['GMAIL_BATCH_SIZE'] = str(args.batch_size)
+    os.environ.setdefault('GOOGLE_CLIENT_ID', 'bench-client-id')
+    os.environ.setdefault('GOOGLE_CLIENT_SECRET', 'bench-client-secret')
+
+    from google.oauth2.credentials import Credentials
+    from gmail_service import GmailService
+
+    gmail_service = GmailService()
+    credentials = Credentials(token='bench-token')
+    service = gmail_service.get_gmail_service(credentials)
+    message_ids = server.mailbox.order
+
+    print(f"latency={args.latency_ms}ms batch_size={gmail_service.batch_size}")
+    print(f"{'page_size':>10} {'sequential_ms':>14} {'batched_ms':>11} {'speedup':>8}")
+    for page_size in [int(size) for size in args.page_sizes.split(',')]:
+        ids = message_ids[:page_size]
+        sequential = time_call(lambda: fetch_sequential(service, ids), args.repeats)
+        batched = time_call(lambda: gmail_service.get_messages_batch(
+            service, ids, format='metadata', metadata_headers=METADATA_HEADERS
+        ), args.repeats)
+        print(f"{page_size:>10} {sequential:>14.1f} {batched:>11.1f} {sequential / batched:>7.1f}x")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add the backend directory to Python path
+backend_dir = Path(__file__).parent
+sys.path.append(str(backend_dir))
+
+# The modules read these at import time; point them at throwaway local state
+_state_dir = tempfile.mkdtemp(prefix='gmail-ai-tests-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_state_dir, 'test.db')}")
+os.environ.setdefault('GOOGLE_CLIENT_ID', 'test-client-id')
+os.environ.setdefault('GOOGLE_CLIENT_SECRET', 'test-client-secret')
+os.environ.setdefault('OPENROUTER_API_KEY', 'test-openrouter-key')
@@ -1,8 +1,19 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
 # Load environment variables
 load_dotenv()
 
@@ -12,8 +23,56 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL not set in environment variables")
 
+# Async drivers for each sync dialect; only imported once the async engine is created
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """Pool settings from DB_POOL_* variables; shared by the sync and async engines.
+
+    Sizing only goes to dialects whose default pool is a queue pool; in-memory SQLite
+    (a single connection) and aiosqlite (NullPool) reject those arguments.
+    """
+    options: Dict[str, Any] = {
+        # Check connections on checkout so a restarted or idle-closed server doesn't fail a request
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+    }
+    parsed = make_url(url)
+    if issubclass(parsed.get_dialect().get_pool_class(parsed), QueuePool):
+        options.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+        )
+    database = parsed.database
+    if _is_sqlite(url) and database and database != ":memory:":
+        # Wait for the write lock instead of failing with "database is locked" straight away
+        options["connect_args"] = {"timeout": float(os.getenv("DB_SQLITE_BUSY_TIMEOUT_SECONDS", "15"))}
+    return options
+
+
+def _configure_sqlite(engine) -> None:
+    if os.getenv("DB_SQLITE_WAL", "true").lower() != "true":
+        return
+
+    @event.listens_for(engine.sync_engine if hasattr(engine, "sync_engine") else engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers run while a request writes; NORMAL sync is durable across app crashes
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+
 # Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+if _is_sqlite(DATABASE_URL):
+    _configure_sqlite(engine)
 
 # Create SessionLocal class for database sessions
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -21,10 +80,94 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Create Base class for declarative models
 Base = declarative_base()
 
+# Request handlers use AsyncSession when enabled, so waiting on the database doesn't hold a thread
+ASYNC_DATABASE_ENABLED = os.getenv("DATABASE_ASYNC_ENABLED", "false").lower() == "true"
+_async_engine = None
+_async_session_factory = None
+
+
+def async_database_url(url: str) -> str:
+    """DATABASE_URL with its driver swapped for the asyncio one, unless ASYNC_DATABASE_URL is set."""
+    override = os.getenv("ASYNC_DATABASE_URL")
+    if override:
+        return override
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver known for {parsed.get_backend_name()}; set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=f"{parsed.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+
+def get_async_session_factory():
+    global _async_engine, _async_session_factory
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        url = async_database_url(DATABASE_URL)
+        logger.debug(f"Creating async database engine for {make_url(url).drivername}")
+        _async_engine = create_async_engine(url, **engine_options(url))
+        if _is_sqlite(url):
+            _configure_sqlite(_async_engine)
+        _async_session_factory = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_session_factory
+
+
+async def close_async_engine() -> None:
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    _async_session_factory = None
+
+
 # Dependency to get database session
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with get_async_session_factory()() as db:
+        yield db
+
+
+async def get_request_db():
+    """One session per request: an AsyncSession when DATABASE_ASYNC_ENABLED, else a Session."""
+    if ASYNC_DATABASE_ENABLED:
+        async with get_async_session_factory()() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            # Closing returns the connection to the pool; keep that off the event loop too
+            await run_in_threadpool(db.close)
+
+
+async def run_db(db, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Call a blocking database function with the request's session passed as `db`.
+
+    With an AsyncSession the function runs through run_sync on the async driver, so the
+    event loop never blocks and no thread is held while the database works; otherwise it
+    runs on the thread pool.
+    """
+    if ASYNC_DATABASE_ENABLED:
+        return await db.run_sync(lambda session: fn(*args, db=session, **kwargs))
+    return await run_in_threadpool(fn, *args, db=db, **kwargs)
+
+
+@contextmanager
+def session_scope(db: Optional[Session] = None) -> Iterator[Session]:
+    """The caller's session, or a new one closed on exit for work outside a request."""
+    if db is not None:
+        yield db
+        return
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
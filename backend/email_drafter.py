@@ -1,31 +1,25 @@
 import logging
-from typing import Dict, List
+from typing import Any, Callable, Dict, List
 
 logger = logging.getLogger(__name__)
 
 class EmailDrafter:
-    def __init__(self):
+    def __init__(self, gemini_provider: Callable[[], Any]):
         logger.debug("Initializing EmailDrafter")
+        # Gemini is created on first use so the app starts without its key
+        self.gemini_provider = gemini_provider
         
     def generate_draft(self, email_content: str, tone: str = "professional") -> str:
         """
-        Generate a draft response for the email.
-        This is a placeholder implementation that returns a mock draft.
-        In a real implementation, this would use AI/ML to generate the draft.
+        Generate a draft reply to the last message of `email_content`, which is
+        either a single email or a compacted thread context ending at the message
+        being replied to.
         """
         try:
             logger.debug(f"Generating draft with tone: {tone}")
-            
-            # Mock draft - replace with actual AI/ML generation
-            draft = f"""
-            Thank you for your email. I appreciate you reaching out.
-            
-            I understand your concerns and will address them promptly.
-            
-            Best regards,
-            [Your Name]
-            """
-            
+            draft = self.gemini_provider().draft_response(email_content, tone)
+            if not draft:
+                raise ValueError("Empty draft from Gemini")
             logger.debug("Draft generated successfully")
             return draft
             
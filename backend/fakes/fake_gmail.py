@@ -0,0 +1,468 @@
+"""Local stand-in for the Gmail REST API, including the /batch endpoint.
+
+Run with `python -m fakes.fake_gmail --port 8090` from the backend directory and
+point the backend at it with GMAIL_API_ROOT_URL=http://127.0.0.1:8090/. The Google
+userinfo endpoint is served too, at GOOGLE_USERINFO_URL=http://127.0.0.1:8090/oauth2/v3/userinfo;
+it answers each access token with its own address, so several tokens act as several users
+of the one shared mailbox.
+
+With an error rate set, that fraction of requests (and of calls inside a batch) fail with
+the configured status, like Gmail's transient 429/500/503 answers.
+"""
+import argparse
+import base64
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = '/gmail/v1/users/me'
+# The discovery document's batchPath has been both 'batch' and 'batch/gmail/v1'
+BATCH_PATHS = ('/batch', '/batch/gmail/v1')
+
+CATEGORY_LABELS = ['CATEGORY_PERSONAL', 'CATEGORY_PROMOTIONS', 'CATEGORY_SOCIAL', 'CATEGORY_UPDATES']
+SYSTEM_LABELS = ['INBOX', 'SPAM', 'TRASH', 'UNREAD', 'STARRED', 'IMPORTANT', 'SENT', 'DRAFT'] + CATEGORY_LABELS + [
+    'CATEGORY_FORUMS'
+]
+USERINFO_PATH = '/oauth2/v3/userinfo'
+# Gmail rejects batchModify calls with more ids than this
+BATCH_MODIFY_MAX_IDS = 1000
+
+
+def userinfo_email(token: str) -> str:
+    """Address the fake userinfo endpoint reports for an access token."""
+    return f"{re.sub(r'[^a-z0-9.-]+', '-', token.lower())}@example.com"
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+
+class FakeMailbox:
+    """Deterministic in-memory mailbox shared by every request to the fake server."""
+
+    def __init__(self, message_count: int = 500):
+        self.lock = threading.RLock()
+        self.messages: Dict[str, Dict[str, Any]] = {}
+        self.order: List[str] = []
+        self.next_index = 0
+        self.history_id = 1000
+        # History records as (history_id, record); starts empty so the initial mailbox is a full sync
+        self.history: List[Tuple[int, Dict[str, Any]]] = []
+        self.min_history_id = 0
+        self.labels: Dict[str, Dict[str, Any]] = {
+            label: {'id': label, 'name': label, 'type': 'system'} for label in SYSTEM_LABELS
+        }
+        self.next_label = 1
+        for _ in range(message_count):
+            self.add_message()
+        self.history.clear()
+
+    def _record(self, kind: str, message: Dict[str, Any]) -> None:
+        self.history_id += 1
+        message['historyId'] = str(self.history_id)
+        entry = {'message': {k: message[k] for k in ('id', 'threadId', 'labelIds')}}
+        self.history.append((self.history_id, {'id': str(self.history_id), kind: [entry]}))
+
+    def expire_history(self) -> None:
+        """Make every previously issued historyId too old, forcing clients into a full resync."""
+        with self.lock:
+            self.min_history_id = self.history_id
+
+    def delete_message(self, message_id: str) -> None:
+        with self.lock:
+            message = self.messages.pop(message_id)
+            self.order.remove(message_id)
+            self._record('messagesDeleted', message)
+
+    def modify_labels(self, message_id: str, add: List[str], remove: List[str]) -> Dict[str, Any]:
+        with self.lock:
+            message = self.messages[message_id]
+            for label in add:
+                if label not in message['labelIds']:
+                    message['labelIds'].append(label)
+            message['labelIds'] = [label for label in message['labelIds'] if label not in remove]
+            if add:
+                self._record('labelsAdded', message)
+            if remove:
+                self._record('labelsRemoved', message)
+            return message
+
+    def create_label(self, name: str) -> Optional[Dict[str, Any]]:
+        """Create a user label; None if the name is taken, like Gmail's 409."""
+        with self.lock:
+            if any(label['name'].lower() == name.lower() for label in self.labels.values()):
+                return None
+            label = {'id': f"Label_{self.next_label}", 'name': name, 'type': 'user'}
+            self.next_label += 1
+            self.labels[label['id']] = label
+            return label
+
+    def delete_label(self, label_id: str) -> bool:
+        """Delete a user label and strip it from every message, like Gmail."""
+        with self.lock:
+            label = self.labels.get(label_id)
+            if label is None or label['type'] != 'user':
+                return False
+            del self.labels[label_id]
+            for message in self.messages.values():
+                if label_id in message['labelIds']:
+                    self.modify_labels(message['id'], [], [label_id])
+            return True
+
+    def add_message(self) -> Dict[str, Any]:
+        with self.lock:
+            i = self.next_index
+            self.next_index += 1
+            message = self._build_message(i)
+            self.messages[message['id']] = message
+            # Newest first, like Gmail's list order
+            self.order.insert(0, message['id'])
+            self._record('messagesAdded', message)
+            return message
+
+    def _build_message(self, i: int) -> Dict[str, Any]:
+        message_id = f"{i + 1:016x}"
+        category = CATEGORY_LABELS[i % len(CATEGORY_LABELS)]
+        headers = [
+            {'name': 'Subject', 'value': f"Fake message {i + 1}"},
+            {'name': 'From', 'value': f"Sender {i % 25} <sender{i % 25}@example.com>"},
+            {'name': 'Date', 'value': 'Mon, 1 Jan 2024 10:00:00 +0000'}
+        ]
+        if category == 'CATEGORY_PROMOTIONS':
+            headers.append({'name': 'List-Unsubscribe', 'value': '<mailto:unsubscribe@example.com>'})
+            headers.append({'name': 'Precedence', 'value': 'bulk'})
+        body = f"Hello,\n\nThis is the body of fake message {i + 1}.\n\nThanks,\nSender {i % 25}\n"
+        message = {
+            'id': message_id,
+            'threadId': f"{(i // 3) + 1:016x}",
+            'labelIds': ['INBOX', category] + (['UNREAD'] if i % 2 else []),
+            'snippet': f"This is the body of fake message {i + 1}.",
+            'historyId': str(self.history_id),
+            'internalDate': str(1704103200000 + i * 60000),
+            'sizeEstimate': len(body),
+            'payload': {
+                'mimeType': 'text/plain',
+                'headers': headers,
+                'body': {'size': len(body), 'data': _b64(body)}
+            }
+        }
+        return message
+
+    def render(self, message: Dict[str, Any], fmt: str, metadata_headers: List[str]) -> Dict[str, Any]:
+        if fmt == 'full':
+            return message
+        rendered = {k: v for k, v in message.items() if k != 'payload'}
+        if fmt == 'metadata':
+            headers = message['payload']['headers']
+            if metadata_headers:
+                wanted = {h.lower() for h in metadata_headers}
+                headers = [h for h in headers if h['name'].lower() in wanted]
+            rendered['payload'] = {'mimeType': message['payload']['mimeType'], 'headers': headers}
+        return rendered
+
+
+class FakeGmailServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], mailbox: FakeMailbox,
+                 latency_ms: float = 0.0, batch_item_latency_ms: float = 0.0, userinfo_latency_ms: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503, seed: int = 0):
+        super().__init__(address, FakeGmailHandler)
+        self.mailbox = mailbox
+        self.latency_ms = latency_ms
+        self.batch_item_latency_ms = batch_item_latency_ms
+        self.userinfo_latency_ms = userinfo_latency_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.userinfo_count = 0
+        self.injected_errors = 0
+        self.count_lock = threading.Lock()
+
+    @property
+    def root_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def userinfo_url(self) -> str:
+        return self.root_url.rstrip('/') + USERINFO_PATH
+
+    def inject_error(self) -> bool:
+        """Whether this request should fail with error_status."""
+        if not self.error_rate:
+            return False
+        with self.count_lock:
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.injected_errors += 1
+            return failed
+
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: FakeGmailServer
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json') -> None:
+        if status == 204:
+            body = b''
+
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _error_payload(self) -> Dict[str, Any]:
+        status = self.server.error_status
+        return {'error': {'code': status, 'message': f"Injected error {status}"}}
+
+    def _handle_userinfo(self) -> None:
+        with self.server.count_lock:
+            self.server.userinfo_count += 1
+        if self.server.userinfo_latency_ms:
+            time.sleep(self.server.userinfo_latency_ms / 1000.0)
+        auth_header = self.headers.get('Authorization', '')
+        if self.server.inject_error():
+            self._send(self.server.error_status, json.dumps(self._error_payload()).encode('utf-8'))
+        elif not auth_header.startswith('Bearer '):
+            self._send(401, json.dumps({'error': 'invalid_request'}).encode('utf-8'))
+        else:
+            email = userinfo_email(auth_header[len('Bearer '):])
+            self._send(200, json.dumps({'sub': email, 'email': email, 'email_verified': True}).encode('utf-8'))
+
+    def _handle(self, method: str) -> None:
+        body = self._read_body()
+        if urlsplit(self.path).path == USERINFO_PATH and method == 'GET':
+            self._handle_userinfo()
+            return
+
+        with self.server.count_lock:
+            self.server.request_count += 1
+        if self.server.latency_ms:
+            time.sleep(self.server.latency_ms / 1000.0)
+        if self.server.inject_error():
+            self._send(self.server.error_status, json.dumps(self._error_payload()).encode('utf-8'))
+            return
+
+        if urlsplit(self.path).path in BATCH_PATHS and method == 'POST':
+            self._handle_batch(body)
+            return
+
+        status, payload = self.server_dispatch(method, self.path, body)
+        self._send(status, json.dumps(payload).encode('utf-8'))
+
+    def server_dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        parts = urlsplit(path)
+        query = parse_qs(parts.query)
+        route = parts.path
+        mailbox = self.server.mailbox
+
+        if not route.startswith(API_PREFIX):
+            return 404, {'error': {'code': 404, 'message': f"Unknown route {route}"}}
+        route = route[len(API_PREFIX):]
+
+        with mailbox.lock:
+            if method == 'GET' and route == '/profile':
+                return 200, {
+                    'emailAddress': 'fake.user@example.com',
+                    'messagesTotal': len(mailbox.order),
+                    'historyId': str(mailbox.history_id)
+                }
+
+            if method == 'GET' and route == '/history':
+                start = int(query.get('startHistoryId', ['0'])[0])
+                if start < mailbox.min_history_id:
+                    return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+                max_results = int(query.get('maxResults', ['100'])[0])
+                offset = int(query.get('pageToken', ['0'])[0] or 0)
+                records = [record for history_id, record in mailbox.history if history_id > start]
+                response = {'history': records[offset:offset + max_results], 'historyId': str(mailbox.history_id)}
+                if offset + max_results < len(records):
+                    response['nextPageToken'] = str(offset + max_results)
+                return 200, response
+
+            if method == 'GET' and route == '/messages':
+                max_results = int(query.get('maxResults', ['100'])[0])
+                offset = int(query.get('pageToken', ['0'])[0] or 0)
+                label_ids = query.get('labelIds', [])
+                # Only the before:<epoch seconds> search term is understood
+                before = re.search(r'\bbefore:(\d+)', query.get('q', [''])[0])
+                ids = [
+                    message_id for message_id in mailbox.order
+                    if all(label in mailbox.messages[message_id]['labelIds'] for label in label_ids)
+                    and (not before or int(mailbox.messages[message_id]['internalDate']) < int(before.group(1)) * 1000)
+                ]
+                page = ids[offset:offset + max_results]
+                response: Dict[str, Any] = {
+                    'messages': [
+                        {'id': message_id, 'threadId': mailbox.messages[message_id]['threadId']}
+                        for message_id in page
+                    ],
+                    'resultSizeEstimate': len(ids)
+                }
+                if offset + max_results < len(ids):
+                    response['nextPageToken'] = str(offset + max_results)
+                return 200, response
+
+            match = re.fullmatch(r'/messages/([^/]+)', route)
+            if method == 'GET' and match:
+                message = mailbox.messages.get(match.group(1))
+                if message is None:
+                    return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+                fmt = query.get('format', ['full'])[0]
+                return 200, mailbox.render(message, fmt, query.get('metadataHeaders', []))
+
+            match = re.fullmatch(r'/threads/([^/]+)', route)
+            if method == 'GET' and match:
+                messages = sorted(
+                    (message for message in mailbox.messages.values() if message['threadId'] == match.group(1)),
+                    key=lambda message: int(message['internalDate'])
+                )
+                if not messages:
+                    return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+                fmt = query.get('format', ['full'])[0]
+                return 200, {
+                    'id': match.group(1),
+                    'historyId': str(mailbox.history_id),
+                    'messages': [mailbox.render(message, fmt, query.get('metadataHeaders', [])) for message in messages]
+                }
+
+            if method == 'GET' and route == '/labels':
+                return 200, {'labels': list(mailbox.labels.values())}
+
+            if method == 'POST' and route == '/labels':
+                request = json.loads(body or b'{}')
+                label = mailbox.create_label(request.get('name', ''))
+                if label is None:
+                    return 409, {'error': {'code': 409, 'message': 'Label name exists or conflicts'}}
+                return 200, label
+
+            match = re.fullmatch(r'/labels/([^/]+)', route)
+            if method == 'DELETE' and match:
+                if not mailbox.delete_label(match.group(1)):
+                    return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+                return 204, {}
+
+            if method == 'POST' and route == '/messages/batchModify':
+                request = json.loads(body or b'{}')
+                ids = request.get('ids', [])
+                if len(ids) > BATCH_MODIFY_MAX_IDS:
+                    return 400, {'error': {'code': 400, 'message': f"Too many ids, at most {BATCH_MODIFY_MAX_IDS}"}}
+                add = request.get('addLabelIds', [])
+                remove = request.get('removeLabelIds', [])
+                for label in add + remove:
+                    if label not in mailbox.labels:
+                        return 400, {'error': {'code': 400, 'message': f"Invalid label: {label}"}}
+                for message_id in ids:
+                    if message_id in mailbox.messages:
+                        mailbox.modify_labels(message_id, add, remove)
+                return 204, {}
+
+            match = re.fullmatch(r'/messages/([^/]+)/trash', route)
+            if method == 'POST' and match:
+                message = mailbox.messages.get(match.group(1))
+                if message is None:
+                    return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+                mailbox.modify_labels(message['id'], ['TRASH'], ['INBOX'])
+                return 200, mailbox.render(message, 'minimal', [])
+
+        return 404, {'error': {'code': 404, 'message': f"Unknown route {route}"}}
+
+    def _handle_batch(self, body: bytes) -> None:
+        content_type = self.headers.get('Content-Type', '')
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + body
+        )
+        boundary = f"batch_{uuid.uuid4().hex}"
+        chunks: List[str] = []
+        for part in message.iter_parts():
+            content_id = part.get('Content-ID', '<>').strip()
+            inner = part.get_payload(decode=True) or part.get_payload().encode('utf-8')
+            request_line, _, rest = inner.decode('utf-8').partition('\n')
+            method, path, _ = request_line.strip().split(' ', 2)
+            sections = re.split(r'\r?\n\r?\n', rest, maxsplit=1)
+            inner_body = sections[1].encode('utf-8') if len(sections) > 1 else b''
+            if self.server.batch_item_latency_ms:
+                time.sleep(self.server.batch_item_latency_ms / 1000.0)
+            if self.server.inject_error():
+                status, payload = self.server.error_status, self._error_payload()
+            else:
+                status, payload = self.server_dispatch(method, path, inner_body)
+            reason = 'OK' if status < 400 else 'Error'
+            chunks.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id[1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} {reason}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        chunks.append(f"--{boundary}--\r\n")
+        self._send(200, ''.join(chunks).encode('utf-8'), f"multipart/mixed; boundary={boundary}")
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+def start_fake_gmail(host: str = '127.0.0.1', port: int = 0, message_count: int = 500,
+                     latency_ms: float = 0.0, batch_item_latency_ms: float = 0.0, userinfo_latency_ms: float = 0.0,
+                     error_rate: float = 0.0, error_status: int = 503, seed: int = 0) -> FakeGmailServer:
+    """Start the fake server on a background thread and return it."""
+    server = FakeGmailServer(
+        (host, port), FakeMailbox(message_count), latency_ms, batch_item_latency_ms, userinfo_latency_ms,
+        error_rate, error_status, seed
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Fake Gmail server listening on {server.root_url}")
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local fake Gmail API server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--batch-item-latency-ms', type=float, default=0.0)
+    parser.add_argument('--userinfo-latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument('--error-status', type=int, default=503)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeGmailServer(
+        (args.host, args.port), FakeMailbox(args.messages), args.latency_ms, args.batch_item_latency_ms,
+        args.userinfo_latency_ms, args.error_rate, args.error_status
+    )
+    print(f"Fake Gmail server listening on {server.root_url}")
+    server.serve_forever()
@@ -0,0 +1,193 @@
+"""Local stand-in for the OpenRouter chat completions API.
+
+Run with `python -m fakes.fake_openrouter --port 8091` from the backend directory and
+point the backend at it with OPENROUTER_API_URL=http://127.0.0.1:8091/api/v1/chat/completions.
+
+Replies follow the formats AIAnalyzer asks for: the line format for single emails and a
+JSON array for packed batches. Latency is a fixed per-request cost plus a per-email cost,
+approximating prompt processing and generation time. Requests with "stream": true get
+server-sent events: the first token after the request latency, then one chunk per word
+spaced by the per-token latency. With an error rate set, that fraction of completions
+fail with the configured status (after the request latency, like an overloaded provider).
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+COMPLETIONS_PATH = '/api/v1/chat/completions'
+BATCH_MARKER = re.compile(r'^### (E\d+)$', re.MULTILINE)
+
+
+def _analysis_for(text: str) -> Dict[str, Any]:
+    promotional = 'unsubscribe' in text.lower() or 'sale' in text.lower()
+    return {
+        'topic': 'fake analysis',
+        'sentiment': 'neutral',
+        'priority': 'low' if promotional else 'medium',
+        'category': 'promotional' if promotional else 'important',
+        'should_trash': promotional,
+        'key_points': ['generated by the fake OpenRouter server'],
+        'action_items': []
+    }
+
+
+def _single_reply(prompt: str) -> str:
+    analysis = _analysis_for(prompt)
+    return (
+        f"1. Topic: {analysis['topic']}\n"
+        f"2. Sentiment: {analysis['sentiment']}\n"
+        f"3. Priority: {analysis['priority']}\n"
+        f"4. Category: {analysis['category']}\n"
+        f"5. Move to trash: {'yes' if analysis['should_trash'] else 'no'}\n"
+    )
+
+
+def _batch_reply(prompt: str, refs: List[str]) -> str:
+    sections = BATCH_MARKER.split(prompt)[1:]
+    bodies = dict(zip(sections[0::2], sections[1::2]))
+    return json.dumps([dict(_analysis_for(bodies.get(ref, '')), id=ref) for ref in refs])
+
+
+class FakeOpenRouterServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], latency_ms: float = 0.0, per_email_latency_ms: float = 0.0,
+                 token_latency_ms: float = 0.0, error_rate: float = 0.0, error_status: int = 503, seed: int = 0):
+        super().__init__(address, FakeOpenRouterHandler)
+        self.latency_ms = latency_ms
+        self.per_email_latency_ms = per_email_latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.injected_errors = 0
+        self.count_lock = threading.Lock()
+
+    def inject_error(self) -> bool:
+        """Whether this completion should fail with error_status."""
+        if not self.error_rate:
+            return False
+        with self.count_lock:
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.injected_errors += 1
+            return failed
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{COMPLETIONS_PATH}"
+
+
+class FakeOpenRouterHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: FakeOpenRouterServer
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, completion_id: str, model: str, content: str) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for index, token in enumerate(re.findall(r'\S+\s*', content)):
+            if index:
+                time.sleep(self.server.token_latency_ms / 1000.0)
+            chunk = {
+                'id': completion_id,
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if self.path != COMPLETIONS_PATH:
+            self._send_json(404, {'error': {'message': f"Unknown route {self.path}"}})
+            return
+
+        with self.server.count_lock:
+            self.server.request_count += 1
+
+        prompt = request.get('messages', [{}])[-1].get('content', '')
+        refs = BATCH_MARKER.findall(prompt)
+        email_count = max(len(refs), 1)
+        time.sleep((self.server.latency_ms + self.server.per_email_latency_ms * email_count) / 1000.0)
+        if self.server.inject_error():
+            status = self.server.error_status
+            self._send_json(status, {'error': {'code': status, 'message': f"Injected error {status}"}})
+            return
+
+        content = _batch_reply(prompt, refs) if refs else _single_reply(prompt)
+        if request.get('stream'):
+            self._send_stream(f"fake-{self.server.request_count}", request.get('model'), content)
+            return
+        prompt_tokens = len(prompt) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        self._send_json(200, {
+            'id': f"fake-{self.server.request_count}",
+            'model': request.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        })
+
+
+def start_fake_openrouter(host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0.0,
+                          per_email_latency_ms: float = 0.0, token_latency_ms: float = 0.0, error_rate: float = 0.0,
+                          error_status: int = 503, seed: int = 0) -> FakeOpenRouterServer:
+    """Start the fake server on a background thread and return it."""
+    server = FakeOpenRouterServer(
+        (host, port), latency_ms, per_email_latency_ms, token_latency_ms, error_rate, error_status, seed
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Fake OpenRouter server listening on {server.api_url}")
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local fake OpenRouter server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--per-email-latency-ms', type=float, default=0.0)
+    parser.add_argument('--token-latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of completions that fail")
+    parser.add_argument('--error-status', type=int, default=503)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeOpenRouterServer((args.host, args.port), args.latency_ms, args.per_email_latency_ms,
+                                  args.token_latency_ms, args.error_rate, args.error_status)
+    print(f"Fake OpenRouter server listening on {server.api_url}")
+    server.serve_forever()
@@ -0,0 +1,102 @@
+import logging
+import os
+import re
+from typing import Any, Dict, FrozenSet, List, Optional, Pattern
+
+logger = logging.getLogger(__name__)
+
+# Headers the rules look at (lowercased); parse_message keeps these alongside the body
+CLASSIFIER_HEADERS = ('list-unsubscribe', 'list-id', 'precedence', 'auto-submitted')
+
+# A person flagged this mail; never second-guess that without the model
+PROTECTED_LABELS = frozenset({'IMPORTANT', 'STARRED'})
+
+
+class Rule:
+    """One compiled classification rule over labels and headers.
+
+    Matches when the message has every label in `all_labels`, at least one of
+    `any_labels` (if given), none of `excluded_labels`, and every header pattern
+    matches (a missing header never matches).
+    """
+
+    def __init__(self, name: str, category: str, priority: str, should_trash: bool,
+                 all_labels: tuple = (), any_labels: tuple = (), excluded_labels: FrozenSet[str] = PROTECTED_LABELS,
+                 headers: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.result = {"category": category, "priority": priority, "should_trash": should_trash}
+        self.all_labels = frozenset(all_labels)
+        self.any_labels = frozenset(any_labels)
+        self.excluded_labels = frozenset(excluded_labels)
+        self.headers: Dict[str, Pattern] = {
+            name.lower(): re.compile(pattern, re.IGNORECASE) for name, pattern in (headers or {}).items()
+        }
+
+    def matches(self, labels: FrozenSet[str], headers: Dict[str, str]) -> bool:
+        if not self.all_labels <= labels:
+            return False
+        if self.any_labels and not self.any_labels & labels:
+            return False
+        if self.excluded_labels & labels:
+            return False
+        for name, pattern in self.headers.items():
+            value = headers.get(name)
+            if value is None or not pattern.search(value):
+                return False
+        return True
+
+
+BULK_PRECEDENCE = r'^\s*(bulk|list|junk)\s*$'
+
+# Evaluated in order; the first match wins. Categories follow the LLM prompt's vocabulary.
+DEFAULT_RULES = [
+    Rule('spam_label', 'spam', 'low', True, all_labels=('SPAM',), excluded_labels=frozenset()),
+    Rule('promotions_unsubscribable', 'promotional', 'low', True,
+         all_labels=('CATEGORY_PROMOTIONS',), headers={'List-Unsubscribe': r'\S'}),
+    Rule('promotions_label', 'promotional', 'low', False, all_labels=('CATEGORY_PROMOTIONS',)),
+    Rule('social_label', 'social', 'low', False, all_labels=('CATEGORY_SOCIAL',)),
+    Rule('forums_label', 'updates', 'low', False, all_labels=('CATEGORY_FORUMS',)),
+    Rule('updates_label', 'updates', 'low', False, all_labels=('CATEGORY_UPDATES',)),
+    Rule('bulk_mailing_list', 'promotional', 'low', False,
+         headers={'Precedence': BULK_PRECEDENCE, 'List-Unsubscribe': r'\S'}),
+    Rule('auto_generated', 'updates', 'low', False, headers={'Auto-Submitted': r'^\s*auto-(generated|replied)'}),
+]
+
+
+class FastClassifier:
+    """Classifies mail from Gmail labels and headers without a model call.
+
+    Only confident matches get a result; everything else is left for the LLM.
+    """
+
+    def __init__(self, rules: Optional[List[Rule]] = None):
+        self.rules = rules if rules is not None else DEFAULT_RULES
+        self.enabled = os.getenv('FAST_CLASSIFIER_ENABLED', 'true').lower() == 'true'
+
+    def classify(self, email: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """`email` is a parse_message result: subject, labels and classifier headers."""
+        if not self.enabled:
+            return None
+        labels = frozenset(email.get('labels') or [])
+        headers = {name.lower(): value for name, value in (email.get('headers') or {}).items()}
+        for rule in self.rules:
+            if rule.matches(labels, headers):
+                logger.debug(f"Fast path rule {rule.name} matched")
+                return {
+                    "topic": (email.get('subject') or '').strip().lower(),
+                    "sentiment": "neutral",
+                    **rule.result,
+                    "key_points": [],
+                    "action_items": [],
+                    "rule": rule.name
+                }
+        return None
+
+    def classify_batch(self, emails: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Classify many emails keyed by message id; ambiguous ones are left out."""
+        results = {}
+        for message_id, email in emails.items():
+            result = self.classify(email)
+            if result is not None:
+                results[message_id] = result
+        return results
@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from fast_classifier import FastClassifier
+from gmail_service import GmailService
+from label_registry import is_label_not_found
+
+logger = logging.getLogger(__name__)
+
+
+class GatorTriage:
+    """Moves low-value inbox mail to the Lator Gator label.
+
+    Decisions come from the fast classifier over labels, so triage never calls the
+    model. Moves are applied with batchModify, and mail that already carries the
+    label is left alone, so re-running over the same page changes nothing. Triage
+    runs on request (POST /emails/triage); listings only report what was moved.
+
+    Each user's label id is kept once resolved, until Gmail says the label is gone.
+    """
+
+    def __init__(self, gmail_service: GmailService, classifier: FastClassifier):
+        self.gmail_service = gmail_service
+        self.classifier = classifier
+        self.enabled = os.getenv('GATOR_TRIAGE_ENABLED', 'true').lower() == 'true'
+        self.label_name = os.getenv('GATOR_LABEL_NAME', 'Lator Gator')
+        self.categories = {
+            category.strip() for category in os.getenv('GATOR_TRIAGE_CATEGORIES', 'promotional,social').split(',')
+            if category.strip()
+        }
+        self.max_users = int(os.getenv('LABEL_REGISTRY_MAX_USERS', '10000'))
+        self._label_ids: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached_label_id(self, user_email: str) -> Optional[str]:
+        with self._lock:
+            label_id = self._label_ids.get(user_email)
+            if label_id is not None:
+                self._label_ids.move_to_end(user_email)
+            return label_id
+
+    def _remember(self, user_email: str, label_id: str) -> None:
+        with self._lock:
+            self._label_ids[user_email] = label_id
+            self._label_ids.move_to_end(user_email)
+            while len(self._label_ids) > self.max_users:
+                self._label_ids.popitem(last=False)
+
+    def forget(self, user_email: str) -> None:
+        """Drop the user's label id, and the registry's labels, after Gmail rejected it."""
+        with self._lock:
+            self._label_ids.pop(user_email, None)
+        self.gmail_service.label_registry.invalidate(user_email)
+
+    def label_id(self, service, user_email: str) -> str:
+        """The user's Lator Gator label id, created on first use."""
+        label_id = self._cached_label_id(user_email)
+        if label_id is None:
+            label_id = self.gmail_service.create_or_get_label_id(service, user_email, self.label_name)
+            self._remember(user_email, label_id)
+        return label_id
+
+    def mark_moved(self, service, user_email: str, emails: List[Dict[str, Any]]) -> None:
+        """Set moved_to_gator on each email from its labels without moving or creating anything."""
+        label_id = self._cached_label_id(user_email)
+        if label_id is None:
+            label_id = self.gmail_service.label_registry.get(service, user_email, self.label_name)
+            if label_id is not None:
+                self._remember(user_email, label_id)
+        for email in emails:
+            email['moved_to_gator'] = label_id is not None and label_id in (email.get('labels') or [])
+
+    def should_move(self, email: Dict[str, Any]) -> bool:
+        if 'INBOX' not in (email.get('labels') or []):
+            return False
+        result = self.classifier.classify(email)
+        return result is not None and result['category'] in self.categories
+
+    def triage(self, service, user_email: str, emails: List[Dict[str, Any]]) -> int:
+        """Move qualifying emails and mark every email's moved_to_gator; returns how many moved.
+
+        Emails are updated in place with their new labels.
+        """
+        if not emails:
+            return 0
+        label_id = self.label_id(service, user_email)
+
+        to_move = [
+            email for email in emails
+            if label_id not in (email.get('labels') or []) and self.should_move(email)
+        ]
+        if to_move:
+            message_ids = [email['id'] for email in to_move]
+            try:
+                self.gmail_service.batch_modify(
+                    service, message_ids, add_label_ids=[label_id], remove_label_ids=['INBOX']
+                )
+            except Exception as e:
+                if not is_label_not_found(e):
+                    raise
+                # The label was deleted in Gmail since it was cached; look it up again once
+                logger.debug(f"Label {self.label_name} is gone, refreshing labels")
+                self.forget(user_email)
+                label_id = self.label_id(service, user_email)
+                self.gmail_service.batch_modify(
+                    service, message_ids, add_label_ids=[label_id], remove_label_ids=['INBOX']
+                )
+            for email in to_move:
+                email['labels'] = [label for label in email['labels'] if label != 'INBOX'] + [label_id]
+            logger.debug(f"Moved {len(to_move)} emails to {self.label_name}")
+
+        for email in emails:
+            email['moved_to_gator'] = label_id in (email.get('labels') or [])
+        return len(to_move)
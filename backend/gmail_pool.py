@@ -0,0 +1,236 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import google_auth_httplib2
+import httplib2
+from google.auth.exceptions import RefreshError
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+
+from metrics import GMAIL_CLIENT_DURATION, current_endpoint, timed
+from outbound import get_upstream, gmail_quota_units
+
+logger = logging.getLogger(__name__)
+
+_discovery_lock = threading.Lock()
+_discovery_doc: Optional[Dict[str, Any]] = None
+
+
+def get_gmail_discovery_doc() -> Dict[str, Any]:
+    """Load and parse the bundled Gmail discovery document once per process."""
+    global _discovery_doc
+    if _discovery_doc is None:
+        with _discovery_lock:
+            if _discovery_doc is None:
+                logger.debug("Loading Gmail discovery document...")
+                raw = get_static_doc('gmail', 'v1')
+                if not raw:
+                    raise ValueError("Gmail discovery document is not bundled with googleapiclient")
+                doc = json.loads(raw)
+                # Allows pointing every call, including /batch, at a local fake Gmail server
+                root_url = os.getenv('GMAIL_API_ROOT_URL')
+                if root_url:
+                    doc['rootUrl'] = root_url.rstrip('/') + '/'
+                _discovery_doc = doc
+    return _discovery_doc
+
+
+class GuardedHttpRequest(HttpRequest):
+    """HttpRequest whose execute() goes through the Gmail quota limiter, retries and breaker.
+
+    Requests added to a batch are sent by BatchHttpRequest instead; callers guard those
+    with quota_units().
+    """
+
+    def __init__(self, *args, user_key: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_key = user_key
+
+    def quota_units(self) -> int:
+        return gmail_quota_units(self.methodId)
+
+    def execute(self, http=None, num_retries=0):
+        return get_upstream('gmail').call(
+            lambda: super(GuardedHttpRequest, self).execute(http=http),
+            cost=self.quota_units(),
+            user_key=self.user_key,
+            operation=self.methodId
+        )
+
+
+class RevocationAwareHttp(google_auth_httplib2.AuthorizedHttp):
+    """AuthorizedHttp that reports when Google rejects the access token.
+
+    Tokens arrive without a refresh token, so a 401 surfaces as a RefreshError when
+    AuthorizedHttp tries to refresh; batch requests see the 401 response itself.
+    """
+
+    def __init__(self, credentials: Credentials, http: httplib2.Http, on_unauthorized: Callable[[str], None]):
+        super().__init__(credentials, http=http)
+        self.on_unauthorized = on_unauthorized
+
+    def request(self, *args, **kwargs):
+        token = self.credentials.token
+        try:
+            response, content = super().request(*args, **kwargs)
+        except RefreshError:
+            self.on_unauthorized(token)
+            raise
+        if response.status == 401:
+            self.on_unauthorized(token)
+        return response, content
+
+
+class PooledGmailClient:
+    """Gmail resource bound to one access token.
+
+    httplib2 connections are not thread-safe, so each worker thread gets its own
+    authorized keep-alive connection through the request builder.
+    """
+
+    def __init__(self, credentials: Credentials, timeout: float, user_key: str,
+                 on_unauthorized: Callable[[str], None]):
+        self.credentials = credentials
+        self.user_key = user_key
+        self.timeout = timeout
+        self.on_unauthorized = on_unauthorized
+        self.last_used = time.monotonic()
+        self._local = threading.local()
+        self.service = build_from_document(
+            get_gmail_discovery_doc(),
+            http=self._authorized_http(),
+            requestBuilder=self._build_request
+        )
+
+    def _authorized_http(self) -> google_auth_httplib2.AuthorizedHttp:
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = RevocationAwareHttp(
+                self.credentials,
+                http=httplib2.Http(timeout=self.timeout),
+                on_unauthorized=self.on_unauthorized
+            )
+            self._local.http = http
+        return http
+
+    def _build_request(self, _http, *args, **kwargs) -> HttpRequest:
+        return GuardedHttpRequest(self._authorized_http(), *args, user_key=self.user_key, **kwargs)
+
+
+class GmailClientPool:
+    """Per-user pool of authorized Gmail clients with idle eviction.
+
+    `on_unauthorized(token)` is called whenever Google rejects a pooled client's
+    token; the client is dropped from the pool either way.
+    """
+
+    def __init__(self, max_clients: Optional[int] = None, idle_seconds: Optional[int] = None,
+                 on_unauthorized: Optional[Callable[[str], None]] = None):
+        self.max_clients = max_clients or int(os.getenv('GMAIL_POOL_MAX_CLIENTS', '500'))
+        self.idle_seconds = idle_seconds or int(os.getenv('GMAIL_POOL_IDLE_SECONDS', '900'))
+        self.timeout = float(os.getenv('GMAIL_HTTP_TIMEOUT_SECONDS', '30'))
+        self.on_unauthorized = on_unauthorized
+        self._clients: "OrderedDict[str, PooledGmailClient]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.idle_evictions = 0
+        self.capacity_evictions = 0
+
+    @staticmethod
+    def _key(credentials: Credentials) -> str:
+        return GmailClientPool._token_key(credentials.token)
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _unauthorized(self, token: str) -> None:
+        logger.info("Google rejected a pooled access token; dropping its client")
+        self.invalidate(token)
+        if self.on_unauthorized is not None:
+            self.on_unauthorized(token)
+
+    def _evict_idle(self, now: float) -> None:
+        # Entries are kept in last-used order, so idle ones sit at the front
+        while self._clients:
+            key, client = next(iter(self._clients.items()))
+            if now - client.last_used < self.idle_seconds:
+                break
+            del self._clients[key]
+            self.idle_evictions += 1
+
+    def get_client(self, credentials: Credentials):
+        with timed(GMAIL_CLIENT_DURATION) as labels:
+            service, labels['outcome'] = self._get_client(credentials)
+            return service
+
+    def get_cached(self, credentials: Credentials):
+        """The pooled client for these credentials, or None without building one."""
+        start = time.perf_counter()
+        service = self._lookup(self._key(credentials), time.monotonic())
+        if service is not None:
+            # Misses are recorded by the get_client call that builds the client
+            GMAIL_CLIENT_DURATION.observe(time.perf_counter() - start, endpoint=current_endpoint.get(), outcome='hit')
+        return service
+
+    def _lookup(self, key: str, now: float):
+        with self._lock:
+            self._evict_idle(now)
+            client = self._clients.get(key)
+            if client is None:
+                return None
+            client.last_used = now
+            self._clients.move_to_end(key)
+            self.hits += 1
+            return client.service
+
+    def _get_client(self, credentials: Credentials):
+        key = self._key(credentials)
+        now = time.monotonic()
+        service = self._lookup(key, now)
+        if service is not None:
+            return service, 'hit'
+        with self._lock:
+            self.misses += 1
+
+        logger.debug("Building pooled Gmail client...")
+        client = PooledGmailClient(credentials, self.timeout, key, self._unauthorized)
+
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing is not None:
+                # Another request built the same client concurrently; keep the first one
+                existing.last_used = now
+                return existing.service, 'miss'
+            self._clients[key] = client
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+                self.capacity_evictions += 1
+        return client.service, 'miss'
+
+    def invalidate(self, token: str) -> None:
+        with self._lock:
+            self._clients.pop(self._token_key(token), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._clients),
+                "max_clients": self.max_clients,
+                "idle_seconds": self.idle_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "idle_evictions": self.idle_evictions,
+                "capacity_evictions": self.capacity_evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -1,17 +1,31 @@
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 import os
 import json
+import base64
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
+import asyncio
 import pickle
+import time
 from datetime import datetime
 import requests
+from googleapiclient.errors import HttpError
+from identity_cache import IdentityCache
+from gmail_pool import GmailClientPool
+from label_registry import LabelRegistry
+from async_io import get_http_client, run_gmail
+from outbound import get_upstream, is_retryable_http_error, parse_retry_after
+from mime_extract import extract_body
+from fast_classifier import CLASSIFIER_HEADERS
 
 logger = logging.getLogger(__name__)
 
+GMAIL_MAX_BATCH_SIZE = 100
+GMAIL_MAX_BATCH_MODIFY_IDS = 1000
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+
 class GmailService:
     def __init__(self):
         # Update scopes to include userinfo.email
@@ -28,6 +42,16 @@ class GmailService:
         
         if not self.client_id or not self.client_secret:
             raise ValueError("GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET must be set in environment variables")
+
+        self.userinfo_url = os.getenv('GOOGLE_USERINFO_URL', 'https://www.googleapis.com/oauth2/v3/userinfo')
+        self.identity_cache = IdentityCache()
+        self.client_pool = GmailClientPool(on_unauthorized=self.identity_cache.invalidate)
+        self.label_registry = LabelRegistry()
+        # Gmail accepts at most 100 calls per batch request
+        self.batch_size = max(1, min(int(os.getenv('GMAIL_BATCH_SIZE', '50')), GMAIL_MAX_BATCH_SIZE))
+        self.stream_chunk_size = max(1, min(int(os.getenv('GMAIL_STREAM_CHUNK_SIZE', '10')), GMAIL_MAX_BATCH_SIZE))
+        # Bodies beyond this are trimmed before they reach a prompt
+        self.llm_input_token_budget = int(os.getenv('LLM_INPUT_TOKEN_BUDGET', '2000'))
         
     def get_auth_url(self) -> str:
         try:
@@ -97,41 +121,86 @@ class GmailService:
                 logger.error(f"Error response: {e.response.text}")
             raise ValueError(f"Failed to get credentials: {str(e)}")
 
+    def forget_token(self, token: str) -> None:
+        """Drop everything cached for an access token, so it has to be verified with Google again."""
+        self.identity_cache.invalidate(token)
+        self.client_pool.invalidate(token)
+
     def get_user_email(self, credentials: Credentials) -> Optional[str]:
+        cached_email = self.identity_cache.get(credentials.token)
+        if cached_email:
+            logger.debug(f"User email served from identity cache: {cached_email}")
+            return cached_email
+
         try:
             logger.debug("Getting user email from userinfo endpoint...")
-            userinfo_url = "https://www.googleapis.com/oauth2/v3/userinfo"
             headers = {"Authorization": f"Bearer {credentials.token}"}
-            response = requests.get(userinfo_url, headers=headers)
+            userinfo = get_upstream('userinfo')
+            response = userinfo.call(
+                lambda: requests.get(self.userinfo_url, headers=headers, timeout=userinfo.timeout),
+                operation='userinfo'
+            )
+            if response.status_code == 200:
+                email = response.json().get("email")
+                logger.debug(f"Successfully obtained user email: {email}")
+                self.identity_cache.put(credentials.token, email, credentials.expiry)
+                return email
+            else:
+                logger.error(f"Failed to fetch userinfo: {response.status_code}")
+                if response.status_code == 401:
+                    self.forget_token(credentials.token)
+        except Exception as e:
+            logger.error(f"Error getting user email: {e}")
+        return None
+
+    async def get_user_email_async(self, credentials: Credentials) -> Optional[str]:
+        cached_email = self.identity_cache.get(credentials.token)
+        if cached_email:
+            logger.debug(f"User email served from identity cache: {cached_email}")
+            return cached_email
+
+        try:
+            logger.debug("Getting user email from userinfo endpoint (async)...")
+            headers = {"Authorization": f"Bearer {credentials.token}"}
+            userinfo = get_upstream('userinfo')
+            response = await userinfo.call_async(
+                lambda: get_http_client().get(self.userinfo_url, headers=headers, timeout=userinfo.timeout),
+                operation='userinfo'
+            )
             if response.status_code == 200:
                 email = response.json().get("email")
                 logger.debug(f"Successfully obtained user email: {email}")
+                self.identity_cache.put(credentials.token, email, credentials.expiry)
                 return email
             else:
                 logger.error(f"Failed to fetch userinfo: {response.status_code}")
+                if response.status_code == 401:
+                    self.forget_token(credentials.token)
         except Exception as e:
             logger.error(f"Error getting user email: {e}")
         return None
 
+    def _build_credentials(self, token: str) -> Credentials:
+        return Credentials(
+            token=token,
+            refresh_token=None,
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id=self.client_id,
+            client_secret=self.client_secret,
+            scopes=self.SCOPES
+        )
+
     def get_credentials_from_token(self, token: str) -> Credentials:
         """Create credentials from an access token."""
         try:
             logger.debug("Creating credentials from token...")
             
             # Create credentials with token
-            credentials = Credentials(
-                token=token,
-                refresh_token=None,
-                token_uri="https://oauth2.googleapis.com/token",
-                client_id=self.client_id,
-                client_secret=self.client_secret,
-                scopes=self.SCOPES
-            )
+            credentials = self._build_credentials(token)
             
-            # Get user email
+            # Resolve the user email now so handlers get it from the identity cache
             try:
                 email = self.get_user_email(credentials)
-                credentials.id_token = email
                 logger.debug(f"Successfully obtained user email: {email}")
             except Exception as e:
                 logger.warning(f"Could not get user email: {str(e)}")
@@ -143,9 +212,27 @@ class GmailService:
             logger.error(f"Error creating credentials from token: {str(e)}")
             raise
 
+    async def get_credentials_from_token_async(self, token: str) -> Credentials:
+        """Create credentials from an access token without blocking the event loop."""
+        try:
+            logger.debug("Creating credentials from token (async)...")
+            credentials = self._build_credentials(token)
+            
+            try:
+                email = await self.get_user_email_async(credentials)
+                logger.debug(f"Successfully obtained user email: {email}")
+            except Exception as e:
+                logger.warning(f"Could not get user email: {str(e)}")
+            
+            return credentials
+            
+        except Exception as e:
+            logger.error(f"Error creating credentials from token: {str(e)}")
+            raise
+
     def get_gmail_service(self, credentials: Credentials):
         try:
-            logger.debug("Building Gmail service...")
+            logger.debug("Getting pooled Gmail service...")
             
             # Verify credentials are valid
             if not credentials or not credentials.valid:
@@ -156,25 +243,57 @@ class GmailService:
                     logger.error("Invalid credentials provided")
                     raise ValueError("Invalid credentials provided")
             
-            # Build the service
-            service = build('gmail', 'v1', credentials=credentials)
-            
-            # Verify the service is working by making a simple API call
-            try:
-                profile = service.users().getProfile(userId='me').execute()
-                logger.debug(f"Gmail profile verified: {profile}")
-            except Exception as e:
-                logger.error(f"Failed to verify Gmail service: {str(e)}")
-                raise
+            # Reuse the per-user client; a bad token surfaces on the first real call
+            service = self.client_pool.get_client(credentials)
             
-            logger.debug("Successfully built and verified Gmail service")
+            logger.debug("Successfully obtained Gmail service")
             return service
         except Exception as e:
             logger.error(f"Error building Gmail service: {str(e)}")
             raise
 
-    def list_emails(self, credentials: Credentials) -> tuple[list[dict], int]:
-        """List emails from Gmail inbox."""
+    async def get_gmail_service_async(self, credentials: Credentials):
+        """get_gmail_service for async handlers.
+
+        Pool hits return straight away; refreshing credentials or building a new
+        client runs on the Gmail executor so the event loop is never blocked.
+        """
+        if credentials and credentials.valid:
+            service = self.client_pool.get_cached(credentials)
+            if service is not None:
+                return service
+        return await run_gmail(self.get_gmail_service, credentials)
+
+    def list_message_ids(self, service, page_size: int = 10, page_token: Optional[str] = None,
+                         query: Optional[str] = None,
+                         label_ids: Optional[List[str]] = None) -> tuple[list[str], Optional[str]]:
+        """Return one page of message ids and Gmail's token for the next page."""
+        params = {
+            'userId': 'me',
+            'maxResults': page_size,
+            'includeSpamTrash': False
+        }
+        if page_token:
+            params['pageToken'] = page_token
+        if query:
+            params['q'] = query
+        if label_ids:
+            params['labelIds'] = label_ids
+
+        try:
+            results = service.users().messages().list(**params).execute()
+        except Exception as e:
+            logger.error(f"Error listing messages: {str(e)}")
+            raise
+
+        messages = results.get('messages', [])
+        logger.debug(f"Found {len(messages)} messages")
+        return [message['id'] for message in messages], results.get('nextPageToken')
+
+    def list_emails(self, credentials: Credentials, page_size: int = 10, page_token: Optional[str] = None,
+                    query: Optional[str] = None,
+                    label_ids: Optional[List[str]] = None) -> tuple[list[dict], int, Optional[str]]:
+        """List one page of emails from Gmail along with the next page token."""
         try:
             logger.debug("Starting to list emails...")
             
@@ -183,87 +302,233 @@ class GmailService:
             if not service:
                 raise ValueError("Failed to initialize Gmail service")
             
-            # Get user's profile to verify service is working
-            try:
-                profile = service.users().getProfile(userId='me').execute()
-                logger.debug(f"Gmail profile: {profile}")
-            except Exception as e:
-                logger.error(f"Error getting Gmail profile: {str(e)}")
-                raise
-            
             # Get messages
-            try:
-                results = service.users().messages().list(
-                    userId='me',
-                    maxResults=10,
-                    includeSpamTrash=False
-                ).execute()
-                
-                messages = results.get('messages', [])
-                if not messages:
-                    logger.warning("No messages found in inbox")
-                    return [], 0
-                
-                logger.debug(f"Found {len(messages)} messages")
-                
-            except Exception as e:
-                logger.error(f"Error listing messages: {str(e)}")
-                raise
+            message_ids, next_page_token = self.list_message_ids(
+                service, page_size, page_token, query, label_ids
+            )
+            if not message_ids:
+                logger.warning("No messages found in inbox")
+                return [], 0, None
+            
+            # Fetch metadata for the whole page in Gmail batch requests
+            fetched = self.get_messages_batch(
+                service,
+                message_ids,
+                format='metadata',
+                metadata_headers=METADATA_HEADERS
+            )
             
             # Process messages
             processed_emails = []
             moved_count = 0
             
-            for message in messages:
+            for msg in fetched:
                 try:
-                    msg = service.users().messages().get(
-                        userId='me',
-                        id=message['id'],
-                        format='metadata',
-                        metadataHeaders=['Subject', 'From', 'Date']
-                    ).execute()
-                    
-                    # Extract headers
-                    headers = msg.get('payload', {}).get('headers', [])
-                    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-                    from_address = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-                    date = next((h['value'] for h in headers if h['name'] == 'Date'), 'No Date')
-                    
-                    # Check if email should be moved to Lator Gator
-                    moved_to_gator = False
-                    if 'labelIds' in msg:
-                        if 'INBOX' in msg['labelIds']:
-                            # Here you can add logic to determine if email should be moved
-                            # For now, we'll just mark it as not moved
-                            moved_to_gator = False
-                    
-                    processed_emails.append({
-                        'id': msg['id'],
-                        'thread_id': msg.get('threadId', ''),
-                        'message_id': msg['id'],
-                        'subject': subject,
-                        'from_address': from_address,
-                        'date': date,
-                        'snippet': msg.get('snippet', ''),
-                        'labels': msg.get('labelIds', []),
-                        'moved_to_gator': moved_to_gator
-                    })
-
-                    if moved_to_gator:
+                    email = self.format_message_metadata(msg)
+                    processed_emails.append(email)
+
+                    if email['moved_to_gator']:
                         moved_count += 1
                     
                 except Exception as e:
-                    logger.error(f"Error processing message {message['id']}: {str(e)}")
+                    logger.error(f"Error processing message {msg.get('id')}: {str(e)}")
                     continue
             
             logger.debug(f"Successfully processed {len(processed_emails)} emails")
-            return processed_emails, moved_count
+            return processed_emails, moved_count, next_page_token
             
         except Exception as e:
             logger.error(f"Error in list_emails: {str(e)}")
             raise
 
-    def get_email(self, service, email_id: str) -> Dict[str, str]:
+    def get_messages_batch(self, service, message_ids: List[str], format: str = 'metadata',
+                           metadata_headers: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Fetch messages through Gmail batch requests, preserving input order.
+
+        Items rejected for rate limits or server errors are retried in a later batch
+        with backoff; other failures are logged and skipped.
+        """
+        def _request(message_id):
+            params = {'userId': 'me', 'id': message_id, 'format': format}
+            if metadata_headers:
+                params['metadataHeaders'] = metadata_headers
+            return service.users().messages().get(**params)
+
+        results, errors = self._execute_batch(service, message_ids, _request, "message gets")
+        for message_id, error in errors.items():
+            logger.error(f"Error processing message {message_id}: {error}")
+        return [results[message_id] for message_id in message_ids if message_id in results]
+
+    def trash_emails_batch(self, service, message_ids: List[str]) -> tuple[Dict[str, Any], Dict[str, str]]:
+        """Trash many messages through Gmail batch requests.
+
+        Returns the trashed messages and the error for each id that failed, both keyed by id.
+        """
+        return self._execute_batch(
+            service, message_ids,
+            lambda message_id: service.users().messages().trash(userId='me', id=message_id),
+            "message trashes"
+        )
+
+    def _execute_batch(self, service, message_ids: List[str], make_request,
+                       description: str) -> tuple[Dict[str, Any], Dict[str, str]]:
+        """Run make_request(message_id) for every id in Gmail batch requests.
+
+        Items rejected for rate limits or server errors are retried in a later batch
+        with backoff. Returns responses and error messages keyed by message id.
+        """
+        gmail = get_upstream('gmail')
+        results: Dict[str, Any] = {}
+        errors: Dict[str, str] = {}
+        retry_ids: List[str] = []
+        retry_after: List[float] = []
+
+        def _callback(request_id, response, exception):
+            if exception is not None:
+                if isinstance(exception, HttpError) and is_retryable_http_error(exception):
+                    retry_ids.append(request_id)
+                    errors[request_id] = str(exception)
+                    hint = parse_retry_after(exception.resp.get('retry-after'))
+                    if hint is not None:
+                        retry_after.append(hint)
+                    return
+                errors[request_id] = str(exception)
+                return
+            errors.pop(request_id, None)
+            results[request_id] = response
+
+        pending = list(message_ids)
+        attempt = 0
+        while pending:
+            for start in range(0, len(pending), self.batch_size):
+                chunk = pending[start:start + self.batch_size]
+                batch = service.new_batch_http_request(callback=_callback)
+                for message_id in chunk:
+                    request = make_request(message_id)
+                    batch.add(request, request_id=message_id)
+                logger.debug(f"Executing Gmail batch of {len(chunk)} {description}")
+                # Each call inside a batch is charged its own quota units
+                gmail.call(
+                    batch.execute, cost=request.quota_units() * len(chunk), user_key=request.user_key,
+                    operation=f"batch:{request.methodId}"
+                )
+
+            if not retry_ids:
+                break
+            attempt += 1
+            delay = gmail.retry_delay(
+                attempt, max(retry_after, default=None), f"{len(retry_ids)} throttled batch items",
+                f"batch:{request.methodId}"
+            )
+            if delay is None:
+                logger.error(f"Giving up on {len(retry_ids)} messages after {attempt - 1} retries")
+                break
+            time.sleep(delay)
+            pending = list(retry_ids)
+            retry_ids.clear()
+            retry_after.clear()
+
+        return results, errors
+
+    def get_history_id(self, service) -> str:
+        """Current mailbox historyId, used as the starting point for incremental sync."""
+        profile = service.users().getProfile(userId='me').execute()
+        return str(profile['historyId'])
+
+    def list_history(self, service, start_history_id: str) -> tuple[list[dict], str]:
+        """Return every history record after start_history_id and the latest historyId.
+
+        Raises googleapiclient HttpError 404 when start_history_id is too old to replay.
+        """
+        records = []
+        page_token = None
+        latest_history_id = start_history_id
+        while True:
+            params = {
+                'userId': 'me',
+                'startHistoryId': start_history_id,
+                'historyTypes': ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'],
+                'maxResults': 500
+            }
+            if page_token:
+                params['pageToken'] = page_token
+            response = service.users().history().list(**params).execute()
+            records.extend(response.get('history', []))
+            latest_history_id = str(response.get('historyId', latest_history_id))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        logger.debug(f"Fetched {len(records)} history records since {start_history_id}")
+        return records, latest_history_id
+
+    def format_message_metadata(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        # Extract headers
+        headers = msg.get('payload', {}).get('headers', [])
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+        from_address = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'No Date')
+
+        return {
+            'id': msg['id'],
+            'thread_id': msg.get('threadId', ''),
+            'message_id': msg['id'],
+            'subject': subject,
+            'from_address': from_address,
+            'date': date,
+            'snippet': msg.get('snippet', ''),
+            'labels': msg.get('labelIds', []),
+            # Set by the Lator Gator triage stage once the label id is known
+            'moved_to_gator': False
+        }
+
+    async def list_emails_async(self, credentials: Credentials, page_size: int = 10,
+                                page_token: Optional[str] = None, query: Optional[str] = None,
+                                label_ids: Optional[List[str]] = None) -> tuple[list[dict], int, Optional[str]]:
+        return await run_gmail(self.list_emails, credentials, page_size, page_token, query, label_ids)
+
+    async def stream_emails_async(self, service, message_ids: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        """Yield formatted metadata chunk by chunk as soon as each Gmail batch returns.
+
+        Chunks are fetched concurrently, so time to the first row does not grow with page size.
+        """
+        chunks = [
+            message_ids[start:start + self.stream_chunk_size]
+            for start in range(0, len(message_ids), self.stream_chunk_size)
+        ]
+        tasks = [
+            asyncio.ensure_future(run_gmail(
+                self.get_messages_batch, service, chunk,
+                format='metadata', metadata_headers=METADATA_HEADERS
+            ))
+            for chunk in chunks
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    fetched = await next_done
+                except Exception as e:
+                    logger.error(f"Error fetching message chunk: {str(e)}")
+                    continue
+                for msg in fetched:
+                    try:
+                        yield self.format_message_metadata(msg)
+                    except Exception as e:
+                        logger.error(f"Error processing message {msg.get('id')}: {str(e)}")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get_email_async(self, service, email_id: str) -> Dict[str, Any]:
+        return await run_gmail(self.get_email, service, email_id)
+
+    def trash_email(self, service, email_id: str) -> Dict[str, Any]:
+        return service.users().messages().trash(userId='me', id=email_id).execute()
+
+    async def trash_email_async(self, service, email_id: str) -> Dict[str, Any]:
+        # Requests must be built on the worker thread so they bind to its own connection
+        return await run_gmail(self.trash_email, service, email_id)
+
+    def get_email(self, service, email_id: str) -> Dict[str, Any]:
         try:
             logger.debug(f"Getting email content for ID: {email_id}")
             message = service.users().messages().get(
@@ -272,51 +537,85 @@ class GmailService:
                 format='full'
             ).execute()
 
-            payload = message['payload']
-            headers = payload.get('headers', [])
-
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            from_address = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-
-            # Extract text/plain part
-            import base64
-            content = ""
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    if part.get('mimeType') == 'text/plain' and part['body'].get('data'):
-                        content = base64.urlsafe_b64decode(part['body']['data']).decode()
-                        break
-            elif payload['body'].get('data'):
-                content = base64.urlsafe_b64decode(payload['body']['data']).decode()
-
+            email = self.parse_message(message)
             logger.debug("Successfully retrieved email content and metadata")
-            return {
-                "subject": subject,
-                "from": from_address,
-                "content": content
-            }
+            return email
         except Exception as e:
             logger.error(f"Error getting email content: {str(e)}")
             raise
 
-    def create_or_get_label_id(self, service, label_name="Lator Gator") -> str:
+    def parse_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Extract subject, sender and the new body text from a format='full' message."""
+        payload = message['payload']
+        headers = payload.get('headers', [])
+
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+        from_address = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+
+        # Walk every nested part, HTML included, keeping only the new text within budget
+        content = extract_body(payload, self.llm_input_token_budget)
+
+        return {
+            "subject": subject,
+            "from": from_address,
+            "content": content,
+            "thread_id": message.get('threadId', ''),
+            # Labels and list headers let the fast classifier skip the model
+            "labels": message.get('labelIds', []),
+            "headers": {h['name']: h['value'] for h in headers if h['name'].lower() in CLASSIFIER_HEADERS}
+        }
+
+    def get_thread(self, service, thread_id: str) -> List[Dict[str, Any]]:
+        """Fetch a whole conversation with one threads.get call, oldest message first.
+
+        Each message is parsed like get_email, so quoted history is already stripped,
+        plus its id, date and internal timestamp.
+        """
+        logger.debug(f"Getting thread {thread_id}")
+        thread = service.users().threads().get(userId='me', id=thread_id, format='full').execute()
+        messages = []
+        for message in thread.get('messages', []):
+            try:
+                parsed = self.parse_message(message)
+            except Exception as e:
+                logger.error(f"Error parsing message {message.get('id')} in thread {thread_id}: {str(e)}")
+                continue
+            headers = message.get('payload', {}).get('headers', [])
+            parsed.update({
+                "id": message['id'],
+                "date": next((h['value'] for h in headers if h['name'] == 'Date'), ''),
+                "internal_date": int(message.get('internalDate') or 0)
+            })
+            messages.append(parsed)
+        return sorted(messages, key=lambda message: message["internal_date"])
+
+    def get_full_messages(self, service, message_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Batch-fetch and parse several messages; ids that fail are left out."""
+        parsed = {}
+        for message in self.get_messages_batch(service, message_ids, format='full'):
+            try:
+                parsed[message['id']] = self.parse_message(message)
+            except Exception as e:
+                logger.error(f"Error parsing message {message.get('id')}: {str(e)}")
+        return parsed
+
+    def batch_modify(self, service, message_ids: List[str], add_label_ids: Optional[List[str]] = None,
+                     remove_label_ids: Optional[List[str]] = None) -> None:
+        """Change labels on many messages with one batchModify call per 1000 ids."""
+        for start in range(0, len(message_ids), GMAIL_MAX_BATCH_MODIFY_IDS):
+            chunk = message_ids[start:start + GMAIL_MAX_BATCH_MODIFY_IDS]
+            logger.debug(f"Modifying labels on {len(chunk)} messages")
+            service.users().messages().batchModify(userId='me', body={
+                'ids': chunk,
+                'addLabelIds': add_label_ids or [],
+                'removeLabelIds': remove_label_ids or []
+            }).execute()
+
+    def create_or_get_label_id(self, service, user_email: str, label_name="Lator Gator") -> str:
         try:
             logger.debug(f"Getting or creating label: {label_name}")
-            labels = service.users().labels().list(userId='me').execute().get('labels', [])
-            for label in labels:
-                if label['name'].lower() == label_name.lower():
-                    logger.debug(f"Found existing label: {label['id']}")
-                    return label['id']
-
-            # Create the label if not found
-            label_object = {
-                "name": label_name,
-                "labelListVisibility": "labelShow",
-                "messageListVisibility": "show"
-            }
-            label = service.users().labels().create(userId='me', body=label_object).execute()
-            logger.debug(f"Created new label: {label['id']}")
-            return label['id']
+            # Served from the per-user registry; Gmail is only listed on a miss or after the TTL
+            return self.label_registry.get_or_create(service, user_email, label_name)
         except Exception as e:
             logger.error(f"Error creating/getting label: {str(e)}")
             raise 
\ No newline at end of file
@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Google access tokens are issued for one hour; never trust an identity longer than that
+MAX_TOKEN_LIFETIME_SECONDS = 3600
+# Endpoints served from the database or caches never show the token to Google, so a
+# revoked token keeps resolving until its entry expires; keep that window short
+DEFAULT_TTL_SECONDS = 300
+
+
+class IdentityCache:
+    """LRU cache of access token -> user email, bounded by token expiry."""
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[int] = None):
+        self.max_entries = max_entries or int(os.getenv('IDENTITY_CACHE_MAX_ENTRIES', '10000'))
+        self.ttl_seconds = ttl_seconds or int(os.getenv('IDENTITY_CACHE_TTL_SECONDS', str(DEFAULT_TTL_SECONDS)))
+        self._entries: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        # Never keep raw tokens in memory longer than the request that carried them
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _expires_at(self, expiry: Optional[datetime]) -> float:
+        now = time.time()
+        expires_at = now + min(self.ttl_seconds, MAX_TOKEN_LIFETIME_SECONDS)
+        if expiry is not None:
+            if expiry.tzinfo is None:
+                # google-auth stores expiry as naive UTC
+                expiry = expiry.replace(tzinfo=timezone.utc)
+            expires_at = min(expires_at, expiry.timestamp())
+        return expires_at
+
+    def get(self, token: str) -> Optional[str]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            email, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return email
+
+    def put(self, token: str, email: str, expiry: Optional[datetime] = None) -> None:
+        if not token or not email:
+            return
+        expires_at = self._expires_at(expiry)
+        if expires_at <= time.time():
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (email, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, token: str) -> None:
+        """Forget a token, e.g. on logout or when Google rejects it."""
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
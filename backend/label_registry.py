@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger(__name__)
+
+# Creation is serialized per user through one of these locks, picked by hash
+LOCK_STRIPES = 64
+
+
+def is_label_not_found(e: Exception) -> bool:
+    """Gmail answers a deleted or unknown label id with 400 "Invalid label" or 404."""
+    return (
+        isinstance(e, HttpError)
+        and e.resp.status in (400, 404)
+        and b'label' in (e.content or b'').lower()
+    )
+
+
+class LabelRegistry:
+    """Per-user cache of Gmail label name -> id.
+
+    A user's labels are loaded with one labels.list call and reused until the TTL
+    passes or invalidate() is called, e.g. after Gmail rejects a cached id because
+    the label was deleted. Lookups are case-insensitive like Gmail's names.
+    """
+
+    def __init__(self, ttl_seconds: Optional[int] = None, max_users: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds or int(os.getenv('LABEL_REGISTRY_TTL_SECONDS', '600'))
+        self.max_users = max_users or int(os.getenv('LABEL_REGISTRY_MAX_USERS', '10000'))
+        self._entries: "OrderedDict[str, Tuple[Dict[str, str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._create_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.hits = 0
+        self.loads = 0
+        self.creates = 0
+        self.conflicts = 0
+        self.invalidations = 0
+
+    def _cached(self, user_key: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            entry = self._entries.get(user_key)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self._entries.move_to_end(user_key)
+            return entry[0]
+
+    def _store(self, user_key: str, labels: Dict[str, str]) -> None:
+        with self._lock:
+            self._entries[user_key] = (labels, time.time() + self.ttl_seconds)
+            self._entries.move_to_end(user_key)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def _load(self, service, user_key: str) -> Dict[str, str]:
+        logger.debug("Loading Gmail labels")
+        response = service.users().labels().list(userId='me').execute()
+        labels = {label['name'].lower(): label['id'] for label in response.get('labels', [])}
+        with self._lock:
+            self.loads += 1
+        self._store(user_key, labels)
+        return labels
+
+    def get(self, service, user_key: str, name: str) -> Optional[str]:
+        """Id of the label called `name`, or None if the user has no such label."""
+        labels = self._cached(user_key)
+        if labels is not None:
+            with self._lock:
+                self.hits += 1
+        else:
+            labels = self._load(service, user_key)
+        return labels.get(name.lower())
+
+    def get_or_create(self, service, user_key: str, name: str) -> str:
+        """Id of the label called `name`, creating it if the user has none.
+
+        Creation for a user is serialized in this process, and a 409 from a creator
+        elsewhere (another worker or instance) is settled by re-listing, so concurrent
+        callers always end up with the same single label.
+        """
+        label_id = self.get(service, user_key, name)
+        if label_id:
+            return label_id
+
+        with self._create_locks[zlib.crc32(user_key.encode('utf-8')) % LOCK_STRIPES]:
+            # Whoever held the lock may have just created it
+            labels = self._cached(user_key)
+            if labels and name.lower() in labels:
+                return labels[name.lower()]
+            labels = self._load(service, user_key)
+            if name.lower() in labels:
+                return labels[name.lower()]
+
+            try:
+                label = service.users().labels().create(userId='me', body={
+                    "name": name,
+                    "labelListVisibility": "labelShow",
+                    "messageListVisibility": "show"
+                }).execute()
+            except HttpError as e:
+                if e.resp.status != 409:
+                    raise
+                with self._lock:
+                    self.conflicts += 1
+                logger.debug(f"Label {name} was created concurrently, re-listing")
+                label_id = self._load(service, user_key).get(name.lower())
+                if not label_id:
+                    raise
+                return label_id
+
+            logger.debug(f"Created new label: {label['id']}")
+            with self._lock:
+                self.creates += 1
+            self._store(user_key, {**labels, name.lower(): label['id']})
+            return label['id']
+
+    def invalidate(self, user_key: str) -> None:
+        with self._lock:
+            if self._entries.pop(user_key, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "max_users": self.max_users,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "loads": self.loads,
+                "creates": self.creates,
+                "conflicts": self.conflicts,
+                "invalidations": self.invalidations
+            }
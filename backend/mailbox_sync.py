@@ -0,0 +1,252 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, session_scope
+from gmail_service import GmailService, METADATA_HEADERS
+from models import MailboxSyncState, MirroredMessage, get_or_create_user
+
+logger = logging.getLogger(__name__)
+
+# Gmail's list call caps maxResults at 500
+GMAIL_MAX_LIST_PAGE = 500
+HIDDEN_LABELS = ('TRASH', 'SPAM')
+
+
+def _join_labels(label_ids: List[str]) -> str:
+    return "," + ",".join(label_ids) + "," if label_ids else ","
+
+
+class MailboxSync:
+    """Keeps a per-user metadata mirror of the mailbox current via Gmail history.list."""
+
+    def __init__(self, gmail_service: GmailService):
+        self.gmail_service = gmail_service
+        self.full_sync_max_messages = int(os.getenv('SYNC_FULL_MAX_MESSAGES', '500'))
+        # user -> [lock, holders and waiters]; entries go away when nobody needs them
+        self._locks: Dict[str, List[Any]] = {}
+        self._locks_guard = threading.Lock()
+
+    @contextmanager
+    def _user_lock(self, user_email: str) -> Iterator[None]:
+        with self._locks_guard:
+            entry = self._locks.get(user_email)
+            if entry is None:
+                entry = self._locks[user_email] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[user_email]
+
+    def sync(self, credentials: Credentials, user_email: str) -> Dict[str, Any]:
+        """Bring the mirror up to date; runs a full sync the first time or when history expired."""
+        # Concurrent refreshes for one user would race on the same mirror rows
+        with self._user_lock(user_email):
+            service = self.gmail_service.get_gmail_service(credentials)
+            db = SessionLocal()
+            try:
+                user = get_or_create_user(db, user_email)
+                # Don't hold the write lock a new user row takes across the Gmail calls below
+                db.commit()
+                state = db.query(MailboxSyncState).filter(MailboxSyncState.user_id == user.id).first()
+                if state is None or not state.history_id:
+                    summary = self._full_sync(db, service, user.id, state)
+                else:
+                    try:
+                        summary = self._incremental_sync(db, service, user.id, state)
+                    except HttpError as e:
+                        if e.resp.status != 404:
+                            raise
+                        logger.warning(f"History {state.history_id} expired for {user_email}, running full resync")
+                        summary = self._full_sync(db, service, user.id, state)
+                db.commit()
+                logger.debug(f"Mailbox sync for {user_email}: {summary}")
+                return summary
+            except Exception as e:
+                logger.error(f"Error syncing mailbox for {user_email}: {str(e)}")
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+    def _full_sync(self, db, service, user_id: int, state: Optional[MailboxSyncState]) -> Dict[str, Any]:
+        # Take the history id before listing so changes made during the listing are replayed later
+        history_id = self.gmail_service.get_history_id(service)
+
+        message_ids: List[str] = []
+        page_token = None
+        while len(message_ids) < self.full_sync_max_messages:
+            page_size = min(GMAIL_MAX_LIST_PAGE, self.full_sync_max_messages - len(message_ids))
+            ids, page_token = self.gmail_service.list_message_ids(service, page_size, page_token)
+            message_ids.extend(ids)
+            if not page_token:
+                break
+
+        fetched = self.gmail_service.get_messages_batch(
+            service, message_ids, format='metadata', metadata_headers=METADATA_HEADERS
+        )
+
+        db.query(MirroredMessage).filter(MirroredMessage.user_id == user_id).delete(synchronize_session=False)
+        for msg in fetched:
+            db.add(self._to_row(user_id, msg))
+
+        now = datetime.now(timezone.utc)
+        if state is None:
+            state = MailboxSyncState(user_id=user_id)
+            db.add(state)
+        state.history_id = history_id
+        # Stopped at the cap with more to list: older pages have to come from Gmail
+        state.older_than = min(int(msg.get('internalDate') or 0) for msg in fetched) if page_token and fetched else None
+        state.last_full_sync_at = now
+        state.last_sync_at = now
+        return {"mode": "full", "added": len(fetched), "removed": 0, "relabeled": 0}
+
+    def _incremental_sync(self, db, service, user_id: int, state: MailboxSyncState) -> Dict[str, Any]:
+        records, latest_history_id = self.gmail_service.list_history(service, state.history_id)
+
+        to_fetch: Dict[str, None] = {}
+        to_delete = set()
+        relabeled: Dict[str, List[str]] = {}
+        for record in records:
+            for item in record.get('messagesAdded', []):
+                message_id = item['message']['id']
+                to_fetch[message_id] = None
+                to_delete.discard(message_id)
+            for item in record.get('messagesDeleted', []):
+                message_id = item['message']['id']
+                to_delete.add(message_id)
+                to_fetch.pop(message_id, None)
+                relabeled.pop(message_id, None)
+            for key in ('labelsAdded', 'labelsRemoved'):
+                for item in record.get(key, []):
+                    message = item['message']
+                    # Each record carries the message's full label set after the change
+                    if message['id'] not in to_delete:
+                        relabeled[message['id']] = message.get('labelIds', [])
+
+        existing = {}
+        touched = set(relabeled) | set(to_fetch)
+        if touched:
+            rows = db.query(MirroredMessage).filter(
+                MirroredMessage.user_id == user_id,
+                MirroredMessage.message_id.in_(touched)
+            ).all()
+            existing = {row.message_id: row for row in rows}
+
+        for message_id, label_ids in relabeled.items():
+            if message_id in to_fetch:
+                continue
+            row = existing.get(message_id)
+            if row is not None:
+                row.label_ids = _join_labels(label_ids)
+            else:
+                # Older than the mirror window but relabeled into view; fetch it
+                to_fetch[message_id] = None
+
+        fetched = []
+        if to_fetch:
+            fetched = self.gmail_service.get_messages_batch(
+                service, list(to_fetch), format='metadata', metadata_headers=METADATA_HEADERS
+            )
+        for msg in fetched:
+            row = existing.get(msg['id'])
+            if row is not None:
+                self._update_row(row, msg)
+            else:
+                db.add(self._to_row(user_id, msg))
+
+        if to_delete:
+            db.query(MirroredMessage).filter(
+                MirroredMessage.user_id == user_id,
+                MirroredMessage.message_id.in_(to_delete)
+            ).delete(synchronize_session=False)
+
+        state.history_id = latest_history_id
+        state.last_sync_at = datetime.now(timezone.utc)
+        return {
+            "mode": "incremental",
+            "added": len(fetched),
+            "removed": len(to_delete),
+            "relabeled": len(relabeled)
+        }
+
+    def _to_row(self, user_id: int, msg: Dict[str, Any]) -> MirroredMessage:
+        row = MirroredMessage(user_id=user_id, message_id=msg['id'])
+        self._update_row(row, msg)
+        return row
+
+    def _update_row(self, row: MirroredMessage, msg: Dict[str, Any]) -> None:
+        email = self.gmail_service.format_message_metadata(msg)
+        row.thread_id = email['thread_id']
+        row.subject = email['subject']
+        row.from_address = email['from_address']
+        row.date = email['date']
+        row.snippet = email['snippet']
+        row.label_ids = _join_labels(email['labels'])
+        row.internal_date = int(msg.get('internalDate') or 0)
+
+    def list_messages(self, user_email: str, page_size: int, label_ids: Optional[List[str]] = None,
+                      after: Optional[List[Any]] = None,
+                      db: Optional[Session] = None) -> tuple[list[dict], Optional[tuple[int, str]], Optional[int]]:
+        """Read one page from the mirror, newest first.
+
+        `after` is the (internal_date, message_id) of the previous page's last row.
+        Returns the emails, the position to resume from (None on the last page) and, on
+        the last page of a mirror that was capped, the internal_date older mail in Gmail
+        continues below.
+        """
+        with session_scope(db) as db:
+            user = get_or_create_user(db, user_email)
+            state = db.query(MailboxSyncState).filter(MailboxSyncState.user_id == user.id).first()
+            older_than = state.older_than if state is not None else None
+            query = db.query(MirroredMessage).filter(MirroredMessage.user_id == user.id)
+            if older_than:
+                # Older rows relabeled into view since are listed from Gmail, not twice
+                query = query.filter(MirroredMessage.internal_date >= older_than)
+            for label in HIDDEN_LABELS:
+                if label not in (label_ids or []):
+                    query = query.filter(~MirroredMessage.label_ids.contains(f",{label},"))
+            for label in label_ids or []:
+                query = query.filter(MirroredMessage.label_ids.contains(f",{label},"))
+            if after:
+                internal_date, message_id = after
+                query = query.filter(or_(
+                    MirroredMessage.internal_date < internal_date,
+                    and_(MirroredMessage.internal_date == internal_date, MirroredMessage.message_id < message_id)
+                ))
+            rows = query.order_by(
+                MirroredMessage.internal_date.desc(), MirroredMessage.message_id.desc()
+            ).limit(page_size + 1).all()
+            db.commit()
+
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+            emails = [self._to_email(row) for row in rows]
+            next_position = (rows[-1].internal_date, rows[-1].message_id) if has_more and rows else None
+            return emails, next_position, None if next_position else older_than
+
+    def _to_email(self, row: MirroredMessage) -> Dict[str, Any]:
+        return {
+            'id': row.message_id,
+            'thread_id': row.thread_id or '',
+            'message_id': row.message_id,
+            'subject': row.subject,
+            'from_address': row.from_address,
+            'date': row.date,
+            'snippet': row.snippet or '',
+            'labels': row.labels,
+            'moved_to_gator': False
+        }
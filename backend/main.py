@@ -1,21 +1,44 @@
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
 import logging
 import os
+import json
+import asyncio
+import math
+import threading
 from dotenv import load_dotenv
 from gmail_service import GmailService
 from email_analyzer import EmailAnalyzer
 from email_drafter import EmailDrafter
 from ai_analyzer import AIAnalyzer
-from database import SessionLocal, engine
-from models import User, EmailLog, init_db
+from database import SessionLocal, engine, close_async_engine, get_request_db, run_db
+from models import init_db
+from async_io import close_async_io, run_gmail
+from pagination import encode_cursor, encode_mirror_cursor, decode_cursor, GMAIL_CURSOR, MIRROR_CURSOR
+from mailbox_sync import MailboxSync
+from metrics import MetricsMiddleware, REGISTRY
+from outbound import OutboundError, outbound_stats
+from singleflight import SingleFlight
+from fast_classifier import FastClassifier
+from gator_triage import GatorTriage
+from similarity_index import SimilarityIndex
+from thread_context import ThreadContextCache
+from analysis_cache import AnalysisCache, content_hash
+from near_duplicates import NearDuplicateIndex
+from analysis_jobs import AnalysisJobQueue, PRIORITIES, TERMINAL_STATUSES
+from activity_log import log_email_activity, log_email_activities, email_category, get_user_stats
 
 # Load environment variables
 load_dotenv()
 
+MAX_PAGE_SIZE = 100
+MAX_ANALYZE_BATCH = 100
+MAX_TRASH_BATCH = 1000
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -25,52 +48,67 @@ logger.debug("Initializing database...")
 init_db(engine)
 logger.debug("Database initialized")
 
-def log_email_activity(email: str, message_id: str, moved: bool):
-    db = SessionLocal()
-    try:
-        logger.debug(f"Logging email activity for {email}, message_id: {message_id}, moved: {moved}")
-        
-        # Get or create user
-        user = db.query(User).filter(User.email == email).first()
-        if not user:
-            logger.debug(f"Creating new user: {email}")
-            user = User(email=email)
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        
-        # Create email log
-        email_log = EmailLog(
-            user_id=user.id,
-            message_id=message_id,
-            moved_to_gator=moved
-        )
-        db.add(email_log)
-        
-        # Update user stats if email was moved
-        if moved:
-            user.total_moved_to_gator += 1
-        
-        db.commit()
-        logger.debug(f"Successfully logged email activity for {email}")
-        
-    except Exception as e:
-        logger.error(f"Error logging email activity: {str(e)}")
-        db.rollback()
-        raise
-    finally:
-        db.close()
-
 # Initialize services
 logger.debug("Initializing services...")
 gmail_service = GmailService()
 email_analyzer = EmailAnalyzer()
-email_drafter = EmailDrafter()
+email_drafter = EmailDrafter(lambda: get_gemini_service())
 ai_analyzer = AIAnalyzer()
+# Label and header rules settle obvious mail before it reaches the model
+fast_classifier = FastClassifier()
+gator_triage = GatorTriage(gmail_service, fast_classifier)
+mailbox_sync = MailboxSync(gmail_service)
+# Local vectors over subjects, senders and bodies for "similar emails" and semantic search
+similarity_index = SimilarityIndex()
+# Compacted per-thread conversations, so redrafts and tone changes skip Gmail
+thread_contexts = ThreadContextCache(gmail_service)
+analysis_cache = AnalysisCache(ai_analyzer.model, ai_analyzer.prompt_version)
+# Near-identical bulk mail inherits the analysis of a copy the model already saw
+near_duplicates = NearDuplicateIndex(analysis_cache)
+analysis_jobs = AnalysisJobQueue(ai_analyzer, analysis_cache, near_duplicates=near_duplicates)
+# Concurrent identical fetches and analyses (double clicks, several open views) share one upstream call
+single_flight = SingleFlight()
+analysis_batch_concurrency = int(os.getenv('ANALYSIS_BATCH_CONCURRENCY', '4'))
+# Serve /emails from the history-synced local mirror unless a Gmail search query is given
+mirror_enabled = os.getenv('EMAILS_FROM_MIRROR', 'true').lower() == 'true'
 logger.debug("Services initialized")
 
+# Gemini is only needed for drafts; its client lists models on startup, so build it on first use
+_gemini_service = None
+_gemini_lock = threading.Lock()
+
+def get_gemini_service():
+    global _gemini_service
+    with _gemini_lock:
+        if _gemini_service is None:
+            from services.gemini_service import GeminiService
+            _gemini_service = GeminiService()
+        return _gemini_service
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 app = FastAPI()
 
+@app.on_event("startup")
+async def start_analysis_workers():
+    await analysis_jobs.start()
+
+@app.on_event("shutdown")
+async def shutdown_async_io():
+    await analysis_jobs.stop()
+    await close_async_io()
+    await close_async_engine()
+
+@app.exception_handler(OutboundError)
+async def outbound_error_handler(request: Request, exc: OutboundError):
+    # Throttled locally or upstream breaker open: tell the client when to come back
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -80,6 +118,9 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Outermost, so the timing covers CORS and error handling too
+app.add_middleware(MetricsMiddleware, router=app.router)
+
 # Models
 class EmailResponse(BaseModel):
     id: str
@@ -101,6 +142,16 @@ class EmailAnalysis(BaseModel):
 class DraftResponse(BaseModel):
     content: str
 
+class AnalyzeBatchRequest(BaseModel):
+    message_ids: List[str]
+
+class TrashBatchRequest(BaseModel):
+    message_ids: List[str]
+
+class AnalysisJobsRequest(BaseModel):
+    message_ids: List[str]
+    priority: str = "bulk"
+
 # Endpoints
 @app.get("/auth/url")
 async def get_auth_url():
@@ -111,6 +162,15 @@ async def get_auth_url():
         logger.error(f"Error getting auth URL: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/auth/logout")
+async def logout(request: Request):
+    # Revoked or not, this token must not resolve from the caches any more
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+    gmail_service.forget_token(auth_header.split(' ')[1])
+    return {"status": "logged_out"}
+
 @app.get("/auth/callback")
 async def auth_callback(code: str):
     try:
@@ -147,6 +207,10 @@ async def auth_callback_post(code: str):
             except Exception as e:
                 logger.warning(f"Could not decode ID token: {str(e)}")
         
+        # Prime the identity cache so the first API call skips the userinfo lookup
+        if email:
+            gmail_service.identity_cache.put(token, email, credentials.expiry)
+        
         # Format expiry time
         expires_in = None
         if credentials.expiry:
@@ -165,8 +229,158 @@ async def auth_callback_post(code: str):
             logger.error(f"Error response: {e.response.text}")
         raise HTTPException(status_code=400, detail=str(e))
 
+def resolve_email_page(page_size: int, page_token: Optional[str], q: Optional[str], label: Optional[str]) -> dict:
+    """Turn query params into list arguments; a cursor carries the filters it was issued for."""
+    if page_token:
+        try:
+            cursor = decode_cursor(page_token)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {
+            "kind": cursor["kind"],
+            "page_size": page_size,
+            "page_token": cursor["page_token"],
+            "query": cursor["query"],
+            "label_ids": cursor["label_ids"]
+        }
+    return {
+        # Gmail search syntax can only be evaluated by Gmail itself
+        "kind": GMAIL_CURSOR if q or not mirror_enabled else MIRROR_CURSOR,
+        "page_size": page_size,
+        "page_token": None,
+        "query": q,
+        "label_ids": [label] if label else []
+    }
+
+async def fetch_email(credentials, user_email: str, message_id: str) -> dict:
+    service = await gmail_service.get_gmail_service_async(credentials)
+
+    async def fetch():
+        email = await gmail_service.get_email_async(service, message_id)
+        await index_emails(user_email, {message_id: email})
+        return email
+
+    return await single_flight.run("get_email", (user_email, message_id), fetch)
+
+async def index_emails(user_email: str, emails):
+    """Add listing rows, or parsed messages keyed by id, to the similarity index."""
+    if not similarity_index.enabled or not emails:
+        return
+    if isinstance(emails, dict):
+        emails = [{**email, 'id': message_id} for message_id, email in emails.items()]
+    try:
+        await run_in_threadpool(similarity_index.add_emails, user_email, emails)
+    except Exception as e:
+        # Indexing is best effort; requests never fail because of it
+        logger.error(f"Error indexing emails: {str(e)}")
+
+async def reuse_near_duplicate(user_email: str, message_id: str, subject: str, from_address: str,
+                               content: str, digest: str) -> Optional[dict]:
+    """Analysis inherited from an analyzed near-duplicate (marked `reused_from`), cached for this message too."""
+    try:
+        reused = await run_in_threadpool(near_duplicates.find, user_email, message_id, subject, from_address, content)
+    except Exception as e:
+        logger.error(f"Error looking up near-duplicates: {str(e)}")
+        return None
+    if reused is not None:
+        await run_in_threadpool(analysis_cache.put, user_email, message_id, digest, reused)
+    return reused
+
+async def store_analysis(user_email: str, message_id: str, subject: str, from_address: str,
+                         content: str, digest: str, analysis: dict):
+    """Cache a model analysis and fingerprint the message so near-duplicates can reuse it."""
+    await run_in_threadpool(analysis_cache.put, user_email, message_id, digest, analysis)
+    await run_in_threadpool(near_duplicates.add, user_email, message_id, subject, from_address, content)
+
+async def get_thread_context(credentials, user_email: str, message_id: str, thread_id: Optional[str] = None) -> dict:
+    """Compacted conversation ending at message_id, from the thread context cache."""
+    thread_id = thread_id or thread_contexts.thread_of(user_email, message_id)
+    if not thread_id:
+        email_content = await fetch_email(credentials, user_email, message_id)
+        if not email_content:
+            raise HTTPException(status_code=404, detail="Email not found")
+        thread_id = email_content.get('thread_id') or message_id
+    service = await gmail_service.get_gmail_service_async(credentials)
+    try:
+        return await single_flight.run(
+            "thread_context", (user_email, thread_id, message_id),
+            lambda: run_gmail(thread_contexts.get, service, user_email, thread_id, message_id)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+async def mark_moved_emails(credentials, user_email: str, emails: List[dict]):
+    """Flag listed emails already in Lator Gator; listing never moves anything itself."""
+    if not emails:
+        return
+    try:
+        service = await gmail_service.get_gmail_service_async(credentials)
+        await run_gmail(gator_triage.mark_moved, service, user_email, emails)
+    except Exception as e:
+        # Listing still succeeds without the flags
+        logger.error(f"Error looking up the Lator Gator label: {str(e)}")
+
+async def log_emails_activity(user_email: str, emails: List[dict], db=None):
+    entries = [
+        {
+            "message_id": email['message_id'],
+            "moved": email.get('moved_to_gator', False),
+            "category": email_category(email.get('labels'))
+        }
+        for email in emails
+    ]
+    try:
+        if db is not None:
+            await run_db(db, log_email_activities, user_email, entries)
+        else:
+            await run_in_threadpool(log_email_activities, user_email, entries)
+    except Exception as e:
+        # Listing still succeeds even if logging fails
+        logger.error(f"Error logging email activity: {str(e)}")
+
+async def list_email_page(credentials, user_email: str, page: dict, page_size: int, db):
+    """One page of listing rows and the cursor for the next, from the mirror or Gmail."""
+    if page["kind"] == MIRROR_CURSOR:
+        # Apply Gmail history deltas to the local mirror, then serve the page from it
+        if not page["page_token"]:
+            await run_gmail(mailbox_sync.sync, credentials, user_email)
+        emails, next_position, older_than = await run_db(
+            db, mailbox_sync.list_messages, user_email, page_size, page["label_ids"], page["page_token"]
+        )
+        next_page_token = encode_mirror_cursor(
+            next_position[0], next_position[1], page["label_ids"], page_size
+        ) if next_position else None
+        if older_than:
+            # The mirror only holds the newest messages; carry on with Gmail below the oldest one
+            query = f"before:{older_than // 1000}"
+            if len(emails) < page_size:
+                older, _, next_token = await gmail_service.list_emails_async(
+                    credentials, page_size - len(emails), None, query, page["label_ids"]
+                )
+                emails = emails + older
+                next_page_token = encode_cursor(
+                    next_token, query, page["label_ids"], page_size
+                ) if next_token else None
+            else:
+                next_page_token = encode_cursor(None, query, page["label_ids"], page_size)
+    else:
+        emails, _, next_token = await gmail_service.list_emails_async(
+            credentials, page_size, page["page_token"], page["query"], page["label_ids"]
+        )
+        next_page_token = encode_cursor(
+            next_token, page["query"], page["label_ids"], page_size
+        ) if next_token else None
+    return emails, next_page_token
+
 @app.get("/emails")
-async def get_emails(request: Request):
+async def get_emails(
+    request: Request,
+    page_size: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    page_token: Optional[str] = None,
+    q: Optional[str] = None,
+    label: Optional[str] = None,
+    db=Depends(get_request_db)
+):
     try:
         # Get token from Authorization header
         auth_header = request.headers.get('Authorization')
@@ -175,55 +389,138 @@ async def get_emails(request: Request):
         
         access_token = auth_header.split(' ')[1]
         logger.debug(f"Getting emails with token: {access_token[:10]}...")
+        page = resolve_email_page(page_size, page_token, q, label)
         
-        credentials = gmail_service.get_credentials_from_token(access_token)
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
         
-        # Get user email from credentials
-        user_email = credentials.id_token
-        if not user_email:
-            # Try to get email from userinfo endpoint
-            try:
-                import requests
-                headers = {'Authorization': f'Bearer {access_token}'}
-                response = requests.get('https://www.googleapis.com/oauth2/v3/userinfo', headers=headers)
-                if response.status_code == 200:
-                    user_info = response.json()
-                    user_email = user_info.get('email')
-                    logger.debug(f"User email from userinfo: {user_email}")
-            except Exception as e:
-                logger.warning(f"Could not get user info: {str(e)}")
+        # Get user email (served from the identity cache warmed above)
+        user_email = await gmail_service.get_user_email_async(credentials)
         
         if not user_email:
             raise HTTPException(status_code=400, detail="Could not determine user email")
         
-        # Get emails and process them
-        emails, moved_count = gmail_service.list_emails(credentials)
+        emails, next_page_token = await list_email_page(credentials, user_email, page, page_size, db)
         
-        # Log activity for each email
-        if user_email:
-            for email in emails:
-                try:
-                    log_email_activity(
-                        email=user_email,
-                        message_id=email['message_id'],
-                        moved=email.get('moved_to_gator', False)
-                    )
-                except Exception as e:
-                    logger.error(f"Error logging email activity: {str(e)}")
-                    # Continue processing other emails even if logging fails
-        
-        logger.debug(f"Retrieved {len(emails)} emails, moved {moved_count} to Lator Gator")
+        # Flag mail already in Lator Gator, then log activity (and the moved total) for each email
+        await mark_moved_emails(credentials, user_email, emails)
+        moved_count = sum(1 for email in emails if email.get('moved_to_gator'))
+        await log_emails_activity(user_email, emails, db)
+        await index_emails(user_email, emails)
+        
+        logger.debug(f"Retrieved {len(emails)} emails, {moved_count} in Lator Gator")
         return {
             "emails": emails,
-            "moved_count": moved_count
+            "moved_count": moved_count,
+            "next_page_token": next_page_token
         }
         
+    except (HTTPException, OutboundError):
+        raise
     except Exception as e:
         logger.error(f"Error getting emails: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/emails/stream")
+async def stream_emails(
+    request: Request,
+    page_size: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    page_token: Optional[str] = None,
+    q: Optional[str] = None,
+    label: Optional[str] = None
+):
+    """NDJSON variant of /emails: one line per email as soon as it is fetched, then a page line."""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+    
+    access_token = auth_header.split(' ')[1]
+    page = resolve_email_page(page_size, page_token, q, label)
+    if page["page_token"] and page["kind"] != GMAIL_CURSOR:
+        raise HTTPException(status_code=400, detail="Page token was not issued by /emails/stream")
+    
+    try:
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
+        user_email = await gmail_service.get_user_email_async(credentials)
+        if not user_email:
+            raise HTTPException(status_code=400, detail="Could not determine user email")
+        
+        service = await gmail_service.get_gmail_service_async(credentials)
+        message_ids, next_token = await run_gmail(
+            gmail_service.list_message_ids, service,
+            page["page_size"], page["page_token"], page["query"], page["label_ids"]
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error starting email stream: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def generate():
+        emails = []
+        try:
+            async for email in gmail_service.stream_emails_async(service, message_ids):
+                emails.append(email)
+                yield json.dumps({"type": "email", "email": email}) + "\n"
+            # Rows are already on the wire, so the Lator Gator flags go in the page line
+            await mark_moved_emails(credentials, user_email, emails)
+            yield json.dumps({
+                "type": "page",
+                "count": len(emails),
+                "moved_ids": [email['id'] for email in emails if email.get('moved_to_gator')],
+                "moved_count": sum(1 for email in emails if email.get('moved_to_gator')),
+                "next_page_token": encode_cursor(
+                    next_token, page["query"], page["label_ids"], page_size
+                ) if next_token else None
+            }) + "\n"
+        except Exception as e:
+            logger.error(f"Error streaming emails: {str(e)}")
+            yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+        finally:
+            if emails:
+                await log_emails_activity(user_email, emails)
+                await index_emails(user_email, emails)
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.post("/emails/triage")
+async def triage_inbox(
+    request: Request,
+    page_size: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    db=Depends(get_request_db)
+):
+    """Move the newest inbox mail the label rules pick to Lator Gator; returns the moved ids."""
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+        if not gator_triage.enabled:
+            return {"moved_count": 0, "moved_ids": []}
+        
+        access_token = auth_header.split(' ')[1]
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
+        user_email = await gmail_service.get_user_email_async(credentials)
+        if not user_email:
+            raise HTTPException(status_code=400, detail="Could not determine user email")
+        
+        page = resolve_email_page(page_size, None, None, 'INBOX')
+        emails, _ = await list_email_page(credentials, user_email, page, page_size, db)
+        service = await gmail_service.get_gmail_service_async(credentials)
+        await run_gmail(gator_triage.triage, service, user_email, emails)
+        moved = [email for email in emails if email.get('moved_to_gator')]
+        # Moves count toward the stats just as listing the moved mail would
+        await log_emails_activity(user_email, moved, db)
+        
+        logger.debug(f"Triaged {len(emails)} inbox emails, {len(moved)} in Lator Gator")
+        return {"moved_count": len(moved), "moved_ids": [email['id'] for email in moved]}
+        
+    except (HTTPException, OutboundError):
+        raise
+    except Exception as e:
+        logger.error(f"Error triaging emails: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/emails/{message_id}/trash")
-async def move_to_trash(message_id: str, request: Request):
+async def move_to_trash(message_id: str, request: Request, db=Depends(get_request_db)):
     try:
         # Get token from Authorization header
         auth_header = request.headers.get('Authorization')
@@ -233,27 +530,19 @@ async def move_to_trash(message_id: str, request: Request):
         access_token = auth_header.split(' ')[1]
         logger.debug(f"Moving email {message_id} to trash")
         
-        credentials = gmail_service.get_credentials_from_token(access_token)
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
         
-        # Get user email from credentials for logging
-        user_email = None
-        if hasattr(credentials, 'id_token') and credentials.id_token:
-            try:
-                import jwt
-                decoded_token = jwt.decode(credentials.id_token, options={"verify_signature": False})
-                user_email = decoded_token.get('email')
-                logger.debug(f"User email from token: {user_email}")
-            except Exception as e:
-                logger.warning(f"Could not decode ID token: {str(e)}")
+        # Get user email (served from the identity cache warmed above)
+        user_email = await gmail_service.get_user_email_async(credentials)
         
-        service = gmail_service.get_gmail_service(credentials)
+        service = await gmail_service.get_gmail_service_async(credentials)
         
         # Move the email to trash
-        service.users().messages().trash(userId='me', id=message_id).execute()
+        await gmail_service.trash_email_async(service, message_id)
         
         # Log the trash activity
         if user_email:
-            log_email_activity(user_email, message_id, moved=False)  # moved=False since it's trashed, not moved to Lator Gator
+            await run_db(db, log_email_activity, user_email, message_id, moved=False)  # moved=False since it's trashed, not moved to Lator Gator
         
         logger.debug(f"Successfully moved email {message_id} to trash")
         return {"status": "success"}
@@ -261,6 +550,62 @@ async def move_to_trash(message_id: str, request: Request):
         logger.error(f"Error moving email to trash: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/emails/trash")
+async def move_many_to_trash(body: TrashBatchRequest, request: Request, db=Depends(get_request_db)):
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+        
+        message_ids = list(dict.fromkeys(body.message_ids))
+        if not message_ids:
+            raise HTTPException(status_code=400, detail="No message ids given")
+        if len(message_ids) > MAX_TRASH_BATCH:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_TRASH_BATCH} message ids per request")
+        logger.debug(f"Moving {len(message_ids)} emails to trash")
+        
+        access_token = auth_header.split(' ')[1]
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
+        user_email = await gmail_service.get_user_email_async(credentials)
+        service = await gmail_service.get_gmail_service_async(credentials)
+        
+        # One Gmail batch request per GMAIL_BATCH_SIZE ids instead of a round trip each
+        trashed, errors = await run_gmail(gmail_service.trash_emails_batch, service, message_ids)
+        
+        # Log every trashed email in a single transaction
+        if user_email and trashed:
+            await run_db(
+                db,
+                log_email_activities,
+                user_email,
+                [
+                    {
+                        "message_id": message_id,
+                        "moved": False,
+                        "category": email_category((trashed[message_id] or {}).get('labelIds'))
+                    }
+                    for message_id in trashed
+                ]
+            )
+        
+        results = {}
+        for message_id in message_ids:
+            if message_id in trashed:
+                results[message_id] = {"status": "success"}
+            else:
+                results[message_id] = {"status": "error", "detail": errors.get(message_id, "Not processed")}
+        logger.debug(f"Trashed {len(trashed)} of {len(message_ids)} emails")
+        return {
+            "results": results,
+            "trashed_count": len(trashed),
+            "error_count": len(message_ids) - len(trashed)
+        }
+    except (HTTPException, OutboundError):
+        raise
+    except Exception as e:
+        logger.error(f"Error moving emails to trash: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/emails/{message_id}/analyze")
 async def analyze_email(message_id: str, request: Request):
     try:
@@ -274,69 +619,518 @@ async def analyze_email(message_id: str, request: Request):
         access_token = auth_header.split(' ')[1]
         logger.debug(f"Using access token: {access_token[:10]}...")
         
-        credentials = gmail_service.get_credentials_from_token(access_token)
-        service = gmail_service.get_gmail_service(credentials)
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
+        user_email = await gmail_service.get_user_email_async(credentials)
+        if not user_email:
+            raise HTTPException(status_code=400, detail="Could not determine user email")
+        
+        # Gmail message content is immutable, so a cached analysis needs no re-fetch
+        cached = analysis_cache.get_memory(user_email, message_id)
+        if cached is None:
+            cached = await run_in_threadpool(analysis_cache.get, user_email, message_id)
+        if cached is not None:
+            logger.debug(f"Analysis for {message_id} served from cache")
+            return dict(cached, analysis_path="cache")
+        
+        async def analyze_uncached():
+            # Get email content
+            email_content = await fetch_email(credentials, user_email, message_id)
+            if not email_content:
+                raise HTTPException(status_code=404, detail="Email not found")
+            
+            classified = fast_classifier.classify(email_content)
+            if classified is not None:
+                return dict(classified, analysis_path="rules")
+        
+            # Extract email details
+            subject = email_content.get('subject', '')
+            from_address = email_content.get('from', '')
+            content = email_content.get('content', '')
+        
+            logger.debug(f"Email details - Subject: {subject}, From: {from_address}")
+        
+            if not content:
+                raise HTTPException(status_code=400, detail="Email content is empty")
+            
+            digest = content_hash(subject, from_address, content)
+            reused = await reuse_near_duplicate(user_email, message_id, subject, from_address, content, digest)
+            if reused is not None:
+                return dict(reused, analysis_path="reused")
+        
+            # Analyze email using AI
+            try:
+                analysis = await ai_analyzer.analyze_email_async(subject, content, from_address)
+            except ValueError as e:
+                logger.error(f"AI analysis error: {str(e)}")
+                raise HTTPException(status_code=400, detail=str(e))
+            except Exception as e:
+                logger.exception("Unexpected error in AI analysis")
+                raise HTTPException(status_code=500, detail="Failed to analyze email")
         
-        # Get email content
-        email_content = gmail_service.get_email(service, message_id)
+            if not analysis:
+                raise HTTPException(status_code=500, detail="Empty analysis result")
+            
+            logger.debug(f"Analysis complete: {analysis}")
+            await store_analysis(user_email, message_id, subject, from_address, content, digest, analysis)
+            return dict(analysis, analysis_path="llm")
+        
+        return await single_flight.run("analyze", (user_email, message_id), analyze_uncached)
+        
+    except HTTPException as e:
+        logger.error(f"HTTP error analyzing email: {str(e)}")
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error analyzing email")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/emails/{message_id}/analyze/stream")
+async def analyze_email_stream(message_id: str, request: Request):
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+    
+    access_token = auth_header.split(' ')[1]
+    credentials = await gmail_service.get_credentials_from_token_async(access_token)
+    user_email = await gmail_service.get_user_email_async(credentials)
+    if not user_email:
+        raise HTTPException(status_code=400, detail="Could not determine user email")
+    
+    # A cached or rule-based result is sent as a single event, with no model call
+    ready = analysis_cache.get_memory(user_email, message_id)
+    if ready is not None:
+        ready = dict(ready, analysis_path="cache")
+    else:
+        email_content = await fetch_email(credentials, user_email, message_id)
         if not email_content:
             raise HTTPException(status_code=404, detail="Email not found")
+        classified = fast_classifier.classify(email_content)
+        if classified is not None:
+            ready = dict(classified, analysis_path="rules")
+        else:
+            subject = email_content.get('subject', '')
+            from_address = email_content.get('from', '')
+            content = email_content.get('content', '')
+            if not content:
+                raise HTTPException(status_code=400, detail="Email content is empty")
+            digest = content_hash(subject, from_address, content)
+            ready = await run_in_threadpool(analysis_cache.get, user_email, message_id, digest)
+            if ready is not None:
+                ready = dict(ready, analysis_path="cache")
+            else:
+                ready = await reuse_near_duplicate(user_email, message_id, subject, from_address, content, digest)
+                if ready is not None:
+                    ready = dict(ready, analysis_path="reused")
+    
+    async def events():
+        if ready is not None:
+            yield sse_event("result", ready)
+            return
+        try:
+            async for kind, value in ai_analyzer.analyze_email_stream(subject, content, from_address):
+                if kind == "token":
+                    yield sse_event("token", {"text": value})
+                else:
+                    await store_analysis(user_email, message_id, subject, from_address, content, digest, value)
+                    yield sse_event("result", dict(value, analysis_path="llm"))
+        except ValueError as e:
+            logger.error(f"AI analysis error: {str(e)}")
+            yield sse_event("error", {"detail": str(e)})
+        except Exception:
+            logger.exception("Unexpected error in streamed AI analysis")
+            yield sse_event("error", {"detail": "Failed to analyze email"})
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/emails/analyze-batch")
+async def analyze_email_batch(body: AnalyzeBatchRequest, request: Request):
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+        
+        message_ids = list(dict.fromkeys(body.message_ids))
+        if not message_ids:
+            raise HTTPException(status_code=400, detail="No message ids given")
+        if len(message_ids) > MAX_ANALYZE_BATCH:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_ANALYZE_BATCH} message ids per request")
+        logger.debug(f"Batch analyzing {len(message_ids)} emails")
+        
+        access_token = auth_header.split(' ')[1]
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
+        user_email = await gmail_service.get_user_email_async(credentials)
+        if not user_email:
+            raise HTTPException(status_code=400, detail="Could not determine user email")
         
-        # Extract email details
-        subject = email_content.get('subject', '')
-        from_address = email_content.get('from', '')
-        content = email_content.get('content', '')
+        results = {}
+        errors = {}
+        paths = {}
         
-        logger.debug(f"Email details - Subject: {subject}, From: {from_address}")
+        # Serve whatever is already cached
+        pending = []
+        for message_id in message_ids:
+            cached = analysis_cache.get_memory(user_email, message_id)
+            if cached is not None:
+                results[message_id] = cached
+            else:
+                pending.append(message_id)
+        if pending:
+            from_db = await run_in_threadpool(
+                lambda: {message_id: analysis_cache.get(user_email, message_id) for message_id in pending}
+            )
+            results.update({message_id: cached for message_id, cached in from_db.items() if cached is not None})
+            pending = [message_id for message_id in pending if from_db[message_id] is None]
+        paths.update({message_id: "cache" for message_id in results})
         
-        if not content:
-            raise HTTPException(status_code=400, detail="Email content is empty")
+        if pending:
+            service = await gmail_service.get_gmail_service_async(credentials)
+            parsed = await run_gmail(gmail_service.get_full_messages, service, pending)
+            await index_emails(user_email, parsed)
+            
+            # Rules settle what they confidently can; only the rest is sent to the model
+            classified = fast_classifier.classify_batch(parsed)
+            results.update(classified)
+            paths.update({message_id: "rules" for message_id in classified})
+            
+            emails = []
+            digests = {}
+            for message_id in pending:
+                if message_id in classified:
+                    continue
+                email_content = parsed.get(message_id)
+                if not email_content:
+                    errors[message_id] = "Email not found"
+                    continue
+                if not email_content.get('content'):
+                    errors[message_id] = "Email content is empty"
+                    continue
+                emails.append({
+                    "id": message_id,
+                    "subject": email_content.get('subject', ''),
+                    "from": email_content.get('from', ''),
+                    "content": email_content['content']
+                })
+                digests[message_id] = content_hash(
+                    email_content.get('subject', ''), email_content.get('from', ''), email_content['content']
+                )
+            
+            # Copies of mail the model already analyzed reuse that analysis; copies within this
+            # batch are sent once and the rest inherit the representative's result
+            reused = {}
+            for email in emails:
+                match = await reuse_near_duplicate(
+                    user_email, email["id"], email["subject"], email["from"], email["content"], digests[email["id"]]
+                )
+                if match is not None:
+                    reused[email["id"]] = match
+            emails = [email for email in emails if email["id"] not in reused]
+            batch_duplicates = near_duplicates.cluster(emails)
+            by_id = {email["id"]: email for email in emails}
+            emails = [email for email in emails if email["id"] not in batch_duplicates]
+            
+            # Independent prompt groups run concurrently, bounded to spare the upstream quota
+            semaphore = asyncio.Semaphore(analysis_batch_concurrency)
+            
+            async def analyze_group(group):
+                async with semaphore:
+                    try:
+                        return group, await ai_analyzer.analyze_batch_async(group), None
+                    except Exception as e:
+                        logger.error(f"Batch analysis group failed: {str(e)}")
+                        return group, {}, e
+            
+            analyzed = {}
+            for group, group_results, error in await asyncio.gather(
+                *(analyze_group(group) for group in ai_analyzer.pack_batches(emails))
+            ):
+                for email in group:
+                    result = group_results.get(email["id"])
+                    if result is not None and "error" in result:
+                        errors[email["id"]] = result["error"]
+                    elif result is not None:
+                        analyzed[email["id"]] = result
+                    else:
+                        errors[email["id"]] = str(error) if error else "Analysis missing from model output"
+            
+            for message_id, analysis in analyzed.items():
+                email = by_id[message_id]
+                await store_analysis(
+                    user_email, message_id, email["subject"], email["from"], email["content"], digests[message_id], analysis
+                )
+            for message_id, (source_id, distance) in batch_duplicates.items():
+                if source_id not in analyzed:
+                    errors[message_id] = errors.get(source_id, "Analysis missing from model output")
+                    continue
+                reused[message_id] = dict(analyzed[source_id], reused_from={"message_id": source_id, "distance": distance})
+                await run_in_threadpool(analysis_cache.put, user_email, message_id, digests[message_id], reused[message_id])
+            results.update(analyzed)
+            paths.update({message_id: "llm" for message_id in analyzed})
+            results.update(reused)
+            paths.update({message_id: "reused" for message_id in reused})
+        
+        return {
+            "results": results,
+            "errors": errors,
+            "analysis_paths": paths
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error in batch analysis")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def submit_analysis_job(user_email: str, message_id: str, email_content: dict, priority: str) -> dict:
+    """Queue an LLM analysis unless rules or the cache already answer it.
+
+    Raises ValueError when the email has no content to analyze.
+    """
+    classified = fast_classifier.classify(email_content)
+    if classified is not None:
+        return {"job_id": None, "status": "completed", "result": classified, "analysis_path": "rules"}
+    subject = email_content.get('subject', '')
+    from_address = email_content.get('from', '')
+    content = email_content.get('content', '')
+    if not content:
+        raise ValueError("Email content is empty")
+    digest = content_hash(subject, from_address, content)
+    cached = await run_in_threadpool(analysis_cache.get, user_email, message_id, digest)
+    if cached is not None:
+        return {"job_id": None, "status": "completed", "result": cached, "analysis_path": "cache"}
+    reused = await reuse_near_duplicate(user_email, message_id, subject, from_address, content, digest)
+    if reused is not None:
+        return {"job_id": None, "status": "completed", "result": reused, "analysis_path": "reused"}
+    return await analysis_jobs.submit(
+        user_email, message_id, subject, from_address, content, digest, PRIORITIES[priority]
+    )
+
+@app.post("/emails/{message_id}/analyze/jobs", status_code=202)
+async def create_analysis_job(message_id: str, request: Request,
+                              priority: str = Query("interactive", pattern="^(interactive|bulk)$")):
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+        
+        access_token = auth_header.split(' ')[1]
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
+        user_email = await gmail_service.get_user_email_async(credentials)
+        if not user_email:
+            raise HTTPException(status_code=400, detail="Could not determine user email")
+        
+        # Skip the queue entirely when the answer is already cached
+        cached = analysis_cache.get_memory(user_email, message_id)
+        if cached is not None:
+            return {"job_id": None, "status": "completed", "result": cached, "analysis_path": "cache"}
+        
+        email_content = await fetch_email(credentials, user_email, message_id)
+        if not email_content:
+            raise HTTPException(status_code=404, detail="Email not found")
         
-        # Analyze email using AI
         try:
-            analysis = ai_analyzer.analyze_email(subject, content, from_address)
+            job = await submit_analysis_job(user_email, message_id, email_content, priority)
         except ValueError as e:
-            logger.error(f"AI analysis error: {str(e)}")
             raise HTTPException(status_code=400, detail=str(e))
-        except Exception as e:
-            logger.exception("Unexpected error in AI analysis")
-            raise HTTPException(status_code=500, detail="Failed to analyze email")
+        logger.debug(f"Analysis job for {message_id}: {job}")
+        return job
         
-        if not analysis:
-            raise HTTPException(status_code=500, detail="Empty analysis result")
-            
-        logger.debug(f"Analysis complete: {analysis}")
-        return analysis
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error submitting analysis job")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/emails/analyze/jobs", status_code=202)
+async def create_analysis_jobs(body: AnalysisJobsRequest, request: Request):
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
         
-    except HTTPException as e:
-        logger.error(f"HTTP error analyzing email: {str(e)}")
+        message_ids = list(dict.fromkeys(body.message_ids))
+        if not message_ids:
+            raise HTTPException(status_code=400, detail="No message ids given")
+        if len(message_ids) > MAX_ANALYZE_BATCH:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_ANALYZE_BATCH} message ids per request")
+        if body.priority not in PRIORITIES:
+            raise HTTPException(status_code=400, detail=f"Priority must be one of {', '.join(PRIORITIES)}")
+        
+        access_token = auth_header.split(' ')[1]
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
+        user_email = await gmail_service.get_user_email_async(credentials)
+        if not user_email:
+            raise HTTPException(status_code=400, detail="Could not determine user email")
+        
+        service = await gmail_service.get_gmail_service_async(credentials)
+        parsed = await run_gmail(gmail_service.get_full_messages, service, message_ids)
+        await index_emails(user_email, parsed)
+        
+        jobs = {}
+        errors = {}
+        for message_id in message_ids:
+            email_content = parsed.get(message_id)
+            if not email_content:
+                errors[message_id] = "Email not found"
+                continue
+            try:
+                jobs[message_id] = await submit_analysis_job(user_email, message_id, email_content, body.priority)
+            except ValueError as e:
+                errors[message_id] = str(e)
+        
+        return {
+            "jobs": jobs,
+            "errors": errors
+        }
+        
+    except HTTPException:
         raise
     except Exception as e:
-        logger.exception("Unexpected error analyzing email")
+        logger.exception("Unexpected error submitting analysis jobs")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def get_owned_job(job_id: str, request: Request) -> dict:
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+    
+    access_token = auth_header.split(' ')[1]
+    credentials = await gmail_service.get_credentials_from_token_async(access_token)
+    user_email = await gmail_service.get_user_email_async(credentials)
+    
+    job = await analysis_jobs.get(job_id)
+    # Someone else's job id is reported as missing rather than forbidden
+    if job is None or job["user_email"] != user_email:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def job_response(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "message_id": job["message_id"],
+        "status": job["status"],
+        "result": job["result"],
+        "error": job["error"],
+        "analysis_path": "llm" if job["result"] is not None else None
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_analysis_job(job_id: str, request: Request, wait: float = Query(0, ge=0, le=30)):
+    job = await get_owned_job(job_id, request)
+    if wait and job["status"] not in TERMINAL_STATUSES:
+        # Long-poll: hold the request until the job finishes or `wait` seconds pass
+        job = await analysis_jobs.wait(job_id, wait)
+    return job_response(job)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_analysis_job(job_id: str, request: Request):
+    job = await get_owned_job(job_id, request)
+    
+    async def events():
+        current = job
+        last_status = None
+        while True:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                event = "result" if last_status in TERMINAL_STATUSES else "status"
+                yield sse_event(event, job_response(current))
+            if last_status in TERMINAL_STATUSES:
+                return
+            if await request.is_disconnected():
+                return
+            # Comment lines keep proxies from closing an idle stream
+            yield ": keepalive\n\n"
+            current = await analysis_jobs.wait(job_id, 15)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/emails/semantic-search")
+async def semantic_search(request: Request, q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=100)):
+    """Free-text search over the local similarity index of mail seen so far."""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+    
+    access_token = auth_header.split(' ')[1]
+    credentials = await gmail_service.get_credentials_from_token_async(access_token)
+    user_email = await gmail_service.get_user_email_async(credentials)
+    if not user_email:
+        raise HTTPException(status_code=400, detail="Could not determine user email")
+    
+    matches = await run_in_threadpool(similarity_index.search, user_email, q, limit)
+    return {"results": [{"id": message_id, "score": score} for message_id, score in matches]}
+
+@app.get("/emails/{message_id}/similar")
+async def similar_emails(message_id: str, request: Request, limit: int = Query(10, ge=1, le=100)):
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+        
+        access_token = auth_header.split(' ')[1]
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
+        user_email = await gmail_service.get_user_email_async(credentials)
+        if not user_email:
+            raise HTTPException(status_code=400, detail="Could not determine user email")
+        
+        matches = await run_in_threadpool(similarity_index.similar_to, user_email, message_id, limit)
+        if matches is None:
+            # Not seen yet: fetching it indexes it
+            await fetch_email(credentials, user_email, message_id)
+            matches = await run_in_threadpool(similarity_index.similar_to, user_email, message_id, limit)
+        return {"results": [{"id": similar_id, "score": score} for similar_id, score in matches or []]}
+    except (HTTPException, OutboundError):
+        raise
+    except Exception as e:
+        logger.error(f"Error finding similar emails: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/emails/{message_id}/draft-response")
-async def draft_response(message_id: str, tone: str, access_token: str):
+async def draft_response(message_id: str, tone: str, access_token: str, thread_id: Optional[str] = None):
     try:
         logger.debug(f"Drafting response for email {message_id} with tone {tone}")
-        credentials = gmail_service.get_credentials_from_token(access_token)
-        service = gmail_service.get_gmail_service(credentials)
-        email_content = gmail_service.get_email(service, message_id)
-        draft = f"""
-        Thank you for your email. I appreciate you reaching out.
-        
-        I understand your concerns and will address them promptly.
-        
-        Best regards,
-        [Your Name]
-        """
-        return {"content": draft}
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
+        user_email = await gmail_service.get_user_email_async(credentials)
+        if not user_email:
+            raise HTTPException(status_code=400, detail="Could not determine user email")
+        thread = await get_thread_context(credentials, user_email, message_id, thread_id)
+        draft = await run_in_threadpool(email_drafter.generate_draft, thread["context"], tone)
+        return {"content": draft, "thread_messages": thread["messages"]}
+    except (HTTPException, OutboundError):
+        raise
     except Exception as e:
         logger.error(f"Error drafting response: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/emails/{message_id}/draft-response/stream")
+async def draft_response_stream(message_id: str, request: Request, tone: str = "professional",
+                                thread_id: Optional[str] = None):
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
+    
+    access_token = auth_header.split(' ')[1]
+    credentials = await gmail_service.get_credentials_from_token_async(access_token)
+    user_email = await gmail_service.get_user_email_async(credentials)
+    if not user_email:
+        raise HTTPException(status_code=400, detail="Could not determine user email")
+    prompt_content = (await get_thread_context(credentials, user_email, message_id, thread_id))["context"]
+    
+    async def events():
+        parts = []
+        try:
+            gemini = await run_in_threadpool(get_gemini_service)
+            # The Gemini SDK streams through a blocking iterator; pull each chunk off the event loop
+            async for text in iterate_in_threadpool(gemini.draft_response_stream(prompt_content, tone)):
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+            yield sse_event("result", {"content": "".join(parts)})
+        except Exception as e:
+            logger.error(f"Error streaming draft response: {str(e)}")
+            yield sse_event("error", {"detail": "Failed to draft response"})
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/stats")
-async def get_stats(request: Request):
+async def get_stats(request: Request, days: int = Query(14, ge=1, le=90), db=Depends(get_request_db)):
     try:
         # Get token from Authorization header
         auth_header = request.headers.get('Authorization')
@@ -347,38 +1141,40 @@ async def get_stats(request: Request):
         logger.debug(f"Getting stats with token: {access_token[:10]}...")
         
         # Get credentials and user email
-        credentials = gmail_service.get_credentials_from_token(access_token)
-        email = gmail_service.get_user_email(credentials)
+        credentials = await gmail_service.get_credentials_from_token_async(access_token)
+        email = await gmail_service.get_user_email_async(credentials)
         
         if not email:
             raise HTTPException(status_code=400, detail="Could not determine user email")
         
-        # Get stats from database
-        db = SessionLocal()
-        try:
-            user = db.query(User).filter(User.email == email).first()
-            if not user:
-                # Create user if not exists
-                user = User(email=email)
-                db.add(user)
-                db.commit()
-                db.refresh(user)
-            
-            # Get total emails processed
-            total_emails = db.query(EmailLog).filter(EmailLog.user_id == user.id).count()
-            
-            return {
-                "total_moved_to_gator": user.total_moved_to_gator,
-                "total_emails_processed": total_emails,
-                "email": email
-            }
-        finally:
-            db.close()
+        # Get stats from database off the event loop
+        stats = await run_db(db, get_user_stats, email, days)
+        return stats
             
     except Exception as e:
         logger.error(f"Error getting stats: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/internal/stats")
+async def get_internal_stats():
+    return {
+        "identity_cache": gmail_service.identity_cache.stats(),
+        "gmail_client_pool": gmail_service.client_pool.stats(),
+        "label_registry": gmail_service.label_registry.stats(),
+        "analysis_cache": analysis_cache.stats(),
+        "near_duplicates": near_duplicates.stats(),
+        "analysis_jobs": await analysis_jobs.stats(),
+        "outbound": outbound_stats(),
+        "single_flight": single_flight.stats(),
+        "similarity_index": similarity_index.stats(),
+        "thread_contexts": thread_contexts.stats()
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Per-endpoint latency of requests and of their outbound, database and LLM stages, for Prometheus."""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,235 @@
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Route template of the request being served ("background" for queue workers and startup)
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar('current_endpoint', default='background')
+
+# Seconds; spans cache hits (sub-millisecond) to slow LLM completions
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: per-bucket (non-cumulative) counts with +Inf last, then sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format, version 0.0.4."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Time to serve an HTTP request, streamed bodies included',
+    ('endpoint', 'method', 'status')
+))
+OUTBOUND_DURATION = REGISTRY.register(Histogram(
+    'outbound_request_duration_seconds', 'Time per outbound attempt, excluding rate-limit waits',
+    ('upstream', 'operation', 'endpoint', 'outcome')
+))
+OUTBOUND_RETRIES = REGISTRY.register(Counter(
+    'outbound_retries_total', 'Outbound attempts that were retried', ('upstream', 'operation', 'endpoint')
+))
+OUTBOUND_THROTTLE_SECONDS = REGISTRY.register(Counter(
+    'outbound_throttle_seconds_total', 'Time spent waiting on outbound rate limits', ('upstream', 'endpoint')
+))
+OUTBOUND_REJECTED = REGISTRY.register(Counter(
+    'outbound_rejected_total', 'Outbound calls refused by a rate limit or open circuit', ('upstream', 'endpoint', 'reason')
+))
+DB_DURATION = REGISTRY.register(Histogram(
+    'db_operation_duration_seconds', 'Time per database operation', ('operation', 'endpoint', 'outcome')
+))
+GMAIL_CLIENT_DURATION = REGISTRY.register(Histogram(
+    'gmail_client_acquire_seconds', 'Time to get a Gmail client from the pool or build one',
+    ('endpoint', 'outcome')
+))
+LLM_DURATION = REGISTRY.register(Histogram(
+    'llm_request_duration_seconds', 'Time per LLM completion, retries included', ('model', 'operation', 'endpoint', 'outcome')
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    'llm_tokens_total', 'Tokens reported by the LLM provider', ('model', 'operation', 'endpoint', 'kind')
+))
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels: str) -> Iterator[Dict[str, str]]:
+    """Observe the block's duration, labeled with the current endpoint and an outcome.
+
+    The outcome is "success", or "error" if the block raises; the block may set
+    labels["outcome"] itself for finer outcomes.
+    """
+    labels.setdefault('endpoint', current_endpoint.get())
+    start = time.perf_counter()
+    try:
+        yield labels
+    except BaseException:
+        labels.setdefault('outcome', 'error')
+        raise
+    finally:
+        labels.setdefault('outcome', 'success')
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def timed_db(operation: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Decorator recording a database function in db_operation_duration_seconds."""
+    def decorator(fn: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            with timed(DB_DURATION, operation=operation):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_usage(model: str, operation: str, usage: Optional[Dict[str, Any]]) -> None:
+    if not usage:
+        return
+    endpoint = current_endpoint.get()
+    for kind in ('prompt', 'completion'):
+        tokens = usage.get(f"{kind}_tokens")
+        if tokens:
+            LLM_TOKENS.inc(tokens, model=model, operation=operation, endpoint=endpoint, kind=kind)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request and tagging it with its route template.
+
+    Everything the request does, including work handed to thread pools, sees the
+    template through `current_endpoint`, so outbound, database and LLM metrics
+    carry the endpoint that caused them.
+    """
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    def _endpoint(self, scope) -> str:
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return 'unmatched'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        endpoint = self._endpoint(scope)
+        token = current_endpoint.set(endpoint)
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start, endpoint=endpoint, method=scope['method'], status=str(status['code'])
+            )
+            current_endpoint.reset(token)
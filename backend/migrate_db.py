@@ -0,0 +1,91 @@
+import os
+import sys
+from pathlib import Path
+
+# Add the backend directory to Python path
+backend_dir = Path(__file__).parent
+sys.path.append(str(backend_dir))
+
+from sqlalchemy import inspect, text
+
+from database import engine, Base
+from activity_log import GMAIL_CATEGORY_LABELS, rebuild_rollups
+import models  # noqa: F401 - registers the tables on Base
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _columns(table):
+    return {column["name"] for column in inspect(engine).get_columns(table)}
+
+def migrate_database():
+    """Bring an existing database up to the current models without dropping any data.
+
+    create_all only adds missing tables, so columns and constraints that
+    existing tables gained are added here. Safe to run more than once.
+    """
+    try:
+        logger.info("Creating missing tables...")
+        Base.metadata.create_all(bind=engine)
+
+        with engine.begin() as conn:
+            if "category" not in _columns("email_logs"):
+                logger.info("Adding email_logs.category...")
+                conn.execute(text("ALTER TABLE email_logs ADD COLUMN category VARCHAR"))
+            if "total_emails_processed" not in _columns("users"):
+                logger.info("Adding users.total_emails_processed...")
+                conn.execute(text(
+                    "ALTER TABLE users ADD COLUMN total_emails_processed INTEGER NOT NULL DEFAULT 0"
+                ))
+            if "older_than" not in _columns("mailbox_sync_state"):
+                logger.info("Adding mailbox_sync_state.older_than...")
+                conn.execute(text("ALTER TABLE mailbox_sync_state ADD COLUMN older_than BIGINT"))
+                # Mirrors that reached the full sync cap probably stop short of the mailbox's end
+                conn.execute(text(
+                    "UPDATE mailbox_sync_state SET older_than = (SELECT MIN(m.internal_date) FROM mirrored_messages m "
+                    "WHERE m.user_id = mailbox_sync_state.user_id) WHERE (SELECT COUNT(*) FROM mirrored_messages m "
+                    "WHERE m.user_id = mailbox_sync_state.user_id) >= :cap"
+                ), {"cap": int(os.getenv('SYNC_FULL_MAX_MESSAGES', '500'))})
+
+            # Collapse repeated logs of a message into its first row, keeping "moved" if any copy had it
+            logger.info("Removing duplicate email logs...")
+            conn.execute(text(
+                "UPDATE email_logs SET moved_to_gator = true "
+                "WHERE id IN (SELECT MIN(id) FROM email_logs GROUP BY user_id, message_id "
+                "HAVING MAX(CASE WHEN moved_to_gator THEN 1 ELSE 0 END) = 1)"
+            ))
+            removed = conn.execute(text(
+                "DELETE FROM email_logs "
+                "WHERE id NOT IN (SELECT MIN(id) FROM email_logs GROUP BY user_id, message_id)"
+            )).rowcount
+            logger.info(f"Removed {removed} duplicate email logs")
+
+            # A unique index is what ON CONFLICT (user_id, message_id) matches on every backend
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_email_logs_user_message ON email_logs (user_id, message_id)"
+            ))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_email_logs_user_id ON email_logs (user_id)"))
+
+            # Take the category from the mailbox mirror where it has the message, else primary
+            logger.info("Backfilling email_logs.category...")
+            for label, category in GMAIL_CATEGORY_LABELS.items():
+                conn.execute(text(
+                    "UPDATE email_logs SET category = :category WHERE category IS NULL AND EXISTS ("
+                    "SELECT 1 FROM mirrored_messages m WHERE m.user_id = email_logs.user_id "
+                    "AND m.message_id = email_logs.message_id AND m.label_ids LIKE :pattern)"
+                ), {"category": category, "pattern": f"%,{label},%"})
+            conn.execute(text("UPDATE email_logs SET category = 'primary' WHERE category IS NULL"))
+
+        # Recomputes total_emails_processed and the daily rollups from the de-duplicated logs
+        logger.info("Rebuilding stats rollups from email logs...")
+        count = rebuild_rollups()
+        logger.info(f"Database migrated; rebuilt stats for {count} user(s)")
+
+    except Exception as e:
+        logger.error(f"Error migrating database: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    migrate_database()
@@ -0,0 +1,226 @@
+import base64
+import logging
+import re
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Same rough ratio AIAnalyzer budgets with
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = "\n[...truncated]"
+
+BLOCK_TAGS = {
+    'p', 'div', 'br', 'tr', 'li', 'ul', 'ol', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'section', 'article', 'header', 'footer', 'pre', 'hr'
+}
+SKIPPED_TAGS = {'script', 'style', 'head', 'title'}
+# Signatures as marked up by Gmail, Outlook and Apple Mail
+SKIPPED_CLASSES = ('gmail_signature',)
+SKIPPED_IDS = ('signature', 'Signature')
+# Quoted history; only kept when a message has nothing else, like an HTML-only forward
+QUOTE_TAGS = {'blockquote'}
+QUOTE_CLASSES = ('gmail_quote', 'gmail_extra', 'moz-cite-prefix', 'yahoo_quoted')
+QUOTE_IDS = ('divRplyFwdMsg', 'appendonsend')
+
+# A quoted reply starts at the first of these lines; everything after it is history
+REPLY_HEADER_PATTERNS = [
+    re.compile(r'^On .{0,200}\bwrote:\s*$', re.IGNORECASE | re.DOTALL),
+    re.compile(r'^-{2,}\s*Original Message\s*-{2,}', re.IGNORECASE),
+    re.compile(r'^-{2,}\s*Forwarded message\s*-{2,}', re.IGNORECASE),
+    re.compile(r'^_{10,}\s*$'),
+    # Outlook's header block, matched together with the following line
+    re.compile(r'^From:\s.+ (Sent|Date):\s', re.IGNORECASE),
+]
+SIGNATURE_PATTERNS = [
+    re.compile(r'^--\s*$'),
+    re.compile(r'^Sent from my \w+', re.IGNORECASE),
+    re.compile(r'^Get Outlook for ', re.IGNORECASE),
+]
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collects visible text, dropping scripts, styles and signatures.
+
+    Quoted replies go to `quoted` instead of `parts`.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.quoted: List[str] = []
+        # Per open element: None, 'skip' or 'quote'
+        self._stack: List[Optional[str]] = []
+        self._skip_depth = 0
+        self._quote_depth = 0
+
+    def _kind(self, tag: str, attrs: List[tuple]) -> Optional[str]:
+        if tag in SKIPPED_TAGS:
+            return 'skip'
+        attributes = dict(attrs)
+        classes = (attributes.get('class') or '').split()
+        if any(name in classes for name in SKIPPED_CLASSES) or attributes.get('id') in SKIPPED_IDS:
+            return 'skip'
+        if tag in QUOTE_TAGS or any(name in classes for name in QUOTE_CLASSES) or attributes.get('id') in QUOTE_IDS:
+            return 'quote'
+        return None
+
+    def _emit(self, text: str) -> None:
+        if not self._skip_depth:
+            (self.quoted if self._quote_depth else self.parts).append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('br', 'hr', 'img', 'meta', 'link', 'input', 'wbr'):
+            # Void elements never get an end tag
+            if tag in ('br', 'hr'):
+                self._emit('\n')
+            return
+        kind = self._kind(tag, attrs)
+        self._stack.append(kind)
+        if kind == 'skip':
+            self._skip_depth += 1
+        elif kind == 'quote':
+            self._quote_depth += 1
+        if tag in BLOCK_TAGS:
+            self._emit('\n')
+        if tag == 'li':
+            self._emit('- ')
+
+    def handle_endtag(self, tag):
+        if tag in ('br', 'hr', 'img', 'meta', 'link', 'input', 'wbr') or not self._stack:
+            return
+        if tag in BLOCK_TAGS:
+            self._emit('\n')
+        kind = self._stack.pop()
+        if kind == 'skip':
+            self._skip_depth -= 1
+        elif kind == 'quote':
+            self._quote_depth -= 1
+
+    def handle_data(self, data):
+        self._emit(data)
+
+
+def _normalize_whitespace(text: str) -> str:
+    text = re.sub(r'[ \t\xa0]+', ' ', text)
+    text = re.sub(r' *\n *', '\n', text)
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+
+def html_to_text(html: str) -> str:
+    """Visible text of an HTML body; quoted history only if there is nothing else."""
+    parser = _HTMLTextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception as e:
+        # Mail HTML is often malformed; keep whatever was collected
+        logger.warning(f"Error parsing HTML body: {str(e)}")
+    return _normalize_whitespace(''.join(parser.parts)) or _normalize_whitespace(''.join(parser.quoted))
+
+
+def strip_quoted_and_signature(text: str) -> str:
+    """Drop quoted reply history, '>' quoted lines and trailing signatures from plain text.
+
+    A message made only of '>' quoted lines keeps them, unquoted, rather than coming out empty.
+    """
+    kept: List[str] = []
+    quoted: List[str] = []
+    lines = text.splitlines()
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        # "On Mon, ... <a@b.c>" is often wrapped onto a second "wrote:" line
+        joined = stripped + ' ' + lines[index + 1].strip() if index + 1 < len(lines) else stripped
+        if kept and any(p.match(stripped) or p.match(joined) for p in REPLY_HEADER_PATTERNS):
+            break
+        if any(p.match(stripped) for p in SIGNATURE_PATTERNS):
+            break
+        if stripped.startswith('>'):
+            quoted.append(re.sub(r'^(>\s?)+', '', stripped))
+            continue
+        kept.append(line.rstrip())
+    return '\n'.join(kept).strip() or '\n'.join(quoted).strip()
+
+
+def truncate_to_budget(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, preferring a paragraph, line or word boundary."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if max_tokens <= 0 or len(text) <= max_chars:
+        return text
+    cut = text[:max_chars - len(TRUNCATION_MARKER)]
+    for boundary in ('\n\n', '\n', '. ', ' '):
+        position = cut.rfind(boundary)
+        # Don't give up more than a fifth of the budget to land on a boundary
+        if position > len(cut) * 0.8:
+            cut = cut[:position + (1 if boundary == '. ' else 0)]
+            break
+    return cut.rstrip() + TRUNCATION_MARKER
+
+
+def _header(part: Dict[str, Any], name: str) -> str:
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name), '')
+
+
+def _decode(part: Dict[str, Any]) -> str:
+    data = part.get('body', {}).get('data')
+    if not data:
+        return ''
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    match = re.search(r'charset="?([\w.-]+)"?', _header(part, 'content-type'), re.IGNORECASE)
+    charset = match.group(1) if match else 'utf-8'
+    try:
+        return raw.decode(charset, errors='replace')
+    except LookupError:
+        return raw.decode('utf-8', errors='replace')
+
+
+def _is_attachment(part: Dict[str, Any]) -> bool:
+    return bool(part.get('filename')) or _header(part, 'content-disposition').lower().startswith('attachment')
+
+
+def iter_text_parts(part: Dict[str, Any]) -> Iterator[str]:
+    """Walk a Gmail format='full' payload depth first, yielding readable text per body part.
+
+    multipart/alternative yields only its best representation (plain text over HTML);
+    attachments are skipped.
+    """
+    mime_type = (part.get('mimeType') or '').lower()
+    if _is_attachment(part):
+        return
+    if mime_type.startswith('multipart/'):
+        children = part.get('parts', [])
+        if mime_type == 'multipart/alternative':
+            preferred = [c for c in children if (c.get('mimeType') or '').lower() == 'text/plain' and c.get('body', {}).get('data')]
+            for child in preferred or list(reversed(children)):
+                texts = list(iter_text_parts(child))
+                if any(text.strip() for text in texts):
+                    yield from texts
+                    return
+            return
+        for child in children:
+            yield from iter_text_parts(child)
+    elif mime_type in ('text/plain', ''):
+        yield _decode(part)
+    elif mime_type == 'text/html':
+        yield html_to_text(_decode(part))
+    elif mime_type == 'message/rfc822':
+        for child in part.get('parts', []):
+            yield from iter_text_parts(child)
+
+
+def extract_body(payload: Dict[str, Any], max_tokens: Optional[int] = None) -> str:
+    """New content of a message as plain text: quoted history and signatures removed,
+    trimmed to max_tokens. Stops walking parts once the budget is filled."""
+    max_chars = max_tokens * CHARS_PER_TOKEN if max_tokens else None
+    sections: List[str] = []
+    length = 0
+    for text in iter_text_parts(payload):
+        text = strip_quoted_and_signature(text)
+        if not text:
+            continue
+        sections.append(text)
+        length += len(text)
+        if max_chars and length > max_chars:
+            break
+    body = '\n\n'.join(sections)
+    return truncate_to_budget(body, max_tokens) if max_tokens else body
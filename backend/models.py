@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Date, DateTime, Boolean, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -12,6 +12,8 @@ class User(Base):
     # User fields
     email = Column(String, unique=True, index=True)
     total_moved_to_gator = Column(Integer, default=0)
+    # Maintained alongside email_logs so /stats never has to count them
+    total_emails_processed = Column(Integer, default=0, server_default="0", nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
@@ -22,16 +24,21 @@ class User(Base):
 
 class EmailLog(Base):
     __tablename__ = "email_logs"
+    __table_args__ = (
+        # One row per message per user; re-listing the same message is an upsert
+        UniqueConstraint("user_id", "message_id", name="uq_email_logs_user_message"),
+    )
     
     # Primary key
     id = Column(Integer, primary_key=True, index=True)
     
     # Foreign key
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     
     # Email fields
     message_id = Column(String)
     moved_to_gator = Column(Boolean, default=False)
+    category = Column(String, default="primary")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
@@ -40,6 +47,151 @@ class EmailLog(Base):
     def __repr__(self):
         return f"<EmailLog {self.message_id}>"
 
+class ActivityRollup(Base):
+    __tablename__ = "activity_rollups"
+    __table_args__ = (
+        UniqueConstraint("user_id", "day", "category", name="uq_activity_rollups_user_day_category"),
+    )
+    
+    # Primary key
+    id = Column(Integer, primary_key=True, index=True)
+    
+    # Foreign key
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    # Bucket fields
+    day = Column(Date, nullable=False)
+    category = Column(String, nullable=False)
+    emails_processed = Column(Integer, default=0, nullable=False)
+    moved_to_gator = Column(Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f"<ActivityRollup user={self.user_id} {self.day} {self.category}>"
+
+class AnalysisCacheEntry(Base):
+    __tablename__ = "analysis_cache"
+    __table_args__ = (
+        UniqueConstraint("user_id", "message_id", "model", "prompt_version", name="uq_analysis_cache_key"),
+    )
+    
+    # Primary key
+    id = Column(Integer, primary_key=True, index=True)
+    
+    # Foreign key
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    # Cache key fields
+    message_id = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    prompt_version = Column(String, nullable=False)
+    content_hash = Column(String, nullable=False)
+    
+    # JSON-encoded analysis result
+    result = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    def __repr__(self):
+        return f"<AnalysisCacheEntry {self.message_id} {self.model}@{self.prompt_version}>"
+
+class AnalysisFingerprint(Base):
+    __tablename__ = "analysis_fingerprints"
+    __table_args__ = (
+        UniqueConstraint("user_id", "message_id", name="uq_analysis_fingerprints_message"),
+        # One index per LSH band; a near-duplicate has the same sender and shares at least one band exactly
+        Index("ix_analysis_fingerprints_band_0", "user_id", "sender", "band_0"),
+        Index("ix_analysis_fingerprints_band_1", "user_id", "sender", "band_1"),
+        Index("ix_analysis_fingerprints_band_2", "user_id", "sender", "band_2"),
+        Index("ix_analysis_fingerprints_band_3", "user_id", "sender", "band_3"),
+        Index("ix_analysis_fingerprints_band_4", "user_id", "sender", "band_4"),
+        Index("ix_analysis_fingerprints_band_5", "user_id", "sender", "band_5"),
+        Index("ix_analysis_fingerprints_band_6", "user_id", "sender", "band_6"),
+        Index("ix_analysis_fingerprints_band_7", "user_id", "sender", "band_7"),
+    )
+    
+    # Primary key
+    id = Column(Integer, primary_key=True, index=True)
+    
+    # Foreign key
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    # Message whose LLM analysis can be reused, and its normalized sender address
+    message_id = Column(String, nullable=False)
+    sender = Column(String, nullable=False)
+    
+    # 64-bit SimHash stored signed, and its eight 8-bit bands
+    fingerprint = Column(BigInteger, nullable=False)
+    band_0 = Column(Integer, nullable=False)
+    band_1 = Column(Integer, nullable=False)
+    band_2 = Column(Integer, nullable=False)
+    band_3 = Column(Integer, nullable=False)
+    band_4 = Column(Integer, nullable=False)
+    band_5 = Column(Integer, nullable=False)
+    band_6 = Column(Integer, nullable=False)
+    band_7 = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    def __repr__(self):
+        return f"<AnalysisFingerprint {self.message_id} {self.fingerprint:x}>"
+
+class MailboxSyncState(Base):
+    __tablename__ = "mailbox_sync_state"
+    
+    # Primary key
+    id = Column(Integer, primary_key=True, index=True)
+    
+    # Foreign key
+    user_id = Column(Integer, ForeignKey("users.id"), unique=True)
+    
+    # Sync fields
+    history_id = Column(String)
+    last_full_sync_at = Column(DateTime(timezone=True))
+    last_sync_at = Column(DateTime(timezone=True))
+    # internal_date of the oldest mirrored message when the full sync stopped at its cap;
+    # anything older is only in Gmail. None when the mirror holds the whole mailbox
+    older_than = Column(BigInteger)
+    
+    def __repr__(self):
+        return f"<MailboxSyncState user={self.user_id} history={self.history_id}>"
+
+class MirroredMessage(Base):
+    __tablename__ = "mirrored_messages"
+    __table_args__ = (
+        UniqueConstraint("user_id", "message_id", name="uq_mirrored_messages_user_message"),
+        Index("ix_mirrored_messages_user_date", "user_id", "internal_date"),
+    )
+    
+    # Primary key
+    id = Column(Integer, primary_key=True, index=True)
+    
+    # Foreign key
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    # Message metadata, as returned by messages.get(format='metadata')
+    message_id = Column(String, nullable=False)
+    thread_id = Column(String)
+    subject = Column(String)
+    from_address = Column(String)
+    date = Column(String)
+    snippet = Column(String)
+    # Stored as ",INBOX,UNREAD," so a label filter is a plain substring match
+    label_ids = Column(String, default=",")
+    internal_date = Column(BigInteger, default=0)
+    
+    @property
+    def labels(self):
+        return [label for label in (self.label_ids or "").split(",") if label]
+    
+    def __repr__(self):
+        return f"<MirroredMessage {self.message_id}>"
+
+def get_or_create_user(db, email: str) -> User:
+    user = db.query(User).filter(User.email == email).first()
+    if not user:
+        user = User(email=email, total_moved_to_gator=0, total_emails_processed=0)
+        db.add(user)
+        db.flush()
+    return user
+
 # Create all tables
 def init_db(engine):
     Base.metadata.create_all(bind=engine) 
\ No newline at end of file
@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import or_
+
+from analysis_cache import AnalysisCache
+from database import SessionLocal
+from models import AnalysisFingerprint, get_or_create_user
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_BITS = 64
+BANDS = 8
+BAND_BITS = FINGERPRINT_BITS // BANDS
+# With eight bands, two fingerprints within 7 bits of each other must match exactly in one band
+MAX_SUPPORTED_DISTANCE = BANDS - 1
+# Fewer words than this is too little text to call two messages the same
+MIN_FEATURES = 8
+# Random band collisions grow with the mailbox; newest fingerprints are checked first
+MAX_CANDIDATES = 500
+
+URL_PATTERN = re.compile(r'https?://\S+|www\.\S+')
+EMAIL_PATTERN = re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+')
+NUMBER_PATTERN = re.compile(r'\d+(?:[.,:/-]\d+)*')
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def normalize(text: str) -> List[str]:
+    """Words with the parts that vary between copies of a blast (links, addresses, numbers) masked."""
+    text = URL_PATTERN.sub(' url ', (text or '').lower())
+    text = EMAIL_PATTERN.sub(' email ', text)
+    text = NUMBER_PATTERN.sub(' 0 ', text)
+    return WORD_PATTERN.findall(text)
+
+
+def _sender(from_address: str) -> str:
+    match = EMAIL_PATTERN.search((from_address or '').lower())
+    return match.group(0) if match else (from_address or '').strip().lower()
+
+
+def _features(subject: str, from_address: str, content: str) -> List[str]:
+    # Single words, repeats included: a changed word moves one vote, where shingles would move several
+    features = normalize(content)
+    features += [f"subject:{word}" for word in normalize(subject)]
+    features.append(f"from:{_sender(from_address)}")
+    return features
+
+
+def simhash(features: List[str]) -> int:
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big') for feature in features],
+        dtype=np.uint64
+    )
+    # Each feature votes +1 or -1 on every bit; a bit is set where the votes are positive
+    bits = (hashes[:, None] >> np.arange(FINGERPRINT_BITS, dtype=np.uint64)) & np.uint64(1)
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - len(features)
+    return sum(1 << bit for bit in np.flatnonzero(votes > 0).tolist())
+
+
+def bands(fingerprint: int) -> List[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [fingerprint >> (band * BAND_BITS) & mask for band in range(BANDS)]
+
+
+def _to_signed(fingerprint: int) -> int:
+    # BigInteger columns are signed 64-bit
+    return fingerprint - (1 << FINGERPRINT_BITS) if fingerprint >= 1 << (FINGERPRINT_BITS - 1) else fingerprint
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << FINGERPRINT_BITS) if value < 0 else value
+
+
+class NearDuplicateIndex:
+    """SimHash fingerprints of LLM-analyzed mail, looked up by LSH band.
+
+    Fingerprints cover the normalized subject, sender and body, so copies of a
+    newsletter or receipt that differ only in links, numbers or a few words land
+    within a few bits of each other. Matches must also come from the same sender
+    address, since templated mail from different senders can look alike. Only
+    messages the model actually analyzed are recorded, so a reused analysis is
+    always one hop from a real one.
+    """
+
+    def __init__(self, cache: AnalysisCache, max_distance: Optional[int] = None):
+        self.cache = cache
+        self.max_distance = min(
+            max_distance if max_distance is not None else int(os.getenv('NEAR_DUPLICATE_MAX_DISTANCE', '6')),
+            MAX_SUPPORTED_DISTANCE
+        )
+        self.enabled = os.getenv('NEAR_DUPLICATE_REUSE_ENABLED', 'true').lower() == 'true'
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.reused = 0
+        self.recorded = 0
+
+    def fingerprint(self, subject: str, from_address: str, content: str) -> Optional[int]:
+        features = _features(subject, from_address, content)
+        # The subject and sender features alone don't say enough
+        if len(features) < MIN_FEATURES:
+            return None
+        return simhash(features)
+
+    def _nearest(self, db, user_id: int, sender: str, fingerprint: int, exclude: str) -> Optional[Tuple[str, int]]:
+        columns = [getattr(AnalysisFingerprint, f"band_{band}") for band in range(BANDS)]
+        candidates = db.query(AnalysisFingerprint.message_id, AnalysisFingerprint.fingerprint).filter(
+            AnalysisFingerprint.user_id == user_id,
+            AnalysisFingerprint.sender == sender,
+            AnalysisFingerprint.message_id != exclude,
+            or_(*(column == band for column, band in zip(columns, bands(fingerprint))))
+        ).order_by(AnalysisFingerprint.id.desc()).limit(MAX_CANDIDATES).all()
+        best = None
+        for message_id, stored in candidates:
+            distance = bin(fingerprint ^ _to_unsigned(stored)).count('1')
+            if distance <= self.max_distance and (best is None or distance < best[1]):
+                best = (message_id, distance)
+        return best
+
+    def find(self, user_email: str, message_id: str, subject: str, from_address: str,
+             content: str) -> Optional[Dict[str, Any]]:
+        """Analysis of an already-analyzed near-duplicate, marked with `reused_from`, or None."""
+        if not self.enabled:
+            return None
+        fingerprint = self.fingerprint(subject, from_address, content)
+        if fingerprint is None:
+            return None
+        with self._lock:
+            self.lookups += 1
+
+        db = SessionLocal()
+        try:
+            user = get_or_create_user(db, user_email)
+            match = self._nearest(db, user.id, _sender(from_address), fingerprint, message_id)
+            db.commit()
+        finally:
+            db.close()
+        if match is None:
+            return None
+
+        source_id, distance = match
+        # Analyses from another model or prompt version are cache misses, so never reused
+        analysis = self.cache.get(user_email, source_id)
+        if analysis is None:
+            return None
+        logger.debug(f"Reusing analysis of {source_id} for {message_id} (distance {distance})")
+        with self._lock:
+            self.reused += 1
+        return dict(analysis, reused_from={"message_id": source_id, "distance": distance})
+
+    def cluster(self, emails: List[Dict[str, Any]]) -> Dict[str, Tuple[str, int]]:
+        """Group near-identical emails within one batch so only one of each group is analyzed.
+
+        `emails` have id, subject, from and content. Returns {duplicate id: (representative id,
+        distance)}; the first email of each group represents it.
+        """
+        if not self.enabled:
+            return {}
+        representatives: Dict[str, List[Tuple[str, int]]] = {}
+        duplicates: Dict[str, Tuple[str, int]] = {}
+        for email in emails:
+            fingerprint = self.fingerprint(email.get('subject', ''), email.get('from', ''), email.get('content', ''))
+            if fingerprint is None:
+                continue
+            same_sender = representatives.setdefault(_sender(email.get('from', '')), [])
+            nearest = min(
+                ((message_id, bin(fingerprint ^ other).count('1')) for message_id, other in same_sender),
+                key=lambda match: match[1], default=None
+            )
+            if nearest is not None and nearest[1] <= self.max_distance:
+                duplicates[email['id']] = nearest
+            else:
+                same_sender.append((email['id'], fingerprint))
+        with self._lock:
+            self.reused += len(duplicates)
+        return duplicates
+
+    def add(self, user_email: str, message_id: str, subject: str, from_address: str, content: str) -> None:
+        """Record a message the model analyzed so near-duplicates can reuse it."""
+        if not self.enabled:
+            return
+        fingerprint = self.fingerprint(subject, from_address, content)
+        if fingerprint is None:
+            return
+        db = SessionLocal()
+        try:
+            user = get_or_create_user(db, user_email)
+            entry = db.query(AnalysisFingerprint).filter(
+                AnalysisFingerprint.user_id == user.id,
+                AnalysisFingerprint.message_id == message_id
+            ).first()
+            if entry is None:
+                entry = AnalysisFingerprint(user_id=user.id, message_id=message_id)
+                db.add(entry)
+            entry.sender = _sender(from_address)
+            entry.fingerprint = _to_signed(fingerprint)
+            for band, value in enumerate(bands(fingerprint)):
+                setattr(entry, f"band_{band}", value)
+            db.commit()
+            with self._lock:
+                self.recorded += 1
+        except Exception as e:
+            # Like the cache, a failed write must never fail the analysis itself
+            logger.error(f"Error storing fingerprint for {message_id}: {str(e)}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_distance": self.max_distance,
+                "lookups": self.lookups,
+                "reused": self.reused,
+                "recorded": self.recorded
+            }
@@ -0,0 +1,472 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+import httplib2
+import requests
+from googleapiclient.errors import HttpError
+
+from metrics import (
+    OUTBOUND_DURATION, OUTBOUND_REJECTED, OUTBOUND_RETRIES, OUTBOUND_THROTTLE_SECONDS, current_endpoint
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Gmail reports per-user rate limits as 403 with one of these reasons
+GMAIL_RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded')
+
+# Gmail API quota units per method (https://developers.google.com/gmail/api/reference/quota)
+GMAIL_QUOTA_UNITS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.labels.list': 1,
+    'gmail.users.labels.get': 1,
+    'gmail.users.labels.create': 5,
+    'gmail.users.history.list': 2,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.modify': 5,
+    'gmail.users.messages.trash': 5,
+    'gmail.users.messages.batchModify': 50,
+    'gmail.users.threads.get': 10,
+    'gmail.users.drafts.create': 10,
+    'gmail.users.messages.send': 100,
+}
+DEFAULT_GMAIL_QUOTA_UNITS = 5
+
+
+def gmail_quota_units(method_id: Optional[str]) -> int:
+    return GMAIL_QUOTA_UNITS.get(method_id or '', DEFAULT_GMAIL_QUOTA_UNITS)
+
+
+class OutboundError(Exception):
+    """An outbound call was refused locally; `retry_after` says when trying again makes sense."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitExceeded(OutboundError):
+    pass
+
+
+class CircuitOpenError(OutboundError):
+    pass
+
+
+class TokenBucket:
+    """Token bucket that hands out reservations instead of sleeping itself.
+
+    Callers reserve `cost` tokens and wait the returned delay, so the same bucket
+    serves threads (time.sleep) and coroutines (asyncio.sleep).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, cost: float, max_wait: float) -> Optional[float]:
+        """Take `cost` tokens, possibly going into debt; None if the wait would exceed max_wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # A single call costlier than the burst size still has to get through eventually
+            wait = max(0.0, (min(cost, self.capacity) - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= cost
+            return wait
+
+
+class CircuitBreaker:
+    """Opens after consecutive upstream failures and lets one trial call through per reset interval."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> Optional[float]:
+        """Return None when the call may proceed, otherwise seconds until the next trial."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return None
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+                return None
+            # Open, or half-open with the trial call still in flight
+            return max(remaining, 1.0)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def release_trial(self) -> None:
+        """Give up a half-open trial that never reached the upstream; the next caller may try."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic() - self.reset_seconds
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+def is_retryable_http_error(e: HttpError) -> bool:
+    status = e.resp.status
+    if status in RETRYABLE_STATUSES:
+        return True
+    return status == 403 and any(reason in (e.content or b'') for reason in GMAIL_RATE_LIMIT_REASONS)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After is either delta-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Upstream:
+    """Rate limiting, retries with backoff, timeouts and circuit breaking for one external API.
+
+    Settings come from OUTBOUND_<NAME>_* environment variables, falling back to the
+    per-upstream defaults below and then to the shared OUTBOUND_* values.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, user_rate: Optional[float] = None,
+                 user_burst: Optional[float] = None, timeout: float = 30.0, breaker: bool = True):
+        prefix = f"OUTBOUND_{name.upper()}_"
+        self.name = name
+        self.bucket = TokenBucket(float(os.getenv(prefix + 'RATE', rate)), float(os.getenv(prefix + 'BURST', burst)))
+        self.user_rate = float(os.getenv(prefix + 'USER_RATE', user_rate)) if user_rate else None
+        self.user_burst = float(os.getenv(prefix + 'USER_BURST', user_burst)) if user_burst else None
+        self.timeout = float(os.getenv(prefix + 'TIMEOUT_SECONDS', timeout))
+        self.max_retries = int(os.getenv(prefix + 'MAX_RETRIES', os.getenv('OUTBOUND_MAX_RETRIES', '3')))
+        self.backoff_base = float(os.getenv('OUTBOUND_BACKOFF_BASE_SECONDS', '0.5'))
+        self.backoff_max = float(os.getenv('OUTBOUND_BACKOFF_MAX_SECONDS', '8'))
+        # Queue behind the limiter for at most this long before failing fast
+        self.max_wait = float(os.getenv('OUTBOUND_MAX_WAIT_SECONDS', '10'))
+        self.max_users = int(os.getenv('OUTBOUND_MAX_TRACKED_USERS', '10000'))
+        self.breaker = CircuitBreaker(
+            int(os.getenv(prefix + 'BREAKER_FAILURES', os.getenv('OUTBOUND_BREAKER_FAILURES', '5'))),
+            float(os.getenv(prefix + 'BREAKER_RESET_SECONDS', os.getenv('OUTBOUND_BREAKER_RESET_SECONDS', '30')))
+        ) if breaker else None
+        self._user_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.throttled_seconds = 0.0
+
+    def _user_bucket(self, user_key: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._user_buckets.get(user_key)
+            if bucket is None:
+                bucket = TokenBucket(self.user_rate, self.user_burst)
+                self._user_buckets[user_key] = bucket
+                while len(self._user_buckets) > self.max_users:
+                    self._user_buckets.popitem(last=False)
+            else:
+                self._user_buckets.move_to_end(user_key)
+            return bucket
+
+    def _admit(self, cost: float, user_key: Optional[str]) -> float:
+        """Check the breaker and reserve quota; returns how long to wait before calling."""
+        if self.breaker is not None:
+            retry_after = self.breaker.before_call()
+            if retry_after is not None:
+                with self._lock:
+                    self.rejected += 1
+                OUTBOUND_REJECTED.inc(upstream=self.name, endpoint=current_endpoint.get(), reason='circuit_open')
+                raise CircuitOpenError(f"{self.name} is unavailable, failing fast", retry_after)
+
+        buckets = [self.bucket]
+        if user_key and self.user_rate:
+            buckets.insert(0, self._user_bucket(user_key))
+        wait = 0.0
+        for bucket in buckets:
+            reserved = bucket.reserve(cost, self.max_wait)
+            if reserved is None:
+                with self._lock:
+                    self.rejected += 1
+                OUTBOUND_REJECTED.inc(upstream=self.name, endpoint=current_endpoint.get(), reason='rate_limit')
+                raise RateLimitExceeded(f"{self.name} rate limit exceeded", self.max_wait)
+            wait = max(wait, reserved)
+        with self._lock:
+            self.calls += 1
+            self.throttled_seconds += wait
+        if wait:
+            OUTBOUND_THROTTLE_SECONDS.inc(wait, upstream=self.name, endpoint=current_endpoint.get())
+        return wait
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> Optional[float]:
+        """Delay before retry number `attempt`, or None when the caller should give up."""
+        if attempt > self.max_retries:
+            return None
+        if retry_after is not None:
+            # Honor the server's hint, plus a little jitter so clients don't return in lockstep
+            if retry_after > self.backoff_max * 4:
+                return None
+            return retry_after + random.uniform(0, self.backoff_base)
+        # Full jitter: uniform over [0, base * 2^attempt], capped
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record(self, success: bool) -> None:
+        if not success:
+            with self._lock:
+                self.failures += 1
+        if self.breaker is not None:
+            if success:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def _observe(self, operation: str, start: float, outcome: str) -> None:
+        OUTBOUND_DURATION.observe(
+            time.perf_counter() - start,
+            upstream=self.name, operation=operation, endpoint=current_endpoint.get(), outcome=outcome
+        )
+
+    def retry_delay(self, attempt: int, retry_after: Optional[float], reason: str,
+                    operation: str = 'request') -> Optional[float]:
+        delay = self._backoff(attempt, retry_after)
+        if delay is not None:
+            with self._lock:
+                self.retries += 1
+            OUTBOUND_RETRIES.inc(upstream=self.name, operation=operation, endpoint=current_endpoint.get())
+            logger.warning(f"{self.name} call failed ({reason}), retry {attempt} in {delay:.2f}s")
+        return delay
+
+    # Blocking callers: googleapiclient and requests, always on worker threads
+
+    def _release(self) -> None:
+        if self.breaker is not None:
+            self.breaker.release_trial()
+
+    def acquire(self, cost: float = 1, user_key: Optional[str] = None) -> None:
+        wait = self._admit(cost, user_key)
+        if wait:
+            try:
+                time.sleep(wait)
+            except BaseException:
+                self._release()
+                raise
+
+    def call(self, fn: Callable[[], T], cost: float = 1, user_key: Optional[str] = None,
+             operation: str = 'request') -> T:
+        """Run a blocking googleapiclient or requests call with quota, retries and breaker.
+
+        googleapiclient raises HttpError on failure; requests responses with a retryable
+        status are retried and the last one is returned. `operation` labels the metrics.
+        """
+        attempt = 0
+        while True:
+            self.acquire(cost, user_key)
+            start = time.perf_counter()
+            try:
+                result = fn()
+            except HttpError as e:
+                status = e.resp.status
+                if not is_retryable_http_error(e):
+                    # The upstream answered; a client error says nothing about its health
+                    self._observe(operation, start, 'client_error')
+                    self._record(True)
+                    raise
+                self._observe(operation, start, 'retryable_error')
+                self._record(status < 500)
+                attempt += 1
+                delay = self.retry_delay(
+                    attempt, parse_retry_after(e.resp.get('retry-after')), f"HTTP {status}", operation
+                )
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except (socket.timeout, TimeoutError, ConnectionError, httplib2.HttpLib2Error,
+                    requests.ConnectionError, requests.Timeout) as e:
+                self._observe(operation, start, 'transport_error')
+                self._record(False)
+                attempt += 1
+                delay = self.retry_delay(attempt, None, type(e).__name__, operation)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except Exception:
+                # Anything else (SSL, DNS, ...) still settles the call, or a half-open
+                # breaker would wait forever for its trial
+                self._observe(operation, start, 'error')
+                self._record(False)
+                raise
+            except BaseException:
+                # Interrupted on our side; says nothing about the upstream, so only hand back the trial
+                self._observe(operation, start, 'cancelled')
+                self._release()
+                raise
+            status = getattr(result, 'status_code', None)
+            if status not in RETRYABLE_STATUSES:
+                self._observe(operation, start, 'client_error' if status and status >= 400 else 'success')
+                self._record(True)
+                return result
+            # requests returns error statuses instead of raising; the last one goes back to the caller
+            self._observe(operation, start, 'retryable_error')
+            self._record(status < 500)
+            attempt += 1
+            delay = self.retry_delay(
+                attempt, parse_retry_after(result.headers.get('Retry-After')), f"HTTP {status}", operation
+            )
+            if delay is None:
+                return result
+            time.sleep(delay)
+
+    # Async callers: httpx on the shared client
+
+    async def acquire_async(self, cost: float = 1, user_key: Optional[str] = None) -> None:
+        wait = self._admit(cost, user_key)
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                self._release()
+                raise
+
+    async def call_async(self, send: Callable[[], Awaitable[httpx.Response]], cost: float = 1,
+                         user_key: Optional[str] = None, operation: str = 'request') -> httpx.Response:
+        """Await an httpx request with quota, retries and breaker; returns the final response.
+
+        Retryable statuses are retried; the last response is returned either way, so callers
+        keep using raise_for_status() as before. For streamed requests the recorded duration
+        covers the response headers only.
+        """
+        attempt = 0
+        while True:
+            await self.acquire_async(cost, user_key)
+            start = time.perf_counter()
+            try:
+                response = await send()
+            except httpx.TransportError as e:
+                self._observe(operation, start, 'transport_error')
+                self._record(False)
+                attempt += 1
+                delay = self.retry_delay(attempt, None, type(e).__name__, operation)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                self._observe(operation, start, 'error')
+                self._record(False)
+                raise
+            except BaseException:
+                # Cancelled when the client goes away mid-call; only hand back the trial
+                self._observe(operation, start, 'cancelled')
+                self._release()
+                raise
+            if response.status_code not in RETRYABLE_STATUSES:
+                self._observe(operation, start, 'client_error' if response.status_code >= 400 else 'success')
+                self._record(True)
+                return response
+            self._observe(operation, start, 'retryable_error')
+            self._record(response.status_code < 500)
+            attempt += 1
+            delay = self.retry_delay(
+                attempt, parse_retry_after(response.headers.get('Retry-After')), f"HTTP {response.status_code}",
+                operation
+            )
+            if delay is None:
+                return response
+            await response.aclose()
+            await asyncio.sleep(delay)
+
+    def record_stream(self, success: bool) -> None:
+        """Report the outcome of a streamed call admitted through acquire_async."""
+        self._record(success)
+
+    def release_stream(self) -> None:
+        """A streamed call was abandoned by our side; release its trial without judging the upstream."""
+        self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+                "tracked_users": len(self._user_buckets)
+            }
+        if self.breaker is not None:
+            stats["breaker"] = {"state": self.breaker.state, "times_opened": self.breaker.times_opened}
+        return stats
+
+
+_upstreams: Dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+
+def _create(name: str) -> Upstream:
+    if name == 'gmail':
+        # Gmail allows 250 quota units per user per second and 1.2M per project per minute
+        return Upstream('gmail', rate=20000, burst=20000, user_rate=250, user_burst=250,
+                        timeout=float(os.getenv('GMAIL_HTTP_TIMEOUT_SECONDS', '30')))
+    if name == 'userinfo':
+        return Upstream('userinfo', rate=100, burst=200, timeout=10)
+    if name == 'openrouter':
+        return Upstream('openrouter', rate=10, burst=20, timeout=60)
+    raise ValueError(f"Unknown upstream {name}")
+
+
+def get_upstream(name: str) -> Upstream:
+    """Process-wide limiter, retry policy and breaker for 'gmail', 'userinfo' or 'openrouter'."""
+    upstream = _upstreams.get(name)
+    if upstream is None:
+        with _upstreams_lock:
+            upstream = _upstreams.get(name)
+            if upstream is None:
+                upstream = _upstreams[name] = _create(name)
+    return upstream
+
+
+def outbound_stats() -> Dict[str, Any]:
+    return {name: upstream.stats() for name, upstream in list(_upstreams.items())}
@@ -0,0 +1,62 @@
+import base64
+import json
+from typing import Any, Dict, List, Optional
+
+CURSOR_VERSION = 1
+
+# Cursors either wrap a Gmail nextPageToken or a keyset position in the local mirror
+GMAIL_CURSOR = "gmail"
+MIRROR_CURSOR = "mirror"
+
+
+def _encode(payload: Dict[str, Any]) -> str:
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def encode_cursor(page_token: Optional[str], query: Optional[str], label_ids: List[str], page_size: int) -> str:
+    """Wrap a Gmail page token together with the filters it was issued for; None starts at the first page."""
+    return _encode({
+        "v": CURSOR_VERSION,
+        "k": GMAIL_CURSOR,
+        "t": page_token,
+        "q": query,
+        "l": label_ids,
+        "s": page_size
+    })
+
+
+def encode_mirror_cursor(internal_date: int, message_id: str, label_ids: List[str], page_size: int) -> str:
+    """Encode the last row of a mirror page so the next page resumes after it."""
+    return _encode({
+        "v": CURSOR_VERSION,
+        "k": MIRROR_CURSOR,
+        "t": [internal_date, message_id],
+        "q": None,
+        "l": label_ids,
+        "s": page_size
+    })
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid page token")
+    if not isinstance(payload, dict) or payload.get("v") != CURSOR_VERSION or "t" not in payload:
+        raise ValueError("Invalid page token")
+    kind = payload.get("k", GMAIL_CURSOR)
+    if kind == MIRROR_CURSOR:
+        position = payload["t"]
+        if not isinstance(position, list) or len(position) != 2:
+            raise ValueError("Invalid page token")
+    elif kind != GMAIL_CURSOR:
+        raise ValueError("Invalid page token")
+    return {
+        "kind": kind,
+        "page_token": payload["t"],
+        "query": payload.get("q"),
+        "label_ids": payload.get("l") or [],
+        "page_size": payload.get("s")
+    }
@@ -0,0 +1,29 @@
+import argparse
+import sys
+from pathlib import Path
+
+# Add the backend directory to Python path
+backend_dir = Path(__file__).parent
+sys.path.append(str(backend_dir))
+
+from activity_log import rebuild_rollups
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def rebuild_stats(email=None):
+    try:
+        logger.info("Rebuilding stats rollups from email logs...")
+        count = rebuild_rollups(email)
+        logger.info(f"Rebuilt stats for {count} user(s)")
+    except Exception as e:
+        logger.error(f"Error rebuilding stats: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute /stats counters and daily rollups from email_logs")
+    parser.add_argument("--email", help="Only rebuild this user")
+    args = parser.parse_args()
+    rebuild_stats(args.email)
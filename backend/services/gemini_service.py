@@ -1,13 +1,26 @@
 import google.generativeai as genai
 from config import settings
+from metrics import LLM_DURATION, record_llm_usage, timed
 import logging
 
 logger = logging.getLogger(__name__)
 
+GEMINI_MODEL = 'gemini-1.5-pro-latest'
+
+def draft_prompt(email_content, tone):
+    """Prompt for a reply to the last message of an email or a compacted thread context."""
+    return f"""
+            Draft a {tone} reply to the last message in this email conversation. Keep it concise.
+            Earlier messages, if any, are context only; don't repeat what was already said.
+            
+            Conversation:
+            {email_content}
+            """
+
 class GeminiService:
     def __init__(self):
         try:
-            genai.configure(api_key="APi KEy Here")
+            genai.configure(api_key=settings.GEMINI_API_KEY)
             
             # List available models
             available_models = genai.list_models()
@@ -16,7 +29,7 @@ class GeminiService:
                 logger.info(f"- {model.name}")
             
             # Use gemini-pro (free tier model)
-            self.model = genai.GenerativeModel('gemini-1.5-pro-latest')
+            self.model = genai.GenerativeModel(GEMINI_MODEL)
             logger.info("Using gemini-pro model")
             
         except Exception as e:
@@ -64,16 +77,33 @@ class GeminiService:
             if not email_content:
                 raise ValueError("Email content is empty")
                 
-            prompt = f"""
-            Draft a {tone} response to this email. Keep it concise and professional.
+            prompt = draft_prompt(email_content, tone)
             
-            Original email:
-            {email_content}
-            """
-            
-            response = self.model.generate_content(prompt)
+            with timed(LLM_DURATION, model=GEMINI_MODEL, operation="draft"):
+                response = self.model.generate_content(prompt)
+            usage = getattr(response, 'usage_metadata', None)
+            if usage is not None:
+                record_llm_usage(GEMINI_MODEL, "draft", {
+                    "prompt_tokens": usage.prompt_token_count,
+                    "completion_tokens": usage.candidates_token_count
+                })
             return response.text
             
         except Exception as e:
             logger.error(f"Error drafting response: {str(e)}")
+            raise
+
+    def draft_response_stream(self, email_content, tone="professional"):
+        """Yield the draft text chunk by chunk as Gemini generates it."""
+        if not email_content:
+            raise ValueError("Email content is empty")
+
+        prompt = draft_prompt(email_content, tone)
+        
+        try:
+            for chunk in self.model.generate_content(prompt, stream=True):
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            logger.error(f"Error streaming draft response: {str(e)}")
             raise 
\ No newline at end of file
@@ -0,0 +1,266 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9'_-]*[a-z0-9]|[a-z0-9]")
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i if in is it its me my not of on or our so that the this
+to was we were will with you your re fwd fw
+""".split())
+# Subject words say more about what a message is than body words
+SUBJECT_WEIGHT = 2.0
+SENDER_WEIGHT = 1.5
+INITIAL_CAPACITY = 1024
+
+
+def _tokens(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall((text or '').lower()) if token not in STOPWORDS]
+
+
+def _sender_domain(from_address: str) -> Optional[str]:
+    match = re.search(r'@([\w.-]+)', from_address or '')
+    return match.group(1).lower() if match else None
+
+
+class HashingVectorizer:
+    """Signed feature hashing of words and word pairs into a fixed-width unit vector.
+
+    Needs no vocabulary or fitting, so vectors from different processes and
+    different days stay comparable. crc32 is used because Python's hash() is
+    salted per process and the vectors are persisted.
+    """
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+
+    def _add(self, vector: np.ndarray, features: Iterable[str], weight: float) -> None:
+        for feature, count in Counter(features).items():
+            hashed = zlib.crc32(feature.encode('utf-8'))
+            sign = 1.0 if hashed & 0x80000000 else -1.0
+            # Sublinear term frequency so a repeated word doesn't dominate
+            vector[hashed % self.dimensions] += sign * weight * (1.0 + np.log(count))
+
+    def vectorize(self, subject: str = '', from_address: str = '', body: str = '') -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for text, weight in ((subject, SUBJECT_WEIGHT), (body, 1.0)):
+            words = _tokens(text)
+            self._add(vector, words, weight)
+            self._add(vector, (f"{a} {b}" for a, b in zip(words, words[1:])), weight * 0.5)
+        domain = _sender_domain(from_address)
+        if domain:
+            self._add(vector, [f"from:{domain}"], SENDER_WEIGHT)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class _UserIndex:
+    """One user's vectors as a memory-mapped float32 matrix plus an append-only id list.
+
+    Rows past the id count are unused capacity; the matrix doubles when full. A second
+    append-only list records which ids were vectorized from a full message body.
+    """
+
+    def __init__(self, directory: str, dimensions: int):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.lock = threading.Lock()
+        # Callers using the index right now; guarded by SimilarityIndex._lock
+        self.holders = 0
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, 'vectors.f32')
+        self.ids_path = os.path.join(directory, 'ids.txt')
+        self.full_path = os.path.join(directory, 'full.txt')
+
+        self.ids: List[str] = []
+        if os.path.exists(self.ids_path):
+            with open(self.ids_path, encoding='utf-8') as f:
+                self.ids = [line.rstrip('\n') for line in f if line.strip()]
+        capacity = os.path.getsize(self.vectors_path) // (4 * dimensions) if os.path.exists(self.vectors_path) else 0
+        if len(self.ids) > capacity:
+            # Vectors are written before ids, so this only happens if the matrix file was lost or cut short
+            logger.warning(f"Similarity index in {directory} is inconsistent, dropping {len(self.ids) - capacity} ids")
+            del self.ids[capacity:]
+            with open(self.ids_path, 'w', encoding='utf-8') as f:
+                f.write(''.join(f"{message_id}\n" for message_id in self.ids))
+        self.rows: Dict[str, int] = {message_id: row for row, message_id in enumerate(self.ids)}
+        self.full: Set[str] = set()
+        if os.path.exists(self.full_path):
+            with open(self.full_path, encoding='utf-8') as f:
+                self.full = {line.rstrip('\n') for line in f if line.strip()} & self.rows.keys()
+        self.matrix = self._open(max(capacity, INITIAL_CAPACITY))
+
+    def _open(self, capacity: int) -> np.memmap:
+        mode = 'r+' if os.path.exists(self.vectors_path) else 'w+'
+        if mode == 'r+' and os.path.getsize(self.vectors_path) < capacity * 4 * self.dimensions:
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(capacity * 4 * self.dimensions)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode=mode, shape=(capacity, self.dimensions))
+
+    def upsert(self, items: List[Tuple[str, np.ndarray, bool]]) -> int:
+        """Write vectors, overwriting rows of ids already indexed; returns how many were new.
+
+        Each item says whether it came from the full body; a row built from the body is
+        never replaced by one built from a snippet.
+        """
+        new_ids = []
+        new_full = []
+        for message_id, vector, full in items:
+            if message_id in self.full and not full:
+                continue
+            if full and message_id not in self.full:
+                self.full.add(message_id)
+                new_full.append(message_id)
+            row = self.rows.get(message_id)
+            if row is None:
+                row = len(self.ids) + len(new_ids)
+                if row >= self.matrix.shape[0]:
+                    self.matrix.flush()
+                    self.matrix = self._open(self.matrix.shape[0] * 2)
+                self.rows[message_id] = row
+                new_ids.append(message_id)
+            self.matrix[row] = vector
+        self.matrix.flush()
+        if new_ids:
+            with open(self.ids_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(f"{message_id}\n" for message_id in new_ids))
+            self.ids.extend(new_ids)
+        if new_full:
+            with open(self.full_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(f"{message_id}\n" for message_id in new_full))
+        return len(new_ids)
+
+    def vector(self, message_id: str) -> Optional[np.ndarray]:
+        row = self.rows.get(message_id)
+        return None if row is None else np.array(self.matrix[row])
+
+    def nearest(self, query: np.ndarray, limit: int, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        count = len(self.ids)
+        if not count or not query.any():
+            return []
+        # Rows are unit vectors, so one matrix-vector product gives every cosine similarity
+        scores = self.matrix[:count] @ query
+        if exclude is not None and exclude in self.rows:
+            scores[self.rows[exclude]] = -np.inf
+        k = min(limit, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[row], round(float(scores[row]), 4)) for row in top if scores[row] > 0]
+
+
+class SimilarityIndex:
+    """Per-user on-disk vector index for "similar emails" and free-text search.
+
+    Vectors are hashed from subject, sender domain and snippet or body, so nothing
+    leaves the machine. Open indexes are kept in an LRU; the rest stay on disk.
+    """
+
+    def __init__(self, directory: Optional[str] = None, dimensions: Optional[int] = None,
+                 max_open: Optional[int] = None):
+        self.directory = directory or os.getenv(
+            'SIMILARITY_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'similarity_index')
+        )
+        self.dimensions = dimensions or int(os.getenv('SIMILARITY_DIMENSIONS', '256'))
+        self.max_open = max_open or int(os.getenv('SIMILARITY_MAX_OPEN_INDEXES', '64'))
+        self.enabled = os.getenv('SIMILARITY_INDEX_ENABLED', 'true').lower() == 'true'
+        self.vectorizer = HashingVectorizer(self.dimensions)
+        self._open: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.indexed = 0
+        self.queries = 0
+
+    @contextmanager
+    def _user_index(self, user_email: str) -> Iterator[_UserIndex]:
+        """Hold the user's index, opened if needed, with its lock taken."""
+        key = hashlib.sha256(user_email.lower().encode('utf-8')).hexdigest()[:32]
+        with self._lock:
+            index = self._open.get(key)
+            if index is None:
+                # Width is part of the path so changing SIMILARITY_DIMENSIONS starts a fresh index
+                index = _UserIndex(os.path.join(self.directory, f"{key}-{self.dimensions}"), self.dimensions)
+                self._open[key] = index
+            self._open.move_to_end(key)
+            index.holders += 1
+            self._evict()
+        try:
+            with index.lock:
+                yield index
+        finally:
+            with self._lock:
+                index.holders -= 1
+                self._evict()
+
+    def _evict(self) -> None:
+        # Only indexes nobody holds are closed, so a user's files are never mapped by two
+        # _UserIndex objects at once; the LRU may run over max_open while they are all busy
+        for key in list(self._open):
+            if len(self._open) <= self.max_open:
+                break
+            if not self._open[key].holders:
+                # Every write is flushed, so the mapping just closes once nothing holds it
+                del self._open[key]
+
+    def add_emails(self, user_email: str, emails: List[Dict[str, Any]]) -> int:
+        """Index listing metadata or parsed messages; a message seen again with its body is re-vectorized.
+
+        Once indexed from its body, a message keeps that vector when listings show it again.
+
+        Returns how many messages were new to the index.
+        """
+        if not self.enabled or not emails:
+            return 0
+        items = [
+            (
+                email['id'],
+                self.vectorizer.vectorize(
+                    email.get('subject', ''),
+                    email.get('from_address') or email.get('from', ''),
+                    email.get('content') or email.get('snippet', '')
+                ),
+                bool(email.get('content'))
+            )
+            for email in emails if email.get('id')
+        ]
+        with self._user_index(user_email) as index:
+            added = index.upsert(items)
+        with self._lock:
+            self.indexed += len(items)
+        return added
+
+    def similar_to(self, user_email: str, message_id: str, limit: int = 10) -> Optional[List[Tuple[str, float]]]:
+        """Nearest messages to an indexed one; None if message_id isn't indexed yet."""
+        with self._user_index(user_email) as index:
+            vector = index.vector(message_id)
+            if vector is None:
+                return None
+            results = index.nearest(vector, limit, exclude=message_id)
+        with self._lock:
+            self.queries += 1
+        return results
+
+    def search(self, user_email: str, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        vector = self.vectorizer.vectorize(subject=query)
+        with self._user_index(user_email) as index:
+            results = index.nearest(vector, limit)
+        with self._lock:
+            self.queries += 1
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "dimensions": self.dimensions,
+                "open_indexes": len(self._open),
+                "indexed": self.indexed,
+                "queries": self.queries
+            }
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls into one in-flight upstream call.
+
+    Callers with the same (operation, key) while a call is running await that call
+    and share its result or exception. Nothing is cached once it completes.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Tuple[str, Hashable], asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, operation: str, field: str) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(operation, {"calls": 0, "executed": 0, "deduplicated": 0})
+            counters[field] += 1
+
+    async def run(self, operation: str, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        flight_key = (operation, key)
+        self._count(operation, "calls")
+        task = self._inflight.get(flight_key)
+        if task is None:
+            self._count(operation, "executed")
+            # A task, not a bare await, so a caller that disconnects doesn't cancel it for the others
+            task = asyncio.ensure_future(fn())
+            self._inflight[flight_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(flight_key, None))
+        else:
+            self._count(operation, "deduplicated")
+            logger.debug(f"Joined in-flight {operation} call")
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            operations = {operation: dict(counters) for operation, counters in self._counters.items()}
+        return {
+            "in_flight": len(self._inflight),
+            "operations": operations
+        }
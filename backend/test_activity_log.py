@@ -0,0 +1,113 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+from activity_log import _insert_ignoring_duplicates, get_user_stats, log_email_activities, rebuild_rollups
+from database import SessionLocal, engine
+from models import EmailLog, User, get_or_create_user, init_db
+
+
+@pytest.fixture(scope="module", autouse=True)
+def tables():
+    init_db(engine)
+
+
+@pytest.fixture
+def email():
+    return f"{uuid.uuid4().hex}@example.com"
+
+
+def totals(email):
+    stats = get_user_stats(email)
+    return stats["total_emails_processed"], stats["total_moved_to_gator"]
+
+
+def test_relisting_the_same_messages_is_idempotent(email):
+    entries = [
+        {"message_id": "m1", "moved": False, "category": "primary"},
+        {"message_id": "m2", "moved": True, "category": "promotions"}
+    ]
+    assert log_email_activities(email, entries) == {"inserted": 2, "newly_moved": 1}
+    assert log_email_activities(email, entries) == {"inserted": 0, "newly_moved": 0}
+    assert totals(email) == (2, 1)
+
+
+def test_message_counts_as_moved_once(email):
+    log_email_activities(email, [{"message_id": "m1", "moved": False}])
+    assert log_email_activities(email, [{"message_id": "m1", "moved": True}]) == {"inserted": 0, "newly_moved": 1}
+    assert log_email_activities(email, [{"message_id": "m1", "moved": True}]) == {"inserted": 0, "newly_moved": 0}
+    assert totals(email) == (1, 1)
+
+
+def test_duplicate_entries_in_one_call_are_merged(email):
+    result = log_email_activities(email, [
+        {"message_id": "m1", "moved": False},
+        {"message_id": "m1", "moved": True}
+    ])
+    assert result == {"inserted": 1, "newly_moved": 1}
+
+
+def trends(email):
+    return get_user_stats(email)["trends"]
+
+
+def test_rollups_split_by_category(email):
+    log_email_activities(email, [
+        {"message_id": "m1", "moved": False, "category": "primary"},
+        {"message_id": "m2", "moved": True, "category": "promotions"}
+    ])
+    log_email_activities(email, [{"message_id": "m1", "moved": True, "category": "updates"}])
+
+    assert trends(email)[0]["categories"] == {
+        "primary": {"emails_processed": 1, "moved_to_gator": 1},
+        "promotions": {"emails_processed": 1, "moved_to_gator": 1}
+    }
+
+
+def test_rows_written_concurrently_are_not_counted_again(email):
+    # Another request logged m1 after this one decided what to write
+    db = SessionLocal()
+    try:
+        user = get_or_create_user(db, email)
+        row = {"user_id": user.id, "moved_to_gator": False, "category": "primary"}
+        assert len(_insert_ignoring_duplicates(db, user.id, [dict(row, message_id="m1")])) == 1
+        inserted = _insert_ignoring_duplicates(db, user.id, [dict(row, message_id="m1"), dict(row, message_id="m2")])
+        db.commit()
+    finally:
+        db.close()
+    assert [message_id for message_id, _, _, _ in inserted] == ["m2"]
+
+
+def test_rebuild_matches_incremental_counters(email):
+    log_email_activities(email, [
+        {"message_id": f"m{i}", "moved": i % 3 == 0, "category": "updates" if i % 2 else "primary"}
+        for i in range(10)
+    ])
+    before = get_user_stats(email)
+    assert rebuild_rollups(email) == 1
+    assert get_user_stats(email) == before
+
+
+def test_moving_an_older_message_counts_on_the_day_it_was_logged(email):
+    log_email_activities(email, [{"message_id": "m1", "moved": False}])
+    two_days_ago = datetime.now(timezone.utc) - timedelta(days=2)
+    db = SessionLocal()
+    try:
+        db.execute(update(EmailLog).where(EmailLog.message_id == "m1", EmailLog.user_id == (
+            select(User.id).where(User.email == email).scalar_subquery()
+        )).values(created_at=two_days_ago))
+        db.commit()
+    finally:
+        db.close()
+    rebuild_rollups(email)
+
+    log_email_activities(email, [{"message_id": "m1", "moved": True}])
+    (bucket,) = trends(email)
+    assert bucket["day"] == two_days_ago.date().isoformat()
+    assert bucket["moved_to_gator"] == 1
+
+    before = get_user_stats(email)
+    rebuild_rollups(email)
+    assert get_user_stats(email) == before
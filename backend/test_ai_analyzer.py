@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from ai_analyzer import AIAnalyzer, CHARS_PER_TOKEN, UpstreamUnavailable, upstream_failure
+from outbound import CircuitBreaker, CircuitOpenError, Upstream
+
+
+def make_email(index: int, content: str = "Short body.") -> dict:
+    return {"id": f"m{index}", "subject": f"Subject {index}", "from": "a@example.com", "content": content}
+
+
+@pytest.fixture
+def analyzer():
+    analyzer = AIAnalyzer()
+    analyzer.batch_token_budget = 1000
+    analyzer.batch_max_emails = 3
+    return analyzer
+
+
+def test_pack_batches_respects_max_emails(analyzer):
+    batches = analyzer.pack_batches([make_email(i) for i in range(7)])
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert [email["id"] for batch in batches for email in batch] == [f"m{i}" for i in range(7)]
+
+
+def test_pack_batches_respects_token_budget(analyzer):
+    body = "x" * (300 * CHARS_PER_TOKEN)
+    batches = analyzer.pack_batches([make_email(i, body) for i in range(4)])
+    assert [len(batch) for batch in batches] == [2, 2]
+
+
+def test_pack_batches_truncates_oversized_email(analyzer):
+    body = "x" * (5000 * CHARS_PER_TOKEN)
+    (batch,) = analyzer.pack_batches([make_email(0, body)])
+    assert len(batch[0]["content"]) < len(body)
+    assert analyzer.estimate_tokens(batch[0]["content"]) <= analyzer.batch_token_budget
+
+
+def test_parse_batch_response_maps_refs_to_message_ids(analyzer):
+    emails = [make_email(i) for i in range(3)]
+    raw = "Here you go:\n" + json.dumps([
+        {"id": "E2", "topic": "Invoice", "category": "Important", "should_trash": "no", "key_points": ["pay"]},
+        {"id": "e1", "topic": "Sale", "category": "promotional", "should_trash": True},
+        {"id": "E9", "topic": "out of range"},
+        "not an object"
+    ]) + "\nThanks"
+    results = analyzer._parse_batch_response(raw, emails)
+    assert set(results) == {"m0", "m1"}
+    assert results["m1"]["topic"] == "invoice"
+    assert results["m1"]["category"] == "important"
+    assert results["m1"]["should_trash"] is False
+    assert results["m1"]["key_points"] == ["pay"]
+    assert results["m0"]["should_trash"] is True
+
+
+def test_parse_batch_response_without_array_raises(analyzer):
+    with pytest.raises(ValueError):
+        analyzer._parse_batch_response("I cannot do that.", [make_email(0)])
+
+
+def test_batch_fallback_failure_keeps_other_results(analyzer, monkeypatch):
+    emails = [make_email(i) for i in range(3)]
+
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            # The model answered for m0 only; m1 and m2 fall back to one call each
+            content = json.dumps([{"id": "E1", "topic": "batched"}])
+            return {"choices": [{"message": {"content": content}}]}
+
+    async def call_async(send, **kwargs):
+        return Response()
+
+    async def analyze_email_async(subject, content, from_address):
+        if subject == "Subject 1":
+            raise CircuitOpenError("openrouter is unavailable, failing fast", 30)
+        return {"topic": "single"}
+
+    monkeypatch.setattr("ai_analyzer.get_upstream", lambda name: type("U", (), {
+        "call_async": staticmethod(call_async), "timeout": 1
+    }))
+    monkeypatch.setattr(analyzer, "analyze_email_async", analyze_email_async)
+
+    results = asyncio.run(analyzer.analyze_batch_async(emails))
+    assert results["m0"]["topic"] == "batched"
+    assert "unavailable" in results["m1"]["error"]
+    assert results["m2"] == {"topic": "single"}
+
+
+def test_abandoned_stream_is_not_an_upstream_failure(analyzer, monkeypatch):
+    upstream = Upstream('test', rate=1000, burst=1000, timeout=1)
+
+    def handler(request):
+        chunks = [{"choices": [{"delta": {"content": word}}]} for word in ("Topic:", " Billing")]
+        body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+        return httpx.Response(200, text=body)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr("ai_analyzer.get_http_client", lambda: client)
+    monkeypatch.setattr("ai_analyzer.get_upstream", lambda name: upstream)
+
+    async def scenario():
+        stream = analyzer.analyze_email_stream("Invoice", "Please pay.", "billing@example.com")
+        assert await stream.__anext__() == ("token", "Topic:")
+        # The client went away after the first token
+        await stream.aclose()
+        await client.aclose()
+
+    asyncio.run(scenario())
+    assert upstream.failures == 0
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.parametrize("error, transient", [
+    (CircuitOpenError("openrouter is unavailable, failing fast", 30), True),
+    (httpx.ConnectError("refused"), True),
+    (httpx.HTTPStatusError("busy", request=httpx.Request("POST", "http://x"), response=httpx.Response(503)), True),
+    (httpx.HTTPStatusError("bad key", request=httpx.Request("POST", "http://x"), response=httpx.Response(401)), False),
+])
+def test_upstream_failures_say_whether_they_may_pass(error, transient):
+    failure = upstream_failure(error)
+    assert isinstance(failure, ValueError)
+    assert isinstance(failure, UpstreamUnavailable) == transient
@@ -0,0 +1,39 @@
+import uuid
+
+import pytest
+
+from analysis_cache import AnalysisCache
+from database import SessionLocal, engine
+from models import User, init_db
+
+
+@pytest.fixture
+def email():
+    init_db(engine)
+    return f"{uuid.uuid4().hex}@example.com"
+
+
+def user_exists(email: str) -> bool:
+    db = SessionLocal()
+    try:
+        return db.query(User).filter(User.email == email).first() is not None
+    finally:
+        db.close()
+
+
+def test_lookup_for_unknown_user_is_a_miss_without_creating_it(email):
+    cache = AnalysisCache("model", "1")
+    assert cache.get(email, "m1") is None
+    assert not user_exists(email)
+    assert cache.stats()["misses"] == 1
+
+
+def test_stored_analysis_is_read_back_from_the_database(email):
+    AnalysisCache("model", "1").put(email, "m1", "hash", {"topic": "Invoice"})
+
+    # A fresh instance has an empty LRU, so this goes to the table
+    cache = AnalysisCache("model", "1")
+    assert cache.get(email, "m1", "hash") == {"topic": "Invoice"}
+    assert cache.get(email, "m1", "other-hash") is None
+    assert AnalysisCache("model", "2").get(email, "m1") is None
+    assert cache.stats()["db_hits"] == 1
@@ -0,0 +1,91 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from ai_analyzer import UpstreamUnavailable
+from analysis_jobs import STATUS_COMPLETED, STATUS_FAILED, AnalysisJobQueue
+
+
+class Analyzer:
+    """Fails the first `failures` calls with `error`, then answers."""
+
+    def __init__(self, failures: int, error: Exception):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    async def analyze_email_async(self, subject, content, from_address):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return {"topic": subject}
+
+
+class Cache:
+    def __init__(self):
+        self.stored = {}
+
+    def put(self, user_email, message_id, content_hash, result):
+        self.stored[message_id] = result
+
+
+def run_job(queue: AnalysisJobQueue, timeout: float = 5.0) -> dict:
+    async def scenario():
+        await queue.start()
+        try:
+            job = await queue.submit("user@example.com", "m1", "Invoice", "a@example.com", "Body", "hash")
+            return await queue.wait(job["job_id"], timeout)
+        finally:
+            await queue.stop()
+
+    return asyncio.run(scenario())
+
+
+def make_queue(tmp_path, analyzer, max_attempts: int = 3) -> AnalysisJobQueue:
+    queue = AnalysisJobQueue(analyzer, Cache(), db_path=str(tmp_path / "jobs.db"), workers=1)
+    queue.max_attempts = max_attempts
+    queue.retry_seconds = 0.01
+    return queue
+
+
+def test_transient_upstream_error_is_retried(tmp_path):
+    analyzer = Analyzer(2, UpstreamUnavailable("OpenRouter API failed: circuit open", 0.0))
+    job = run_job(make_queue(tmp_path, analyzer))
+    assert job["status"] == STATUS_COMPLETED
+    assert job["attempts"] == 2
+    assert analyzer.calls == 3
+
+
+def test_retries_stop_after_max_attempts(tmp_path):
+    analyzer = Analyzer(10, UpstreamUnavailable("OpenRouter API failed: 503", 0.0))
+    job = run_job(make_queue(tmp_path, analyzer, max_attempts=3))
+    assert job["status"] == STATUS_FAILED
+    assert analyzer.calls == 3
+
+
+def test_validation_error_fails_at_once(tmp_path):
+    analyzer = Analyzer(10, ValueError("Email content is empty"))
+    job = run_job(make_queue(tmp_path, analyzer))
+    assert job["status"] == STATUS_FAILED
+    assert job["error"] == "Email content is empty"
+    assert analyzer.calls == 1
+
+
+def test_retry_waits_at_least_retry_after(tmp_path):
+    queue = make_queue(tmp_path, Analyzer(0, ValueError()))
+    assert queue._retry_delay(0, 30) == 30
+    assert queue._retry_delay(3, 0) == pytest.approx(0.08)
+
+
+def test_queue_files_without_retry_columns_are_upgraded(tmp_path):
+    path = tmp_path / "jobs.db"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE analysis_jobs (id TEXT PRIMARY KEY, user_email TEXT NOT NULL, message_id TEXT NOT NULL, "
+        "priority INTEGER NOT NULL, status TEXT NOT NULL, subject TEXT, from_address TEXT, content TEXT, "
+        "content_hash TEXT, result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+    )
+    conn.close()
+    job = run_job(make_queue(tmp_path, Analyzer(0, ValueError())))
+    assert job["status"] == STATUS_COMPLETED
@@ -0,0 +1,39 @@
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.pool import NullPool
+
+import database
+from database import async_database_url, close_async_engine, engine_options, get_request_db, run_db
+
+
+def test_queue_pool_engines_get_sizing():
+    options = engine_options("postgresql://user@localhost/app")
+    assert {"pool_size", "max_overflow", "pool_timeout"} <= set(options)
+
+
+def test_single_connection_and_null_pool_engines_get_no_sizing():
+    for url in ("sqlite://", "sqlite:///:memory:", "sqlite+aiosqlite:////tmp/app.db"):
+        assert not {"pool_size", "max_overflow", "pool_timeout"} & set(engine_options(url)), url
+
+
+def test_async_session_on_file_sqlite(monkeypatch):
+    assert database.DATABASE_URL.startswith("sqlite:///")
+    monkeypatch.setattr(database, "ASYNC_DATABASE_ENABLED", True)
+
+    async def scenario():
+        try:
+            sessions = get_request_db()
+            db = await sessions.__anext__()
+            assert isinstance(db, AsyncSession)
+            assert (await db.execute(text("SELECT 1"))).scalar() == 1
+            # Blocking helpers run on the same session through run_sync
+            assert await run_db(db, lambda db: db.execute(text("SELECT 2")).scalar()) == 2
+            assert isinstance(database._async_engine.pool, NullPool)
+            await sessions.aclose()
+        finally:
+            await close_async_engine()
+
+    asyncio.run(scenario())
+    assert async_database_url(database.DATABASE_URL).startswith("sqlite+aiosqlite:///")
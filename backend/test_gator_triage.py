@@ -0,0 +1,81 @@
+import uuid
+
+import pytest
+from google.oauth2.credentials import Credentials
+
+import gmail_pool
+from fakes.fake_gmail import start_fake_gmail
+from fast_classifier import FastClassifier
+from gator_triage import GatorTriage
+from gmail_service import GmailService
+
+
+@pytest.fixture
+def fake_gmail(monkeypatch):
+    server = start_fake_gmail(message_count=30)
+    monkeypatch.setenv('GMAIL_API_ROOT_URL', server.root_url)
+    # The discovery document is cached per process with the root URL baked in
+    monkeypatch.setattr(gmail_pool, '_discovery_doc', None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def gmail_service(fake_gmail):
+    return GmailService()
+
+
+@pytest.fixture
+def credentials():
+    return Credentials(token='gator-triage-test-token')
+
+
+@pytest.fixture
+def email():
+    return f"{uuid.uuid4().hex}@example.com"
+
+
+def inbox(gmail_service, credentials):
+    emails, _, _ = gmail_service.list_emails(credentials, 30, label_ids=['INBOX'])
+    return emails
+
+
+def test_label_id_is_resolved_once_per_user(fake_gmail, gmail_service, credentials, email):
+    triage = GatorTriage(gmail_service, FastClassifier())
+    service = gmail_service.get_gmail_service(credentials)
+
+    assert triage.triage(service, email, inbox(gmail_service, credentials)) > 0
+    loads = gmail_service.label_registry.stats()["loads"]
+    gmail_service.label_registry.invalidate(email)
+    # Nothing left to move, and the cached id needs no labels.list
+    assert triage.triage(service, email, inbox(gmail_service, credentials)) == 0
+    assert gmail_service.label_registry.stats()["loads"] == loads
+
+
+def test_listing_flags_moved_mail_without_creating_the_label(fake_gmail, gmail_service, credentials, email):
+    triage = GatorTriage(gmail_service, FastClassifier())
+    service = gmail_service.get_gmail_service(credentials)
+    emails = inbox(gmail_service, credentials)
+
+    triage.mark_moved(service, email, emails)
+    assert not any(row['moved_to_gator'] for row in emails)
+    assert all(label['name'] != triage.label_name for label in fake_gmail.mailbox.labels.values())
+
+    triage.triage(service, email, emails)
+    listed, _, _ = gmail_service.list_emails(credentials, 30)
+    GatorTriage(gmail_service, FastClassifier()).mark_moved(service, email, listed)
+    assert {row['id'] for row in listed if row['moved_to_gator']} == {
+        row['id'] for row in emails if row['moved_to_gator']
+    }
+
+
+def test_deleted_label_is_created_again(fake_gmail, gmail_service, credentials, email):
+    triage = GatorTriage(gmail_service, FastClassifier())
+    service = gmail_service.get_gmail_service(credentials)
+    emails = inbox(gmail_service, credentials)
+    first = triage.label_id(service, email)
+    fake_gmail.mailbox.delete_label(first)
+
+    assert triage.triage(service, email, emails) > 0
+    assert triage.label_id(service, email) != first
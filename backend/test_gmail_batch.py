@@ -0,0 +1,65 @@
+import pytest
+from google.oauth2.credentials import Credentials
+
+import gmail_pool
+from fakes.fake_gmail import start_fake_gmail
+from gmail_service import GmailService, METADATA_HEADERS
+from outbound import get_upstream
+
+
+@pytest.fixture
+def fake_gmail(monkeypatch):
+    server = start_fake_gmail(message_count=60, error_rate=0.2, error_status=503, seed=7)
+    monkeypatch.setenv('GMAIL_API_ROOT_URL', server.root_url)
+    monkeypatch.setenv('GMAIL_BATCH_SIZE', '20')
+    # The discovery document is cached per process with the root URL baked in
+    monkeypatch.setattr(gmail_pool, '_discovery_doc', None)
+    gmail = get_upstream('gmail')
+    monkeypatch.setattr(gmail, 'backoff_base', 0.001)
+    monkeypatch.setattr(gmail, 'backoff_max', 0.01)
+    monkeypatch.setattr(gmail, 'max_retries', 10)
+    monkeypatch.setattr(gmail.breaker, 'failure_threshold', 1000)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def gmail_service(fake_gmail):
+    return GmailService()
+
+
+@pytest.fixture
+def service(gmail_service):
+    return gmail_service.get_gmail_service(Credentials(token='batch-test-token'))
+
+
+def test_batch_fetch_retries_failed_items_and_keeps_order(fake_gmail, gmail_service, service):
+    message_ids = fake_gmail.mailbox.order[:50]
+    messages = gmail_service.get_messages_batch(service, message_ids, metadata_headers=METADATA_HEADERS)
+
+    assert fake_gmail.injected_errors > 0
+    assert [message['id'] for message in messages] == message_ids
+    headers = {header['name'] for header in messages[0]['payload']['headers']}
+    assert headers == set(METADATA_HEADERS)
+
+
+def test_batch_uses_one_request_per_chunk_without_errors(fake_gmail, gmail_service, service):
+    fake_gmail.error_rate = 0.0
+    before = fake_gmail.request_count
+    messages = gmail_service.get_messages_batch(service, fake_gmail.mailbox.order[:50])
+
+    assert len(messages) == 50
+    # 50 ids in chunks of 20
+    assert fake_gmail.request_count - before == 3
+
+
+def test_batch_reports_non_retryable_errors_per_item(fake_gmail, gmail_service, service):
+    fake_gmail.error_rate = 0.0
+    existing = fake_gmail.mailbox.order[:3]
+    trashed, errors = gmail_service.trash_emails_batch(service, existing + ['missing-id'])
+
+    assert set(trashed) == set(existing)
+    assert set(errors) == {'missing-id'}
+    for message_id in existing:
+        assert 'TRASH' in fake_gmail.mailbox.messages[message_id]['labelIds']
@@ -0,0 +1,88 @@
+import uuid
+
+import pytest
+from google.oauth2.credentials import Credentials
+
+import gmail_pool
+from database import engine
+from fakes.fake_gmail import start_fake_gmail
+from gmail_service import GmailService
+from mailbox_sync import MailboxSync
+from models import init_db
+
+
+@pytest.fixture
+def fake_gmail(monkeypatch):
+    server = start_fake_gmail(message_count=50)
+    monkeypatch.setenv('GMAIL_API_ROOT_URL', server.root_url)
+    # The discovery document is cached per process with the root URL baked in
+    monkeypatch.setattr(gmail_pool, '_discovery_doc', None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def gmail_service(fake_gmail):
+    init_db(engine)
+    return GmailService()
+
+
+@pytest.fixture
+def credentials():
+    return Credentials(token='mailbox-sync-test-token')
+
+
+@pytest.fixture
+def email():
+    return f"{uuid.uuid4().hex}@example.com"
+
+
+def list_all(sync, gmail_service, credentials, email, label_ids=None):
+    """Page through the mirror, then through Gmail below it, like GET /emails does."""
+    ids, after = [], None
+    while True:
+        emails, after, older_than = sync.list_messages(email, 8, label_ids, after)
+        ids += [row['id'] for row in emails]
+        if not after:
+            break
+    if older_than:
+        service = gmail_service.get_gmail_service(credentials)
+        page_token = None
+        while True:
+            page, page_token = gmail_service.list_message_ids(
+                service, 8, page_token, f"before:{older_than // 1000}", label_ids
+            )
+            ids += page
+            if not page_token:
+                break
+    return ids
+
+
+def test_capped_mirror_hands_older_pages_to_gmail(fake_gmail, gmail_service, credentials, email):
+    sync = MailboxSync(gmail_service)
+    sync.full_sync_max_messages = 20
+    sync.sync(credentials, email)
+
+    assert list_all(sync, gmail_service, credentials, email) == fake_gmail.mailbox.order
+
+
+def test_capped_mirror_keeps_label_filters_past_its_end(fake_gmail, gmail_service, credentials, email):
+    sync = MailboxSync(gmail_service)
+    sync.full_sync_max_messages = 20
+    sync.sync(credentials, email)
+
+    expected = [
+        message_id for message_id in fake_gmail.mailbox.order
+        if 'UNREAD' in fake_gmail.mailbox.messages[message_id]['labelIds']
+    ]
+    assert list_all(sync, gmail_service, credentials, email, ['UNREAD']) == expected
+
+
+def test_complete_mirror_does_not_fall_back(fake_gmail, gmail_service, credentials, email):
+    sync = MailboxSync(gmail_service)
+    sync.sync(credentials, email)
+
+    emails, after, older_than = sync.list_messages(email, 100)
+    assert len(emails) == 50
+    assert after is None and older_than is None
@@ -0,0 +1,37 @@
+import base64
+
+from mime_extract import extract_body, html_to_text, strip_quoted_and_signature
+
+
+def html_part(html: str) -> dict:
+    data = base64.urlsafe_b64encode(html.encode('utf-8')).decode('ascii')
+    return {'mimeType': 'text/html', 'headers': [], 'body': {'data': data}}
+
+
+def test_reply_drops_quoted_history():
+    html = (
+        '<div>Sounds good, see you then.</div>'
+        '<div class="gmail_quote"><div class="gmail_attr">On Mon, Bob wrote:</div>'
+        '<blockquote>Lunch on Friday?</blockquote></div>'
+    )
+    assert html_to_text(html) == "Sounds good, see you then."
+
+
+def test_html_only_forward_falls_back_to_quoted_text():
+    html = (
+        '<div dir="ltr"><br></div>'
+        '<div class="gmail_quote"><div>---------- Forwarded message ---------<br>From: Bob</div>'
+        '<blockquote>Your order has shipped.</blockquote></div>'
+    )
+    body = extract_body(html_part(html))
+    assert "Your order has shipped." in body
+
+
+def test_signature_is_still_dropped_from_the_fallback():
+    html = '<blockquote>Quoted only</blockquote><div class="gmail_signature">Bob, CEO</div>'
+    assert html_to_text(html) == "Quoted only"
+
+
+def test_plain_text_of_only_quoted_lines_is_kept_unquoted():
+    assert strip_quoted_and_signature("> first\n>> second") == "first\nsecond"
+    assert strip_quoted_and_signature("New text\n> old text") == "New text"
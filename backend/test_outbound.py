@@ -0,0 +1,209 @@
+import asyncio
+import socket
+import ssl
+import time
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from outbound import CircuitBreaker, CircuitOpenError, RateLimitExceeded, TokenBucket, Upstream, parse_retry_after
+
+
+def make_upstream(**overrides) -> Upstream:
+    upstream = Upstream('test', rate=1000, burst=1000, timeout=1)
+    upstream.max_retries = 0
+    upstream.backoff_base = 0.001
+    upstream.backoff_max = 0.001
+    upstream.breaker.failure_threshold = overrides.get('failure_threshold', 1)
+    upstream.breaker.reset_seconds = overrides.get('reset_seconds', 0.05)
+    return upstream
+
+
+def http_error(status: int) -> HttpError:
+    return HttpError(httplib2.Response({'status': status}), b'{}')
+
+
+def open_breaker(upstream: Upstream) -> None:
+    def fail():
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        upstream.call(fail)
+    assert upstream.breaker.state == CircuitBreaker.OPEN
+
+
+def test_breaker_opens_after_threshold_and_fails_fast():
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=60)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.before_call() is None
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.before_call() > 0
+
+
+def test_breaker_allows_one_trial_after_reset():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.before_call() is None
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # The trial is still in flight, so everyone else keeps failing fast
+    assert breaker.before_call() is not None
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.before_call() is None
+
+
+def test_failed_trial_reopens_breaker():
+    breaker = CircuitBreaker(failure_threshold=5, reset_seconds=0.01)
+    for _ in range(5):
+        breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.before_call() is None
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 2
+
+
+def test_open_upstream_raises_circuit_open_error():
+    upstream = make_upstream(reset_seconds=60)
+    open_breaker(upstream)
+    with pytest.raises(CircuitOpenError):
+        upstream.call(lambda: 'never called')
+
+
+@pytest.mark.parametrize("error", [
+    OSError(101, "Network is unreachable"),
+    ssl.SSLError("handshake failed"),
+    socket.gaierror(-2, "Name or service not known"),
+    RuntimeError("unexpected"),
+])
+def test_unlisted_trial_failure_reopens_breaker(error):
+    upstream = make_upstream()
+    open_breaker(upstream)
+    time.sleep(0.06)
+
+    def fail():
+        raise error
+
+    with pytest.raises(type(error)):
+        upstream.call(fail)
+    assert upstream.breaker.state == CircuitBreaker.OPEN
+    # Once the reset interval passes again, the next trial gets through
+    time.sleep(0.06)
+    assert upstream.call(lambda: 'ok') == 'ok'
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_client_errors_do_not_count_against_upstream():
+    upstream = make_upstream(failure_threshold=2)
+
+    def not_found():
+        raise http_error(404)
+
+    for _ in range(3):
+        with pytest.raises(HttpError):
+            upstream.call(not_found)
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retryable_http_errors_are_retried():
+    upstream = make_upstream(failure_threshold=10)
+    upstream.max_retries = 3
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise http_error(503)
+        return 'ok'
+
+    assert upstream.call(flaky) == 'ok'
+    assert len(attempts) == 3
+    assert upstream.stats()['retries'] == 2
+
+
+def test_cancelled_async_trial_is_released_without_a_failure():
+    upstream = make_upstream()
+    open_breaker(upstream)
+    failures = upstream.failures
+    time.sleep(0.06)
+
+    async def scenario():
+        async def hang():
+            await asyncio.sleep(10)
+
+        task = asyncio.create_task(upstream.call_async(hang))
+        await asyncio.sleep(0.01)
+        assert upstream.breaker.state == CircuitBreaker.HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    # Cancellation says nothing about the upstream; the next caller gets the trial
+    assert upstream.failures == failures
+    assert upstream.breaker.before_call() is None
+
+
+def test_cancellations_do_not_open_the_breaker():
+    upstream = make_upstream(failure_threshold=2)
+
+    async def scenario():
+        async def hang():
+            await asyncio.sleep(10)
+
+        for _ in range(3):
+            task = asyncio.create_task(upstream.call_async(hang))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(scenario())
+    assert upstream.failures == 0
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_trial_cancelled_while_throttled_is_released():
+    upstream = make_upstream(reset_seconds=60)
+    open_breaker(upstream)
+    upstream.breaker.opened_at -= 60
+    upstream.bucket = TokenBucket(rate=1, capacity=1)
+    upstream.bucket.reserve(1, max_wait=10)
+
+    async def scenario():
+        task = asyncio.create_task(upstream.call_async(lambda: None))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    # The trial never reached the upstream, so the next caller may try straight away
+    assert upstream.breaker.before_call() is None
+
+
+def test_token_bucket_refuses_waits_beyond_max_wait():
+    bucket = TokenBucket(rate=10, capacity=1)
+    assert bucket.reserve(1, max_wait=0) == 0
+    assert bucket.reserve(1, max_wait=0) is None
+    assert 0 < bucket.reserve(1, max_wait=1) <= 0.1
+
+
+def test_rate_limited_upstream_raises():
+    upstream = make_upstream()
+    upstream.bucket = TokenBucket(rate=0.001, capacity=1)
+    upstream.max_wait = 0
+    upstream.call(lambda: None)
+    with pytest.raises(RateLimitExceeded):
+        upstream.call(lambda: None)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after('soon') is None
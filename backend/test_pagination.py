@@ -0,0 +1,39 @@
+import pytest
+
+from pagination import GMAIL_CURSOR, MIRROR_CURSOR, decode_cursor, encode_cursor, encode_mirror_cursor
+
+
+def test_gmail_cursor_round_trips_filters():
+    cursor = encode_cursor("gmail-token", "from:bob", ["INBOX"], 25)
+    assert decode_cursor(cursor) == {
+        "kind": GMAIL_CURSOR,
+        "page_token": "gmail-token",
+        "query": "from:bob",
+        "label_ids": ["INBOX"],
+        "page_size": 25
+    }
+
+
+def test_mirror_cursor_round_trips_position():
+    cursor = encode_mirror_cursor(1704103200000, "abc", [], 10)
+    decoded = decode_cursor(cursor)
+    assert decoded["kind"] == MIRROR_CURSOR
+    assert decoded["page_token"] == [1704103200000, "abc"]
+    assert decoded["label_ids"] == []
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor("?/+" * 20, "subject:a+b", ["Label_1"], 100)
+    assert not set(cursor) & set("+/=")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    "e30",  # {}
+    encode_cursor("t", None, [], 10)[:-4],
+    "eyJ2IjoyLCJ0IjoieCJ9",  # {"v":2,"t":"x"}
+    "eyJ2IjoxLCJrIjoibWlycm9yIiwidCI6MX0",  # mirror cursor without a position pair
+])
+def test_invalid_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid page token"):
+        decode_cursor(cursor)
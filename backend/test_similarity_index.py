@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from similarity_index import SimilarityIndex
+
+USER = "someone@example.com"
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SimilarityIndex(directory=str(tmp_path), dimensions=64)
+
+
+def body_email(**overrides):
+    email = {
+        "id": "m1", "subject": "Invoice", "from": "billing@example.com",
+        "snippet": "Your invoice is ready", "content": "Invoice 42 for hosting, due on the first of the month"
+    }
+    email.update(overrides)
+    return email
+
+
+def stored_vector(index, message_id):
+    with index._user_index(USER) as user_index:
+        return user_index.vector(message_id)
+
+
+def test_listing_does_not_overwrite_vector_from_body(index):
+    index.add_emails(USER, [body_email()])
+    from_body = stored_vector(index, "m1")
+
+    listing = body_email(content=None)
+    index.add_emails(USER, [listing])
+    assert np.allclose(stored_vector(index, "m1"), from_body)
+
+
+def test_body_replaces_vector_from_listing(index):
+    index.add_emails(USER, [body_email(content=None)])
+    from_snippet = stored_vector(index, "m1")
+
+    assert index.add_emails(USER, [body_email()]) == 0
+    assert not np.allclose(stored_vector(index, "m1"), from_snippet)
+
+
+def test_body_marker_survives_reopening(tmp_path):
+    index = SimilarityIndex(directory=str(tmp_path), dimensions=64)
+    index.add_emails(USER, [body_email()])
+    from_body = stored_vector(index, "m1")
+
+    reopened = SimilarityIndex(directory=str(tmp_path), dimensions=64)
+    reopened.add_emails(USER, [body_email(content=None)])
+    assert np.allclose(stored_vector(reopened, "m1"), from_body)
@@ -0,0 +1,44 @@
+from thread_context import ThreadContextCache
+
+
+class Thread:
+    """Stands in for GmailService.get_thread over a thread that grows."""
+
+    def __init__(self, count: int):
+        self.messages = [
+            {"id": f"m{i}", "subject": "Plans", "from": f"person{i}@example.com", "date": f"day {i}",
+             "content": f"Message number {i} says something distinct about topic {i}."}
+            for i in range(count)
+        ]
+        self.calls = 0
+
+    def get_thread(self, service, thread_id):
+        self.calls += 1
+        return list(self.messages)
+
+
+def test_context_ends_at_the_message_being_replied_to():
+    thread = Thread(3)
+    cache = ThreadContextCache(thread, recent_messages=3, fresh_seconds=60)
+
+    result = cache.get(None, "user@example.com", "t1", "m1")
+    assert "Message number 1" in result["context"]
+    assert "Message number 2" not in result["context"]
+    assert result["messages"] == 2
+
+    # Served from the cache, still cut at m0
+    result = cache.get(None, "user@example.com", "t1", "m0")
+    assert result["fetched"] is False
+    assert "Message number 1" not in result["context"]
+
+
+def test_replying_to_a_folded_message_keeps_it_in_full():
+    thread = Thread(6)
+    cache = ThreadContextCache(thread, recent_messages=2, fresh_seconds=60)
+    cache.get(None, "user@example.com", "t1", "m5")
+
+    result = cache.get(None, "user@example.com", "t1", "m1")
+    assert result["fetched"] is True
+    assert "From: person1@example.com" in result["context"]
+    assert "topic 2" not in result["context"]
+    assert result["messages"] == 2
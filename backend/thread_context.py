@@ -0,0 +1,205 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from gmail_service import GmailService
+from mime_extract import CHARS_PER_TOKEN, truncate_to_budget
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+SUMMARY_LINE_CHARS = 240
+
+
+def _paragraph_key(paragraph: str) -> str:
+    return re.sub(r'\W+', ' ', paragraph.lower()).strip()
+
+
+def _first_sentences(text: str, max_chars: int = SUMMARY_LINE_CHARS) -> str:
+    text = ' '.join(text.split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    ends = [match.start() for match in SENTENCE_END.finditer(cut)]
+    return cut[:ends[-1]] if ends else cut.rsplit(' ', 1)[0] + '...'
+
+
+class ThreadContext:
+    """Compacted conversation of one thread, extended in place as replies arrive.
+
+    The newest messages are kept in full. Older ones are folded into a running
+    summary of one extractive line per message once the recent window holds too
+    many messages or too many tokens. Paragraphs repeated from earlier messages
+    (disclaimers, pasted quotes) are dropped.
+    """
+
+    def __init__(self, thread_id: str, recent_messages: int, token_budget: int):
+        self.thread_id = thread_id
+        self.recent_messages = recent_messages
+        self.token_budget = token_budget
+        self.subject = ''
+        self.message_ids: List[str] = []
+        self.summary: List[str] = []
+        self.recent: List[Dict[str, str]] = []
+        self._seen_paragraphs: Set[str] = set()
+        self.fetched_at = 0.0
+        self.lock = threading.Lock()
+
+    def extend(self, messages: List[Dict[str, Any]]) -> int:
+        """Add messages not seen before, oldest first; returns how many were new."""
+        added = 0
+        for message in messages:
+            if message['id'] in self.message_ids:
+                continue
+            self.subject = self.subject or message.get('subject', '')
+            paragraphs = []
+            for paragraph in re.split(r'\n\s*\n', message.get('content') or ''):
+                key = _paragraph_key(paragraph)
+                if not key or key in self._seen_paragraphs:
+                    continue
+                self._seen_paragraphs.add(key)
+                paragraphs.append(paragraph.strip())
+            self.message_ids.append(message['id'])
+            self.recent.append({
+                "id": message['id'],
+                "from": message.get('from', ''),
+                "date": message.get('date', ''),
+                "text": '\n\n'.join(paragraphs)
+            })
+            added += 1
+        self._fold()
+        return added
+
+    def _recent_chars(self, recent: Optional[List[Dict[str, str]]] = None) -> int:
+        return sum(len(entry["text"]) for entry in (self.recent if recent is None else recent))
+
+    def has_in_full(self, message_id: str) -> bool:
+        """Whether message_id is still in the recent window rather than folded into the summary."""
+        return any(entry["id"] == message_id for entry in self.recent)
+
+    def _fold(self) -> None:
+        # Keep at least the latest message in full; that's the one being replied to
+        while len(self.recent) > 1 and (
+            len(self.recent) > self.recent_messages
+            or self._recent_chars() > self.token_budget * CHARS_PER_TOKEN
+        ):
+            entry = self.recent.pop(0)
+            self.summary.append(f"- {entry['from']} ({entry['date']}): {_first_sentences(entry['text']) or '(no text)'}")
+
+    def render(self, until: Optional[str] = None) -> str:
+        """The conversation as prompt text; with `until`, it ends at that message, which must be held in full."""
+        recent = self.recent
+        if until is not None:
+            ids = [entry["id"] for entry in recent]
+            recent = recent[:ids.index(until) + 1]
+        sections = [f"Subject: {self.subject}"]
+        if self.summary:
+            # The summary gets whatever budget the full messages leave, keeping its newest lines
+            budget = max(self.token_budget * CHARS_PER_TOKEN - self._recent_chars(recent), SUMMARY_LINE_CHARS)
+            lines: List[str] = []
+            for line in reversed(self.summary):
+                if lines and sum(len(kept) for kept in lines) + len(line) > budget:
+                    lines.append(f"- ({len(self.summary) - len(lines)} earlier messages omitted)")
+                    break
+                lines.append(line)
+            sections.append("Earlier in this conversation:\n" + '\n'.join(reversed(lines)))
+        for entry in recent:
+            sections.append(
+                f"From: {entry['from']}\nDate: {entry['date']}\n\n"
+                + truncate_to_budget(entry['text'], self.token_budget)
+            )
+        return '\n\n---\n\n'.join(sections)
+
+
+class ThreadContextCache:
+    """LRU of per-thread compacted contexts for drafting.
+
+    A draft for a message already in a context fetched within the last
+    `fresh_seconds` (a redraft, or another tone) needs no Gmail call at all.
+    Otherwise the thread is fetched with one threads.get and only the replies not
+    seen yet are compacted into the existing context, so later replies show up.
+    """
+
+    def __init__(self, gmail_service: GmailService, max_entries: Optional[int] = None,
+                 token_budget: Optional[int] = None, recent_messages: Optional[int] = None,
+                 fresh_seconds: Optional[float] = None):
+        self.gmail_service = gmail_service
+        self.max_entries = max_entries or int(os.getenv('THREAD_CONTEXT_MAX_ENTRIES', '1000'))
+        self.token_budget = token_budget or int(os.getenv('THREAD_CONTEXT_TOKEN_BUDGET', '3000'))
+        self.recent_messages = recent_messages or int(os.getenv('THREAD_CONTEXT_RECENT_MESSAGES', '3'))
+        self.fresh_seconds = fresh_seconds if fresh_seconds is not None else float(
+            os.getenv('THREAD_CONTEXT_FRESH_SECONDS', '120')
+        )
+        self._entries: "OrderedDict[Tuple[str, str], ThreadContext]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fetches = 0
+        self.messages_added = 0
+
+    def thread_of(self, user_email: str, message_id: str) -> Optional[str]:
+        """Thread id of a message already in a cached context, if any."""
+        with self._lock:
+            for (owner, thread_id), context in self._entries.items():
+                if owner == user_email and message_id in context.message_ids:
+                    return thread_id
+        return None
+
+    def get(self, service, user_email: str, thread_id: str, message_id: str) -> Dict[str, Any]:
+        """Rendered context for replying to message_id; fetched or extended only if needed.
+
+        The context ends at message_id, so later replies in the thread never reach the prompt.
+        """
+        key = (user_email, thread_id)
+        with self._lock:
+            context = self._entries.get(key)
+            if context is None:
+                context = ThreadContext(thread_id, self.recent_messages, self.token_budget)
+                self._entries[key] = context
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            self._entries.move_to_end(key)
+
+        with context.lock:
+            if context.has_in_full(message_id) and time.monotonic() - context.fetched_at < self.fresh_seconds:
+                with self._lock:
+                    self.hits += 1
+                return {
+                    "context": context.render(message_id),
+                    "messages": context.message_ids.index(message_id) + 1,
+                    "fetched": False,
+                    "added": 0
+                }
+
+            messages = self.gmail_service.get_thread(service, thread_id)
+            added = context.extend(messages)
+            context.fetched_at = time.monotonic()
+            logger.debug(f"Thread {thread_id}: {added} new of {len(messages)} messages compacted")
+            with self._lock:
+                self.fetches += 1
+                self.messages_added += added
+            if message_id not in context.message_ids:
+                raise ValueError(f"Message {message_id} is not in thread {thread_id}")
+            position = context.message_ids.index(message_id)
+            if context.has_in_full(message_id):
+                rendered = context.render(message_id)
+            else:
+                # Replying to a message already folded into the summary: compact the thread up to it
+                earlier = ThreadContext(thread_id, self.recent_messages, self.token_budget)
+                ids = [message['id'] for message in messages]
+                earlier.extend(messages[:ids.index(message_id) + 1])
+                rendered = earlier.render()
+            return {"context": rendered, "messages": position + 1, "fetched": True, "added": added}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "fetches": self.fetches,
+                "messages_added": self.messages_added
+            }
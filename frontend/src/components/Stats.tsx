@@ -1,10 +1,18 @@
 import React, { useEffect, useState } from 'react';
 import { useAuth } from '../contexts/AuthContext';
 
+interface DailyTrend {
+  day: string;
+  emails_processed: number;
+  moved_to_gator: number;
+  categories: Record<string, { emails_processed: number; moved_to_gator: number }>;
+}
+
 interface Stats {
   total_moved_to_gator: number;
   total_emails_processed: number;
   email: string;
+  trends?: DailyTrend[];
 }
 
 const Stats: React.FC = () => {
@@ -87,6 +95,27 @@ const Stats: React.FC = () => {
         </div>
       </div>
 
+      {stats.trends && stats.trends.length > 0 && (
+        <div className="mt-6">
+          <h3 className="text-lg font-medium text-gray-700 mb-2">Recent Activity</h3>
+          <ul className="divide-y divide-gray-100 text-sm">
+            {stats.trends.map((trend) => (
+              <li key={trend.day} className="flex justify-between py-1">
+                <span className="text-gray-600">{trend.day}</span>
+                <span className="text-gray-500">
+                  {Object.entries(trend.categories)
+                    .map(([category, counts]) => `${category}: ${counts.emails_processed}`)
+                    .join(', ')}
+                </span>
+                <span className="font-medium text-gray-700">
+                  {trend.emails_processed} processed, {trend.moved_to_gator} moved
+                </span>
+              </li>
+            ))}
+          </ul>
+        </div>
+      )}
+
       <div className="mt-4 text-sm text-gray-500">
         Connected Account: <span className="font-medium">{stats.email}</span>
       </div>
@@ -46,6 +46,10 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
 
   const logout = () => {
     logger.debug('Logout initiated');
+    if (accessToken) {
+      // Let the backend drop its cached identity for this token
+      apiService.logout(accessToken);
+    }
     setAccessToken(null);
     setUserEmail(null);
     setTokenExpiry(null);
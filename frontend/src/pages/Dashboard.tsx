@@ -41,6 +41,9 @@ export default function Dashboard() {
       if (statsResponse) {
         setStats(statsResponse);
       }
+
+      // Move low-value inbox mail to Lator Gator without holding up the page
+      triageInbox();
     } catch (error) {
       console.error('Error fetching data:', error);
       if (error.response?.status === 401) {
@@ -54,6 +57,17 @@ export default function Dashboard() {
     }
   };
 
+  const triageInbox = async () => {
+    try {
+      const { moved_count } = await apiService.triageInbox(accessToken);
+      if (moved_count > 0) {
+        setStats(await apiService.getStats(accessToken));
+      }
+    } catch (error) {
+      console.error('Error triaging inbox:', error);
+    }
+  };
+
   useEffect(() => {
     if (!accessToken) {
       console.log('No access token found, redirecting to login');
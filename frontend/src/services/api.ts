@@ -60,10 +60,18 @@ export interface EmailAnalysis {
   action_items: string[];
 }
 
+export interface DailyTrend {
+  day: string;
+  emails_processed: number;
+  moved_to_gator: number;
+  categories: Record<string, { emails_processed: number; moved_to_gator: number }>;
+}
+
 export interface Stats {
   total_moved_to_gator: number;
   total_emails_processed: number;
   email: string;
+  trends?: DailyTrend[];
 }
 
 class ApiService {
@@ -136,6 +144,32 @@ class ApiService {
     }
   }
 
+  async triageInbox(token: string): Promise<{ moved_count: number; moved_ids: string[] }> {
+    try {
+      const response = await api.post('/emails/triage', null, {
+        headers: {
+          'Authorization': `Bearer ${token}`
+        }
+      });
+      return response.data;
+    } catch (error) {
+      console.error('Error triaging inbox:', error);
+      throw error;
+    }
+  }
+
+  async logout(token: string): Promise<void> {
+    try {
+      await api.post('/auth/logout', null, {
+        headers: {
+          'Authorization': `Bearer ${token}`
+        }
+      });
+    } catch (error) {
+      console.error('Error logging out:', error);
+    }
+  }
+
   async analyzeEmail(id: string, token: string): Promise<EmailAnalysis> {
     try {
       const response = await fetch(`${API_BASE_URL}/emails/${id}/analyze`, {